@@ -0,0 +1,298 @@
+'''
+Static asset pipeline.
+
+At startup, build() reads every file under the static directory once,
+fingerprints it with a hash of its contents and precomputes compressed
+variants of the compressible ones.  Relative url() references in stylesheets
+are rewritten to point at fingerprinted urls, so fonts and images pulled in
+by CSS are versioned as well.
+
+Templates link assets with static_url(), which returns a url such as
+/static/css/reset.css?v=<hash>.  StaticAssetHandler serves requests carrying
+the current hash with an immutable, far-future Cache-Control header, and
+picks a precompressed body when the client accepts one.
+
+build(preload=True) additionally keeps the identity body of every asset in
+memory, so requests are answered without touching the filesystem, and
+watch() polls the static directory and rebuilds when a file is added,
+removed or modified.
+'''
+
+import collections
+import datetime
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+import tornado.ioloop
+import tornado.log
+import tornado.web
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_PATH = 'static'
+
+# Asset types worth compressing; everything else (images, woff) is already compressed.
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.html', '.txt', '.json', '.xml', '.svg', '.ttf', '.otf', '.eot'}
+
+# Content encodings we can precompute, in order of preference, with the
+# suffix used for the in-memory key of each variant.
+ENCODINGS = [('gzip', '.gz')]
+if brotli is not None:
+    ENCODINGS.insert(0, ('br', '.br'))
+
+# How often watch() checks the static directory for changes, in milliseconds.
+WATCH_INTERVAL = 1000
+
+CSS_URL_RE = re.compile(rb'''url\(\s*(['"]?)([^'")\s]+)\1\s*\)''')
+
+
+def _compress(encoding, data):
+    if encoding == 'br':
+        return brotli.compress(data)
+    return gzip.compress(data, 9)
+
+
+# Metadata recorded for each source file when it is processed by build().
+_Asset = collections.namedtuple('_Asset', 'mtime size mime_type modified')
+
+
+def _snapshot(root):
+    """Return {abspath: (mtime, size)} for every file under `root`."""
+    snapshot = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            abspath = os.path.join(dirpath, filename)
+            try:
+                st = os.stat(abspath)
+            except OSError:
+                continue
+            snapshot[abspath] = (st.st_mtime_ns, st.st_size)
+    return snapshot
+
+
+def _accepted_encodings(header):
+    """Return the set of content codings listed in an Accept-Encoding header."""
+    accepted = set()
+    for coding in header.split(','):
+        name, _, params = coding.partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+class StaticAssetHandler(tornado.web.StaticFileHandler):
+    """
+    A StaticFileHandler which serves the bodies computed by build().
+
+    Virtual absolute paths (the asset path plus an encoding suffix) name the
+    compressed variants, so the base class' etag and range handling work
+    unchanged on whichever representation is being sent.
+    """
+
+    # Absolute path (or variant key) -> bytes, for bodies that differ from the file on disk.
+    _bodies = {}
+    # Absolute path -> {encoding: variant key}.
+    _variants = {}
+    # Absolute path -> _Asset.
+    _assets = {}
+    # Keys this class added to _static_hashes in the last build.
+    _versions = {}
+    # Arguments of the last build, reused when watch() rebuilds.
+    _root = None
+    _preload = False
+
+    @classmethod
+    def build(cls, root=STATIC_PATH, preload=False):
+        """
+        Fingerprint and precompress every asset under `root`.
+
+        With `preload`, the unmodified body of every asset is kept in memory
+        too.  Returns the number of assets processed.
+        """
+
+        root = os.path.abspath(root)
+        versions = {}
+        bodies = {}
+        variants = {}
+        assets = {}
+
+        def rewrite_css(abspath, data):
+            def replace(match):
+                quote, target = match.groups()
+                if b':' in target or target.startswith((b'/', b'#')):
+                    return match.group(0)
+                target, hash_mark, fragment = target.partition(b'#')
+                target, _, query = target.partition(b'?')
+                if query:
+                    return match.group(0)
+                dep = os.path.normpath(os.path.join(os.path.dirname(abspath), os.fsdecode(target)))
+                if not dep.startswith(root + os.path.sep) or not os.path.isfile(dep):
+                    return match.group(0)
+                version = process(dep)
+                if version is None:
+                    return match.group(0)
+                url = target + b'?v=' + version.encode() + hash_mark + fragment
+                return b'url(' + quote + url + quote + b')'
+
+            return CSS_URL_RE.sub(replace, data)
+
+        def process(abspath):
+            if abspath in versions:
+                # None marks an asset whose processing is still in progress (an import cycle).
+                return versions[abspath]
+            versions[abspath] = None
+            with open(abspath, 'rb') as f:
+                st = os.fstat(f.fileno())
+                data = f.read()
+            mime_type, encoding = mimetypes.guess_type(abspath)
+            modified = datetime.datetime.utcfromtimestamp(int(st.st_mtime))
+            assets[abspath] = _Asset(st.st_mtime_ns, st.st_size, mime_type, modified)
+            if abspath.endswith('.css'):
+                rewritten = rewrite_css(abspath, data)
+                if rewritten != data:
+                    bodies[abspath] = data = rewritten
+            if preload:
+                bodies[abspath] = data
+
+            if os.path.splitext(abspath)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                for encoding, suffix in ENCODINGS:
+                    compressed = _compress(encoding, data)
+                    if len(compressed) < len(data):
+                        key = abspath + suffix
+                        bodies[key] = compressed
+                        versions[key] = hashlib.md5(compressed).hexdigest()
+                        variants.setdefault(abspath, {})[encoding] = key
+
+            versions[abspath] = hashlib.md5(data).hexdigest()
+            return versions[abspath]
+
+        count = 0
+        for dirpath, dirnames, filenames in os.walk(root):
+            for filename in filenames:
+                process(os.path.join(dirpath, filename))
+                count += 1
+
+        with cls._lock:
+            cls._bodies = bodies
+            cls._variants = variants
+            cls._assets = assets
+            for key in cls._versions:
+                cls._static_hashes.pop(key, None)
+            cls._static_hashes.update(versions)
+            cls._versions = versions
+            cls._root = root
+            cls._preload = preload
+        return count
+
+    @classmethod
+    def changed(cls):
+        """Return True if the files under the built root differ from the last build."""
+        if cls._root is None:
+            return False
+        built = {abspath: (asset.mtime, asset.size) for abspath, asset in cls._assets.items()}
+        return _snapshot(cls._root) != built
+
+    @classmethod
+    def refresh(cls):
+        """Rebuild the assets if any of them changed on disk."""
+        if cls.changed():
+            tornado.log.app_log.info('Static assets changed, rebuilding %s', cls._root)
+            cls.build(cls._root, preload=cls._preload)
+
+    @classmethod
+    def get_content(cls, abspath, start=None, end=None):
+        body = cls._bodies.get(abspath)
+        if body is None:
+            return super().get_content(abspath, start, end)
+        return body[start:end]
+
+    @classmethod
+    def get_content_file(cls, abspath):
+        if abspath in cls._bodies:
+            return None
+        return open(abspath, 'rb')
+
+    def validate_absolute_path(self, root, absolute_path):
+        # A source file build() found under the root whose body is held in
+        # memory needs no filesystem checks.  Anything else, including the
+        # keys of the compressed variants, must be a file on disk.
+        if absolute_path not in self._assets or absolute_path not in self._bodies:
+            absolute_path = super().validate_absolute_path(root, absolute_path)
+            if absolute_path is None:
+                return None
+        self.source_path = absolute_path
+        self.encoding = None
+        variants = self._variants.get(absolute_path)
+        if variants:
+            accepted = _accepted_encodings(self.request.headers.get('Accept-Encoding', ''))
+            for encoding, suffix in ENCODINGS:
+                if encoding in accepted and encoding in variants:
+                    self.encoding = encoding
+                    return variants[encoding]
+        return absolute_path
+
+    def get_content_size(self):
+        body = self._bodies.get(self.absolute_path)
+        if body is None:
+            return super().get_content_size()
+        return len(body)
+
+    def get_modified_time(self):
+        asset = self._assets.get(self.source_path)
+        if asset is None:
+            return datetime.datetime.utcfromtimestamp(int(os.stat(self.source_path).st_mtime))
+        return asset.modified
+
+    def get_content_type(self):
+        asset = self._assets.get(self.source_path)
+        if asset is None:
+            mime_type, encoding = mimetypes.guess_type(self.source_path)
+            return mime_type
+        return asset.mime_type
+
+    def get_cache_time(self, path, modified, mime_type):
+        # Only a url carrying the current fingerprint may be cached forever;
+        # a stale ?v= must not pin the new content under the old url.
+        version = self.get_argument('v', None)
+        if version and version == self._get_cached_version(self.source_path):
+            return self.CACHE_MAX_AGE
+        return 0
+
+    def set_extra_headers(self, path):
+        if self.source_path in self._variants:
+            self.set_header('Vary', 'Accept-Encoding')
+        if self.encoding:
+            self.set_header('Content-Encoding', self.encoding)
+        if self.get_cache_time(path, self.modified, None):
+            self.set_header('Cache-Control', 'public, max-age={}, immutable'.format(self.CACHE_MAX_AGE))
+
+
+def build(root=STATIC_PATH, preload=False):
+    """Run the asset pipeline over `root`.  Call once at server startup."""
+    return StaticAssetHandler.build(root, preload)
+
+
+def watch(interval=WATCH_INTERVAL, io_loop=None):
+    """
+    Rebuild the assets whenever a file under the static directory changes.
+
+    Returns the started PeriodicCallback.
+    """
+    callback = tornado.ioloop.PeriodicCallback(StaticAssetHandler.refresh, interval, io_loop)
+    callback.start()
+    return callback
+
+
+def static_url(path):
+    """
+    Return the fingerprinted url of a static asset, given relative to the
+    static directory, e.g. static_url('css/reset.css').
+    """
+    return StaticAssetHandler.make_static_url({'static_path': STATIC_PATH}, path)
@@ -0,0 +1,409 @@
+'''
+Caches for objects loaded from the database: in-process ones, and
+SharedCache, which is shared by the processes that open the same file.
+'''
+
+import collections
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__all__ = ['LRUCache', 'TableCache', 'SharedCache']
+
+# A SharedCache item can go in any of this many slots, chosen by its key.
+SHARED_CACHE_WAYS = 8
+
+
+class LRUCache(object):
+    """
+    A mapping that holds at most `max_size` items, dropping the least
+    recently used item to make room for a new one.  If `ttl` is given, items
+    that have not been used for `ttl` seconds are dropped too.
+
+    The cache does no locking; it is meant for the single-threaded server.
+
+    >>> cache = LRUCache(2)
+    >>> cache.put('a', 1)
+    >>> cache.put('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.put('c', 3)
+    >>> 'b' in cache, len(cache)
+    (False, 2)
+    >>> cache.get('b', 'missing')
+    'missing'
+    >>> cache.pop('a')
+    1
+    >>> list(cache)
+    ['c']
+
+    >>> now = [0]
+    >>> cache = LRUCache(10, ttl=60, timer=lambda: now[0])
+    >>> cache.put('a', 1)
+    >>> now[0] = 59
+    >>> cache.get('a')
+    1
+    >>> now[0] = 119
+    >>> cache.get('a')
+    1
+    >>> now[0] = 180
+    >>> cache.get('a') is None
+    True
+    """
+
+    def __init__(self, max_size, ttl=None, timer=time.monotonic):
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+        self.max_size = max_size
+        self.ttl = ttl
+        self.timer = timer
+        # Key -> (value, time last used), least recently used first.
+        self._items = collections.OrderedDict()
+
+    def __len__(self):
+        self.expire()
+        return len(self._items)
+
+    def __contains__(self, key):
+        return self._get_entry(key) is not None
+
+    def __iter__(self):
+        self.expire()
+        return iter(list(self._items))
+
+    def _get_entry(self, key):
+        entry = self._items.get(key)
+        if entry is not None and self.ttl is not None and self.timer() - entry[1] > self.ttl:
+            del self._items[key]
+            return None
+        return entry
+
+    def get(self, key, default=None):
+        """Return the value for `key` and mark it as used, or `default`."""
+        entry = self._get_entry(key)
+        if entry is None:
+            return default
+        self._items[key] = (entry[0], self.timer())
+        self._items.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value):
+        """Add or replace the value for `key`, dropping old items if the cache is full."""
+        self._items.pop(key, None)
+        self._items[key] = (value, self.timer())
+        self.expire()
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Remove `key` from the cache, returning its value or `default`."""
+        entry = self._items.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        self._items.clear()
+
+    def expire(self):
+        """Drop the items that have not been used for `ttl` seconds."""
+        if self.ttl is None:
+            return
+        cutoff = self.timer() - self.ttl
+        # Items are in order of use, so the expired ones are all at the front.
+        while self._items:
+            key, (value, used) = next(iter(self._items.items()))
+            if used >= cutoff:
+                break
+            del self._items[key]
+
+
+class TableCache(object):
+    """
+    Holds all the rows of a small table that is rarely written, read
+    through from `load` the first time they are wanted and again after
+    each invalidate().  `load(limit)` returns at most `limit` rows.  A
+    table of more than `max_size` rows is not kept, and get() returns None
+    until the next invalidate(), so callers read from the database instead.
+
+    `hits` counts the calls of get() answered from the cache, and `misses`
+    the rest.
+
+    >>> loads = []
+    >>> def load(limit):
+    ...     loads.append(limit)
+    ...     return ['a', 'b']
+    >>> cache = TableCache(load, 10)
+    >>> cache.get(), cache.get()
+    (('a', 'b'), ('a', 'b'))
+    >>> cache.invalidate()
+    >>> cache.get()
+    ('a', 'b')
+    >>> loads, cache.stats()
+    ([11, 11], {'hits': 1, 'misses': 2, 'rows': 2})
+    >>> cache = TableCache(load, 1)
+    >>> cache.get() is None, cache.get() is None, loads
+    (True, True, [11, 11, 2])
+    """
+
+    def __init__(self, load, max_size):
+        self.load = load
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._rows = None
+        self._loaded = False
+
+    def get(self):
+        """Return a tuple of all the rows, or None if the table is too big to keep."""
+        if self._rows is not None:
+            self.hits += 1
+            return self._rows
+        self.misses += 1
+        if not self._loaded:
+            rows = tuple(self.load(self.max_size + 1))
+            self._rows = rows if len(rows) <= self.max_size else None
+            self._loaded = True
+        return self._rows
+
+    def invalidate(self):
+        """Drop the rows, so they are loaded again when next wanted."""
+        self._rows = None
+        self._loaded = False
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'rows': 0 if self._rows is None else len(self._rows)}
+
+
+class SharedCache(object):
+    """
+    A cache with the interface of LRUCache, kept in a file mapped into
+    memory, so that all the processes that open the same file share its
+    items.  Keys and values are pickled, so only processes that trust each
+    other should share a file; it is created readable by its owner only.
+
+    The file holds a fixed number of slots of `slot_size` bytes, at least
+    `max_size`, in sets of SHARED_CACHE_WAYS.  A hash of an item's key
+    picks its set, and a new item replaces the least recently used item of
+    its set, so items are dropped a little before the cache is full.  Items
+    too big for a slot are not kept.  If `ttl` is given, items that have not
+    been used for `ttl` seconds (by any process) are dropped too.
+
+    Readers take no lock.  Each slot has a sequence number that a writer
+    makes odd while it changes the slot, so a reader that finds it odd, or
+    changed after reading, takes the item to be missing.  Writers lock the
+    whole file.  Needs fcntl, so it doesn't work on Windows.
+
+    A file laid out for a different `max_size` or `slot_size` is refused
+    with a ValueError rather than cleared, as other processes may still be
+    using it; remove it, or use another path, to change the layout.
+
+    >>> import shutil, tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> path = os.path.join(directory, 'cache')
+    >>> cache = SharedCache(path, 8, slot_size=256)
+    >>> cache.put('a', [1, 2])
+    >>> other = SharedCache(path, 8, slot_size=256)
+    >>> other.get('a'), 'a' in other, other.get('b', 'missing')
+    ([1, 2], True, 'missing')
+    >>> for key in 'bcdefgh':
+    ...     cache.put(key, key.upper())
+    >>> cache.get('a')
+    [1, 2]
+    >>> cache.put('i', 'I')
+    >>> 'b' in other, len(other), sorted(other)[:3]
+    (False, 8, ['a', 'c', 'd'])
+    >>> cache.put('big', 'x' * 1000)
+    >>> 'big' in cache
+    False
+    >>> other.pop('a'), cache.get('a')
+    ([1, 2], None)
+    >>> cache.clear()
+    >>> len(other)
+    0
+    >>> SharedCache(path, 8, slot_size=512)  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+      ...
+    ValueError: ... is laid out for a different shared cache
+    >>> cache.close(); other.close(); shutil.rmtree(directory)
+    """
+
+    MAGIC = b'QZSC'
+    # Magic, format version, number of slots, slot size.
+    HEADER = struct.Struct('<4sIII')
+    HEADER_SIZE = 64
+    # Sequence number, key hash, time last used, key length, value length.
+    SLOT = struct.Struct('<QQdII')
+    VERSION = 1
+
+    def __init__(self, path, max_size, slot_size=4096, ttl=None, timer=time.time):
+        if fcntl is None:
+            raise RuntimeError('a shared cache needs fcntl')
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+        if slot_size <= self.SLOT.size:
+            raise ValueError('slot_size must be more than {}'.format(self.SLOT.size))
+        self.max_size = max_size
+        self.ttl = ttl
+        self.timer = timer
+        self.slot_size = slot_size
+        self.slots = -(-max_size // SHARED_CACHE_WAYS) * SHARED_CACHE_WAYS
+        size = self.HEADER_SIZE + self.slots * slot_size
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        header = self.HEADER.pack(self.MAGIC, self.VERSION, self.slots, slot_size)
+        with self._locked():
+            existing = os.pread(self._fd, self.HEADER.size, 0)
+            if not existing:
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, header, 0)
+        if existing and existing != header:
+            os.close(self._fd)
+            raise ValueError('{!r} is laid out for a different shared cache'.format(path))
+        self._map = mmap.mmap(self._fd, size)
+
+    def _locked(self):
+        return _FileLock(self._fd)
+
+    @staticmethod
+    def _key_bytes(key):
+        return pickle.dumps(key, pickle.HIGHEST_PROTOCOL)
+
+    def _set(self, key_bytes):
+        """Returns the key's hash and the offsets of the slots it may be in."""
+        # Python's hash() differs between processes, so it can't be used.
+        key_hash = int.from_bytes(hashlib.blake2b(key_bytes, digest_size=8).digest(), 'little')
+        first = key_hash % (self.slots // SHARED_CACHE_WAYS) * SHARED_CACHE_WAYS
+        return key_hash, [self.HEADER_SIZE + (first + i) * self.slot_size for i in range(SHARED_CACHE_WAYS)]
+
+    def _read(self, offset):
+        """
+        Returns the (key hash, time last used, key bytes, value bytes) in a
+        slot, or None if it is empty or being written.
+        """
+
+        seq, key_hash, used, key_length, value_length = self.SLOT.unpack_from(self._map, offset)
+        if seq & 1 or not key_length:
+            return None
+        start = offset + self.SLOT.size
+        data = self._map[start:start + key_length + value_length]
+        if self.SLOT.unpack_from(self._map, offset)[0] != seq:
+            return None
+        return key_hash, used, data[:key_length], data[key_length:]
+
+    def _expired(self, used):
+        return self.ttl is not None and self.timer() - used > self.ttl
+
+    def _find(self, key_bytes):
+        """Returns the offset of the key's slot and its value bytes, or (None, None)."""
+        key_hash, offsets = self._set(key_bytes)
+        for offset in offsets:
+            entry = self._read(offset)
+            if entry is not None and entry[0] == key_hash and entry[2] == key_bytes and not self._expired(entry[1]):
+                return offset, entry[3]
+        return None, None
+
+    def _write(self, offset, key_hash=0, key_bytes=b'', value_bytes=b''):
+        """Fill or (with no key) empty a slot.  The caller holds the lock."""
+        seq = self.SLOT.unpack_from(self._map, offset)[0]
+        struct.pack_into('<Q', self._map, offset, seq + 1)
+        start = offset + self.SLOT.size
+        self._map[start:start + len(key_bytes) + len(value_bytes)] = key_bytes + value_bytes
+        self.SLOT.pack_into(self._map, offset, seq + 1, key_hash, self.timer(), len(key_bytes), len(value_bytes))
+        struct.pack_into('<Q', self._map, offset, seq + 2)
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __contains__(self, key):
+        return self._find(self._key_bytes(key))[0] is not None
+
+    def __iter__(self):
+        keys = []
+        for offset in range(self.HEADER_SIZE, self.HEADER_SIZE + self.slots * self.slot_size, self.slot_size):
+            entry = self._read(offset)
+            if entry is not None and not self._expired(entry[1]):
+                keys.append(pickle.loads(entry[2]))
+        return iter(keys)
+
+    def get(self, key, default=None):
+        """Return the value for `key` and mark it as used, or `default`."""
+        offset, value_bytes = self._find(self._key_bytes(key))
+        if offset is None:
+            return default
+        # Not locked: at worst another item's time is changed, if the slot
+        # was just refilled.
+        struct.pack_into('<d', self._map, offset + 16, self.timer())
+        return pickle.loads(value_bytes)
+
+    def put(self, key, value):
+        """Add or replace the value for `key`, dropping an old item if its set is full."""
+        key_bytes = self._key_bytes(key)
+        value_bytes = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        too_big = self.SLOT.size + len(key_bytes) + len(value_bytes) > self.slot_size
+        key_hash, offsets = self._set(key_bytes)
+        with self._locked():
+            offset = self._find(key_bytes)[0]
+            if too_big:
+                # Don't leave an old value behind for the key.
+                if offset is not None:
+                    self._write(offset)
+                return
+            if offset is None:
+                # An empty or expired slot, or else the least recently used.
+                entries = [(self._read(offset), offset) for offset in offsets]
+                offset = min(entries, key=lambda entry: -1 if entry[0] is None or self._expired(entry[0][1]) else entry[0][1])[1]
+            self._write(offset, key_hash, key_bytes, value_bytes)
+
+    def pop(self, key, default=None):
+        """Remove `key` from the cache, returning its value or `default`."""
+        with self._locked():
+            offset, value_bytes = self._find(self._key_bytes(key))
+            if offset is None:
+                return default
+            self._write(offset)
+        return pickle.loads(value_bytes)
+
+    def clear(self):
+        with self._locked():
+            for offset in range(self.HEADER_SIZE, self.HEADER_SIZE + self.slots * self.slot_size, self.slot_size):
+                if self.SLOT.unpack_from(self._map, offset)[3]:
+                    self._write(offset)
+
+    def expire(self):
+        """Drop the items that have not been used for `ttl` seconds."""
+        if self.ttl is None:
+            return
+        with self._locked():
+            for offset in range(self.HEADER_SIZE, self.HEADER_SIZE + self.slots * self.slot_size, self.slot_size):
+                entry = self._read(offset)
+                if entry is not None and self._expired(entry[1]):
+                    self._write(offset)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class _FileLock(object):
+    """An exclusive lock on an open file, for use in a with statement."""
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    def __enter__(self):
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -11,6 +11,9 @@ cur.execute("""DROP TABLE IF EXISTS answers""")
 cur.execute("""DROP TABLE IF EXISTS flags""")
 cur.execute("""DROP TABLE IF EXISTS scores""")
 cur.execute("""DROP TABLE IF EXISTS games""")
+cur.execute("""DROP TABLE IF EXISTS questions_search""")
+cur.execute("""DROP TABLE IF EXISTS user_ratings""")
+cur.execute("""DROP TABLE IF EXISTS question_ratings""")
 
 conn.commit()
 
@@ -50,11 +53,22 @@ cur.execute("""CREATE TABLE IF NOT EXISTS flags(
     FOREIGN KEY (question_id) REFERENCES questions (question_id)
     );""")
 
+# A user's answers in a category, kept up to date as they answer, and split
+# by the difficulty band of the question (0, 1 and 2).  rebuild_scores.py
+# recomputes it from questionresults.
 cur.execute("""CREATE TABLE IF NOT EXISTS scores(
     user_id INTEGER NOT NULL,
     category_id INTEGER NOT NULL,
     num_answered INTEGER NOT NULL,
     num_correct INTEGER NOT NULL,
+    streak INTEGER NOT NULL DEFAULT 0,
+    best_streak INTEGER NOT NULL DEFAULT 0,
+    easy_answered INTEGER NOT NULL DEFAULT 0,
+    easy_correct INTEGER NOT NULL DEFAULT 0,
+    medium_answered INTEGER NOT NULL DEFAULT 0,
+    medium_correct INTEGER NOT NULL DEFAULT 0,
+    hard_answered INTEGER NOT NULL DEFAULT 0,
+    hard_correct INTEGER NOT NULL DEFAULT 0,
     PRIMARY KEY(user_id, category_id),
     FOREIGN KEY (user_id) REFERENCES users (user_id),
     FOREIGN KEY (category_id) REFERENCES categories (category_id)
@@ -87,7 +101,92 @@ cur.execute("""CREATE TABLE IF NOT EXISTS questionresults(
     FOREIGN KEY (answer_id) REFERENCES answers (answer_id)
     );""")
 
+# Ratings of how good users are and how hard questions are (see ratings.py).
+cur.execute("""CREATE TABLE IF NOT EXISTS user_ratings(
+    user_id INTEGER PRIMARY KEY,
+    rating REAL NOT NULL,
+    answered INTEGER NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users (user_id)
+    );""")
+
+cur.execute("""CREATE TABLE IF NOT EXISTS question_ratings(
+    question_id INTEGER PRIMARY KEY,
+    rating REAL NOT NULL,
+    answered INTEGER NOT NULL,
+    FOREIGN KEY (question_id) REFERENCES questions (question_id)
+    );""")
+
+# Indexes for listing a category's questions and a user's games a page at a
+# time (see Model.find_page()); each also ends with the table's rowid.  The
+# category page shows only the question text, so with it in the index the
+# pages are read from the index alone.
+cur.execute("""DROP INDEX IF EXISTS questions_category;""")
+cur.execute("""CREATE INDEX IF NOT EXISTS questions_category_page ON questions(category, question_id, question);""")
+cur.execute("""CREATE INDEX IF NOT EXISTS games_user ON games(user_id);""")
+
+# Logging in looks users up by name; with the rowid in the index, finding
+# just a user's id by name never reads the users table.
+cur.execute("""CREATE INDEX IF NOT EXISTS users_username ON users(username);""")
 
+# Full-text index of the questions and their answers, for Question.search().
+# The rowid is the question_id, and the answers column holds all of the
+# question's answers.  The triggers keep it up to date; the question counters
+# are updated on every answer, so they don't touch the index.
+cur.executescript("""CREATE VIRTUAL TABLE IF NOT EXISTS questions_search USING fts5(
+    question,
+    answers,
+    tokenize = 'porter unicode61'
+    );
+
+CREATE TRIGGER questions_search_insert AFTER INSERT ON questions BEGIN
+    INSERT INTO questions_search(rowid, question, answers)
+    VALUES (new.question_id, new.question,
+            (SELECT coalesce(group_concat(answer_text, ' '), '') FROM answers WHERE question_id = new.question_id));
+END;
+
+CREATE TRIGGER questions_search_update AFTER UPDATE OF question ON questions BEGIN
+    UPDATE questions_search SET question = new.question WHERE rowid = new.question_id;
+END;
+
+CREATE TRIGGER questions_search_delete AFTER DELETE ON questions BEGIN
+    DELETE FROM questions_search WHERE rowid = old.question_id;
+END;
+
+CREATE TRIGGER answers_search_insert AFTER INSERT ON answers BEGIN
+    UPDATE questions_search
+    SET answers = (SELECT group_concat(answer_text, ' ') FROM answers WHERE question_id = new.question_id)
+    WHERE rowid = new.question_id;
+END;
+
+CREATE TRIGGER answers_search_update AFTER UPDATE OF question_id, answer_text ON answers BEGIN
+    UPDATE questions_search
+    SET answers = (SELECT coalesce(group_concat(answer_text, ' '), '') FROM answers WHERE question_id = questions_search.rowid)
+    WHERE rowid IN (old.question_id, new.question_id);
+END;
+
+CREATE TRIGGER answers_search_delete AFTER DELETE ON answers BEGIN
+    UPDATE questions_search
+    SET answers = (SELECT coalesce(group_concat(answer_text, ' '), '') FROM answers WHERE question_id = old.question_id)
+    WHERE rowid = old.question_id;
+END;
+""")
+
+# A count of the changes to each table that other processes cache, which the
+# triggers keep, so a process can tell which of its caches another process's
+# writes have made stale (see versions.py).  Only the question columns the
+# caches use count, as the answer counters change on every answer, and only
+# the game columns that say which question a game is on.
+cur.execute("""CREATE TABLE IF NOT EXISTS table_versions(
+    table_name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+    );""")
 
+for table, update_columns in (('categories', ''), ('questions', ' OF question, category, difficulty'), ('answers', ''),
+                              ('games', ' OF question_index, time_completed')):
+    cur.execute("""INSERT OR IGNORE INTO table_versions VALUES(?, 0);""", (table,))
+    for action in ('INSERT', 'UPDATE' + update_columns, 'DELETE'):
+        cur.execute("""CREATE TRIGGER IF NOT EXISTS {0}_version_{1} AFTER {2} ON {0} BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE table_name = '{0}';
+END;""".format(table, action.split()[0].lower(), action))
 
 conn.commit()
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+
+'''
+Publish a question bank (see question_bank.py) of everything in the
+database, for servers started with --question-bank to read questions from.
+Servers already running swap to the new bank by themselves.  Run it from the
+top of the repository:
+
+    $ python3 -m db.export_questions [bank file]
+'''
+
+import sqlite3
+import sys
+import time
+
+from . import question_bank
+
+# Where the bank is published unless another file is given.
+DEFAULT_PATH = 'db/questions.bank'
+
+path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_PATH
+conn = sqlite3.connect('db/trivia.db')
+start = time.time()
+version = question_bank.export(conn, path)
+bank = question_bank.QuestionBank(path)
+print('Published {} questions to {} (data version {}) in {:.1f}s'.format(len(bank), path, version, time.time() - start))
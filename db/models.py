@@ -22,17 +22,124 @@
 Provides an interface to the database.
 '''
 
+import collections
+import difflib
+import json
+import logging
+import re
 import sqlite3
 import random
 import time
 
 from . import hasher
+from . import question_bank
+from . import ratings
+from . import selection
+from . import versions
+from .cache import LRUCache, TableCache
 
-__all__ = ['User', 'Question', 'Category', 'Flag', 'Answer', 'Score', 'QuestionResult', 'Game']
+__all__ = ['User', 'Question', 'Category', 'Flag', 'Answer', 'Score', 'QuestionResult', 'Game', 'Change', 'StaleGameError']
+
+# Text that SQLite and int() both read as the same integer.
+_INTEGER = re.compile(r'[+-]?[0-9]+')
+
+# The functions Model.aggregate() and Model.group_by() accept.
+AGGREGATES = ('count', 'sum', 'total', 'avg', 'min', 'max')
+
+# The most games Game.find_active() keeps in memory, and how many seconds a
+# game may go without being played before it is dropped.
+ACTIVE_GAMES_MAX = 1000
+ACTIVE_GAME_TTL = 30 * 60
+
+# The most categories kept in memory by Category's table cache.
+CATEGORY_CACHE_SIZE = 1000
+
+# A change made to a row, as passed to the hooks added with Model.add_hook():
+# the action ('insert', 'update' or 'delete'), the Model class, the key of the
+# row (see Model._key), and the names of the fields that were set, or None for
+# a delete.
+Change = collections.namedtuple('Change', 'action model key fields')
+
+# Model class -> the hooks added for it.
+_hooks = {}
+
+# The changes made since the last commit, in order.
+_pending = []
+
+
+class StaleGameError(Exception):
+    """Raised when an answer is for a question the game has already moved past."""
+    pass
+
+
+class Connection(sqlite3.Connection):
+    """
+    The connection the models use, which passes the changes made in a
+    transaction to the hooks once conn.commit() has committed them, and
+    forgets them if it is rolled back.  (Committing by using the connection
+    as a context manager doesn't call commit(), so the changes wait for the
+    next commit.)
+    """
+
+    def commit(self):
+        super().commit()
+        versions.committed(self)
+        _deliver_changes()
+
+    def rollback(self):
+        super().rollback()
+        del _pending[:]
+
+
+def _deliver_changes():
+    """Internal use: pass the pending changes to the hooks that want them."""
+    if not _pending:
+        return
+    # Hooks may make and commit changes of their own, which are delivered by
+    # that commit.
+    changes = list(_pending)
+    del _pending[:]
+    for model, hooks in list(_hooks.items()):
+        wanted = [change for change in changes if issubclass(change.model, model)]
+        if not wanted:
+            continue
+        for hook in list(hooks):
+            # The changes are committed whatever a hook does, so a broken
+            # hook is logged rather than failing the request that committed.
+            try:
+                hook(wanted)
+            except Exception:
+                logging.getLogger(__name__).exception('Error in change hook %r', hook)
 
 
 class Model(object):
-    """Base class for models defined in this module."""
+    """
+    Base class for models defined in this module.
+
+    Models have __slots__ rather than a __dict__ to keep them small.  Each
+    model lists its properties that come from its table's columns in
+    `_fields`, and those columns in `_columns`, in the order its __init__
+    takes them.
+
+    The find* methods take a `fields` argument, a sequence of property names.
+    If it is given, only those columns are read, and they are returned as
+    namedtuple records rather than Models.
+
+    Caches and other derived data can keep up with changes to the models by
+    adding a hook with Model.add_hook(), which is called after each commit.
+
+    Models of small tables that are rarely written can be given a
+    TableCache as `_table_cache`, from which Model.find(), find_all() and
+    find_iter() are answered without querying the database.  The cached
+    Models are shared, so they are made read-only.
+    """
+
+    __slots__ = ()
+    _fields = ()
+    _columns = ()
+    # The fields that identify a row.
+    _key = ('id',)
+    _table_cache = None
 
     def __init__(self):
         raise NotImplementedError()
@@ -53,7 +160,160 @@ class Model(object):
         return cls.__name__.lower() + '_id'
 
     @classmethod
-    def _query(cls, action, single=True, _iter=False, **kwargs):
+    def add_hook(cls, hook):
+        """
+        Call `hook(changes)` after each commit that changed rows of this
+        model (or of any model, if added to Model), with a list of the
+        Changes made, in order.  The hook is returned, so this can be used
+        as a decorator.
+
+        Changes made with the models' methods are reported, but not changes
+        made with SQL of other modules.  An upsert is reported as an update.
+
+        >>> changes = []
+        >>> hook = Flag.add_hook(changes.extend)
+        >>> flag = Flag.create(1)
+        >>> changes == [Change('insert', Flag, flag.id, ('id', 'question_id'))]
+        True
+        >>> flag.delete()
+        >>> changes[1:]
+        []
+        >>> conn.commit()
+        >>> changes[1] == Change('delete', Flag, flag.id, None)
+        True
+        >>> Flag.remove_hook(hook)
+        """
+
+        _hooks.setdefault(cls, []).append(hook)
+        return hook
+
+    @classmethod
+    def remove_hook(cls, hook):
+        """Stop calling a hook added with Model.add_hook()."""
+        _hooks[cls].remove(hook)
+
+    @classmethod
+    def _changed(cls, action, key, fields=None):
+        """
+        Internal use: record a change to the row with `key`, to be passed to
+        the hooks when it is committed.
+        """
+
+        if fields is None and action == 'insert':
+            fields = cls._fields
+        _pending.append(Change(action, cls, key, None if fields is None else tuple(fields)))
+
+    @classmethod
+    def _key_of(cls, row):
+        """Internal use: returns the key of a Model or record."""
+        if len(cls._key) == 1:
+            return getattr(row, cls._key[0])
+        return tuple(getattr(row, field) for field in cls._key)
+
+    @classmethod
+    def _conditions(cls, kwargs):
+        """Internal use: returns a `field = ?` condition for each keyword argument."""
+        return [(cls._id_field() if key == 'id' else key) + ' = ?' for key in kwargs]
+
+    @classmethod
+    def _load_table(cls, limit):
+        """Internal use: returns up to `limit` read-only Models of the table, for its TableCache."""
+        models = conn.execute('{} FROM {} ORDER BY rowid LIMIT ?'.format(cls._select()[0], cls._table_name()), (limit,)).fetchall()
+        models = [cls(*row) for row in models]
+        for model in models:
+            model._freeze()
+        return models
+
+    def _freeze(self):
+        """
+        Internal use: make a Model read-only.  Models with a table cache
+        have a `_frozen` slot and a __setattr__ that checks it.
+        """
+
+        object.__setattr__(self, '_frozen', True)
+
+    @classmethod
+    def _find_cached(cls, fields, kwargs):
+        """
+        Internal use: returns the Models (or records of `fields`) that match
+        the criteria from the model's table cache, or None if they must be
+        read from the database.
+        """
+
+        if cls._table_cache is None:
+            return None
+        names = dict(zip(cls._columns, cls._fields))
+        names.update(zip(cls._fields, cls._fields))
+        if not all(key in names for key in kwargs):
+            return None
+        if fields is not None:
+            fields = tuple(fields)
+            for field in fields:
+                if field not in cls._fields:
+                    raise ValueError('{} has no field {!r}'.format(cls.__name__, field))
+        versions.check(conn)
+        models = cls._table_cache.get()
+        if models is None:
+            return None
+
+        criteria = []
+        for key, value in kwargs.items():
+            # Plain integers in text match integer columns, as in SQLite.
+            if isinstance(value, str) and _INTEGER.fullmatch(value):
+                value = int(value)
+            criteria.append((names[key], value))
+        found = []
+        for model in models:
+            for field, value in criteria:
+                stored = getattr(model, field)
+                if stored == value:
+                    continue
+                # SQLite converts between text and numbers by the column's
+                # type, and `= NULL` matches nothing, so those comparisons
+                # are left to the database.
+                if value is None or (stored is not None and isinstance(stored, str) != isinstance(value, str)):
+                    return None
+                break
+            else:
+                found.append(model)
+        if fields is not None:
+            make = cls._record_type(fields)._make
+            found = [make(getattr(model, field) for field in fields) for model in found]
+        return found
+
+    @classmethod
+    def _record_type(cls, fields):
+        """Internal use: returns the namedtuple type of records of `fields`."""
+        if '_records' not in cls.__dict__:
+            cls._records = {}
+        record = cls._records.get(fields)
+        if record is None:
+            record = cls._records[fields] = collections.namedtuple(cls.__name__ + 'Record', fields)
+        return record
+
+    @classmethod
+    def _select(cls, fields=None):
+        """
+        Internal use: returns the `SELECT columns` action for `fields`, or
+        for all of the model's fields if None, and a row_factory that builds
+        a Model, or a record of just those fields, from each row.
+
+        >>> Answer._select(('id', 'text'))[0]
+        'SELECT answer_id, answer_text'
+        """
+
+        if fields is None:
+            return 'SELECT ' + ', '.join(cls._columns), lambda cursor, row: cls(*row)
+        columns = dict(zip(cls._fields, cls._columns))
+        fields = tuple(fields)
+        for field in fields:
+            if field not in columns:
+                raise ValueError('{} has no field {!r}'.format(cls.__name__, field))
+        make = cls._record_type(fields)._make
+        return 'SELECT ' + ', '.join(columns[field] for field in fields), lambda cursor, row: make(row)
+
+    @classmethod
+    def _query(cls, action, single=True, _iter=False, _row_factory=None, **kwargs):
         """
         Execute a query against the class' database table (given by
         `cls._table_name()`) of a specified action (e.g. `SELECT columns`,
@@ -74,6 +334,9 @@ class Model(object):
 
         :param _iter: If True, return an iterator of rows.
 
+        :param _row_factory: If given, the row_factory used to build rows
+            in place of sqlite3.Row.
+
         >>> Question._query("SELECT question", question_id=1)['question'] == Question._query("SELECT question", id=1)['question']
         True
         >>> User._query("SELECT email", username='awesomealex')['email']
@@ -82,10 +345,12 @@ class Model(object):
 
         query = '{0} FROM {1}'.format(action, cls._table_name())
         if kwargs:
-            query += ' WHERE ' + ' AND '.join((cls._id_field() if key == 'id' else key) + ' = ?' for key in kwargs)
+            query += ' WHERE ' + ' AND '.join(cls._conditions(kwargs))
         values = tuple(kwargs.values())
 
         cur = conn.cursor()
+        if _row_factory is not None:
+            cur.row_factory = _row_factory
         cur.execute(query, values)
 
         if single:
@@ -98,7 +363,7 @@ class Model(object):
         return cur.fetchall()
 
     @classmethod
-    def find(cls, **kwargs):
+    def find(cls, fields=None, **kwargs):
         """
         Return an object corresponding to the first row that match the
         given criteria.  Criteria are specified by keyword arguments to
@@ -106,11 +371,15 @@ class Model(object):
 
         >>> Question.find(question_id=1).question == Question.find(id=1).question
         True
+        >>> Question.find(('id', 'category'), question='c1_d0_q1')
+        QuestionRecord(id=8, category='1')
         """
 
-        row = cls._query("SELECT *", **kwargs)
-        if row:
-            return cls(*row)
+        found = cls._find_cached(fields, kwargs)
+        if found is not None:
+            return found[0] if found else None
+        action, row_factory = cls._select(fields)
+        return cls._query(action, _row_factory=row_factory, **kwargs)
 
     @classmethod
     def delete_where(cls, **kwargs):
@@ -120,7 +389,13 @@ class Model(object):
         Criteria are specified in a similar manner to Model.find().
         """
 
+        # Find the keys of the rows first, to tell the hooks which went.
+        columns = dict(zip(cls._fields, cls._columns))
+        key_columns = [columns[field] for field in cls._key]
+        keys = [row[0] if len(row) == 1 else tuple(row) for row in cls._query('SELECT ' + ', '.join(key_columns), single=False, **kwargs)]
         cls._query("DELETE", **kwargs)
+        for key in keys:
+            cls._changed('delete', key)
 
     def delete(self):
         """
@@ -130,28 +405,302 @@ class Model(object):
         self.delete_where(id=self.id)
 
     @classmethod
-    def find_all(cls, **kwargs):
+    def find_all(cls, fields=None, **kwargs):
         """
         Like Model.find(), but returns a list of Models for all rows
         that match the criteria.
         """
 
-        return [cls(*row) for row in cls._query("SELECT *", single=False, **kwargs)]
+        found = cls._find_cached(fields, kwargs)
+        if found is not None:
+            return found
+        action, row_factory = cls._select(fields)
+        return cls._query(action, single=False, _row_factory=row_factory, **kwargs)
 
     @classmethod
-    def find_iter(cls, **kwargs):
+    def find_iter(cls, fields=None, **kwargs):
         """
         Like Model.find_all(), but is a generator, rather than
         returning a list.
         """
 
-        for row in cls._query("SELECT *", single=False, _iter=True, **kwargs):
-            yield cls(*row)
+        found = cls._find_cached(fields, kwargs)
+        if found is not None:
+            yield from found
+            return
+        action, row_factory = cls._select(fields)
+        yield from cls._query(action, single=False, _iter=True, _row_factory=row_factory, **kwargs)
+
+    @classmethod
+    def find_records(cls, **kwargs):
+        """
+        Like Model.find_all(), but returns read-only records rather than
+        Models: namedtuples of the same properties, holding the values of the
+        columns as they are in the database, built by the cursor as it
+        fetches each row.  They cost much less time and memory than Models
+        for long lists that are only read.
+
+        >>> answer = Answer.find_records(question_id=0)[0]
+        >>> answer
+        AnswerRecord(id=0, question_id=0, correct=1, text='c0_d0_q0_A0')
+        >>> answer.text == Answer.find(id=0).text
+        True
+        """
+
+        return cls.find_all(cls._fields, **kwargs)
+
+    @classmethod
+    def _expression(cls, field):
+        """
+        Internal use: returns the SQL for `field`, which may be a property
+        name, a column name, '*', or arithmetic on columns.
+        """
+
+        columns = dict(zip(cls._fields, cls._columns))
+        if field in columns:
+            return columns[field]
+        if field == 'id':
+            return cls._id_field()
+        if not re.match(r'^[\w\s.+\-*/()]+$', field):
+            raise ValueError('bad field: {!r}'.format(field))
+        return field
+
+    @classmethod
+    def count(cls, **kwargs):
+        """
+        Return the number of rows that match the criteria.
+
+        >>> Question.count(category=1) > Question.count(category=1, difficulty=1)
+        True
+        """
+
+        return cls._query('SELECT COUNT(*)', **kwargs)[0]
+
+    @classmethod
+    def exists(cls, **kwargs):
+        """
+        Return whether any row matches the criteria.
+
+        >>> Category.exists(id=1), Category.exists(id=-1)
+        (True, False)
+        """
+
+        return cls._query('SELECT 1', **kwargs) is not None
+
+    @classmethod
+    def aggregate(cls, function, field='*', **kwargs):
+        """
+        Return the result of an SQL aggregate `function` (count, sum, total,
+        avg, min or max) of `field` over the rows that match the criteria.
+        `field` is a property, a column, '*' or arithmetic on columns.
+
+        >>> Question.aggregate('max', 'difficulty', category=0)
+        1.0
+        >>> Answer.aggregate('count', 'text', question_id=0)
+        4
+        """
+
+        if function.lower() not in AGGREGATES:
+            raise ValueError('bad aggregate function: {!r}'.format(function))
+        return cls._query('SELECT {}({})'.format(function.upper(), cls._expression(field)), **kwargs)[0]
+
+    @classmethod
+    def group_by(cls, by, function='count', field='*', top=None, **kwargs):
+        """
+        Like Model.aggregate(), but groups the rows that match the criteria
+        by the value of the field `by` and returns a dict of each value to
+        the aggregate of its group.  If `top` is given, only that many
+        groups with the largest aggregates are returned, largest first;
+        otherwise the dict is in order of `by`.
+
+        >>> Question.group_by('difficulty', category=0)
+        {0.0: 2, 1.0: 5}
+        >>> Answer.group_by('question_id', 'sum', 'correct', top=1, question_id=0)
+        {0: 1}
+        """
+
+        if function.lower() not in AGGREGATES:
+            raise ValueError('bad aggregate function: {!r}'.format(function))
+        by = cls._expression(by)
+        query = 'SELECT {}, {}({}) FROM {}'.format(by, function.upper(), cls._expression(field), cls._table_name())
+        if kwargs:
+            query += ' WHERE ' + ' AND '.join(cls._conditions(kwargs))
+        query += ' GROUP BY ' + by
+        values = list(kwargs.values())
+        if top is None:
+            query += ' ORDER BY ' + by
+        else:
+            query += ' ORDER BY 2 DESC LIMIT ?'
+            values.append(top)
+        cur = conn.cursor()
+        cur.row_factory = None
+        return dict(cur.execute(query, values))
+
+    @classmethod
+    def find_page(cls, order_by='id', after=None, limit=20, fields=None, **kwargs):
+        """
+        Like Model.find_all(), but returns one page of at most `limit`
+        Models ordered by the field `order_by` (descending if it starts with
+        '-'), followed by a cursor for the next page, or None if this is the
+        last page.  Pass the cursor as `after` to get the next page.
+
+        Pages start after the last row of the previous page rather than at
+        an offset, so with an index on the criteria and `order_by` every
+        page costs the same however far in it is.  Rows with equal
+        `order_by` values are ordered by id, so the model needs an id field.
+
+        Raises ValueError if `after` is not a cursor.
+
+        >>> questions, after = Question.find_page(limit=2, category=1)
+        >>> [question.id for question in questions]
+        [7, 8]
+        >>> questions, after = Question.find_page(after=after, limit=2, category=1)
+        >>> [question.id for question in questions]
+        [9, 10]
+        >>> [question.id for question in Question.find_page('-id', limit=3, category=0)[0]]
+        [6, 5, 4]
+        >>> Question.find_page('-difficulty', limit=3, category=0)[1]
+        '[1.0, 4]'
+        >>> Question.find_page(after='[100]', category=1)
+        ([], None)
+        >>> Question.find_page(after='[{}]', category=1)
+        Traceback (most recent call last):
+          ...
+        ValueError: bad cursor: '[{}]'
+        >>> Question.find_page(after='[' * 100000, category=1)  # doctest: +ELLIPSIS
+        Traceback (most recent call last):
+          ...
+        ValueError: bad cursor: '[[[[...'
+        >>> Question.find_page(limit=1, fields=('question',), category=1)
+        ([QuestionRecord(question='c1_d0_q0')], '[7]')
+        """
+
+        descending = order_by.startswith('-')
+        field = order_by.lstrip('-')
+        if field == 'id':
+            field = cls._id_field()
+        if not re.match(r'^\w+$', field):
+            raise ValueError('bad field name: {!r}'.format(field))
+        order_columns = [field] if field == cls._id_field() else [field, cls._id_field()]
+
+        conditions = cls._conditions(kwargs)
+        values = list(kwargs.values())
+        if after is not None:
+            try:
+                cursor = json.loads(after)
+            except RecursionError:
+                # Nested too deeply for the decoder.
+                raise ValueError('bad cursor: {!r}'.format(after[:100]))
+            # Only values SQLite can bind; bool is an int, but not one a cursor holds.
+            if type(cursor) is not list or len(cursor) != len(order_columns) or \
+                    not all(value is None or type(value) in (float, str) or
+                            (type(value) is int and -2 ** 63 <= value < 2 ** 63) for value in cursor):
+                raise ValueError('bad cursor: {!r}'.format(after))
+            conditions.append('({}) {} ({})'.format(', '.join(order_columns), '<' if descending else '>', ', '.join('?' * len(order_columns))))
+            values.extend(cursor)
+
+        # The ordering columns are selected after the fields, for the cursor.
+        action, row_factory = cls._select(fields)
+        query = '{}, {} FROM {}'.format(action, ', '.join(order_columns), cls._table_name())
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY ' + ', '.join(column + (' DESC' if descending else '') for column in order_columns)
+        query += ' LIMIT ?'
+        values.append(limit + 1)
+        cur = conn.cursor()
+        cur.row_factory = None
+        rows = cur.execute(query, values).fetchall()
+
+        after = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            after = json.dumps(list(rows[-1][-len(order_columns):]))
+        return [row_factory(cur, row[:-len(order_columns)]) for row in rows], after
 
     @classmethod
     def create(cls):
         raise NotImplementedError()
 
+    @classmethod
+    def create_many(cls, rows, commit=True):
+        """
+        Insert many rows with a single executemany() and return them as
+        Models.  Each row is a sequence of column values in the order of
+        `_fields`, leaving out the id if the model has one: ids are given
+        out by the database, and returned in the Models.
+
+        All the rows are inserted in one transaction, which is committed
+        unless `commit` is False, for callers making other changes in the
+        same transaction.  If any row can't be inserted, none are.
+
+        >>> flags = Flag.create_many([(1,), (2,)], commit=False)
+        >>> flags[1].id == flags[0].id + 1, flags[1].question_id
+        (True, 2)
+        >>> conn.rollback()
+        """
+
+        rows = [tuple(row) for row in rows]
+        has_id = cls._fields[0] == 'id'
+        columns = cls._columns[1:] if has_id else cls._columns
+        query = 'INSERT INTO {} ({}) VALUES({})'.format(cls._table_name(), ', '.join(columns), ', '.join('?' * len(columns)))
+        cur = conn.cursor()
+        try:
+            cur.executemany(query, rows)
+            if has_id and rows:
+                # executemany() doesn't report the ids, but rows inserted in
+                # one transaction are given consecutive ids, so the last
+                # one's id gives them all.
+                last_id = cur.execute('SELECT last_insert_rowid()').fetchone()[0]
+                rows = [(row_id,) + row for row_id, row in zip(range(last_id - len(rows) + 1, last_id + 1), rows)]
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        models = [cls(*row) for row in rows]
+        for model in models:
+            cls._changed('insert', cls._key_of(model))
+        if commit:
+            conn.commit()
+        return models
+
+    @classmethod
+    def update_many(cls, rows, fields, key=None, commit=True):
+        """
+        Write the values of `fields` of each of `rows` (Models or records)
+        to the database with a single executemany(), finding each row's
+        database row by the values of the `key` fields, by default the
+        fields that identify a row of the model.  Returns the number
+        of rows changed.  Like Model.create_many(), the rows are updated in
+        one transaction, committed unless `commit` is False.
+
+        >>> answers = Answer.find_records(question_id=0)
+        >>> Answer.update_many([answer._replace(text=answer.text.upper()) for answer in answers], ['text'], commit=False)
+        4
+        >>> Answer.find(id=1).text
+        'C0_D0_Q0_A1'
+        >>> conn.rollback()
+        """
+
+        fields, key = tuple(fields), tuple(cls._key if key is None else key)
+        columns = dict(zip(cls._fields, cls._columns))
+        for field in fields + key:
+            if field not in columns:
+                raise ValueError('{} has no field {!r}'.format(cls.__name__, field))
+        query = 'UPDATE {} SET {} WHERE {}'.format(cls._table_name(),
+                                                    ', '.join(columns[field] + ' = ?' for field in fields),
+                                                    ' AND '.join(columns[field] + ' = ?' for field in key))
+        cur = conn.cursor()
+        rows = list(rows)
+        try:
+            cur.executemany(query, [tuple(getattr(row, field) for field in fields + key) for row in rows])
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        for row in rows:
+            cls._changed('update', cls._key_of(row), fields)
+        if commit:
+            conn.commit()
+        return cur.rowcount
+
 
 class User(Model):
     """
@@ -172,13 +721,17 @@ class User(Model):
     * User.find(**kwargs)
     """
 
+    _fields = ('id', 'username', 'email')
+    _columns = ('user_id', 'username', 'email')
+    __slots__ = _fields
+
     def __init__(self, user_id, username, email):
         self.id = user_id
         self.username = username
         self.email = email
 
     @classmethod
-    def find(cls, **kwargs):
+    def find(cls, fields=None, **kwargs):
         """
         Find and return a user where the kwargs match their records.
 
@@ -186,11 +739,11 @@ class User(Model):
         'dummy@example.com'
         >>> User.find(user_id=1).username
         'awesomealex'
+        >>> User.find(['username'], user_id=1)
+        UserRecord(username='awesomealex')
         """
 
-        row = cls._query("SELECT user_id, username, email", **kwargs)
-        if row:
-            return cls(*row)
+        return super(User, cls).find(fields, **kwargs)
 
     def check_login(self, password):
         """Check whether a provided password is the user's password."""
@@ -210,6 +763,7 @@ class User(Model):
         cur = conn.cursor()
         cur.execute('INSERT INTO users VALUES(NULL,?,?,?,?)',
                     (username, hasher.hash(password, salt), salt, email))
+        cls._changed('insert', cur.lastrowid)
         conn.commit()
         return cls(cur.lastrowid, username, email)
 
@@ -229,6 +783,7 @@ class User(Model):
         cur = conn.cursor()
         cur.execute('UPDATE users SET email = ? WHERE user_id = ?', (new_email, self.id))
         self.email = new_email
+        self._changed('update', self.id, ('email',))
         conn.commit()
 
     def set_password(self, new_password):
@@ -250,6 +805,7 @@ class User(Model):
         cur = conn.cursor()
         cur.execute('UPDATE users SET password = ?, salt = ? WHERE user_id = ?',
                     (hasher.hash(new_password, salt), salt, self.id))
+        self._changed('update', self.id, ('password', 'salt'))
         conn.commit()
 
 
@@ -269,8 +825,15 @@ class Question(Model):
 
     Class methods:
     * Question.create(question_text, category_id)
+    * Question.create_with_answers(question_text, category_id, answers)
+    * Question.search(text)
+    * Question.find_similar(question_text)
     """
 
+    _fields = ('id', 'question', 'questions_answered', 'questions_correct', 'category', 'difficulty')
+    _columns = ('question_id', 'question', 'questions_answered', 'questions_correct', 'category', 'difficulty')
+    __slots__ = _fields
+
     def __init__(self, question_id, question, questions_answered, questions_correct, category, difficulty):
         self.id = question_id
         self.question = question
@@ -283,9 +846,89 @@ class Question(Model):
     def create(cls, question, category_id):
         cur = conn.cursor()
         cur.execute('INSERT INTO questions VALUES(NULL,?,0,0,?,0)', (question, category_id))
+        cls._changed('insert', cur.lastrowid)
         conn.commit()
         return cls(cur.lastrowid, question, 0, 0, category_id, 0)
 
+    @classmethod
+    def create_with_answers(cls, question, category_id, answers):
+        """
+        Add a question and its answers, the first of which is the correct
+        one, in one transaction.
+        """
+
+        question = cls.create_many([(question, 0, 0, category_id, 0)], commit=False)[0]
+        Answer.create_many([(question.id, 1 if index == 0 else 0, answer) for index, answer in enumerate(answers)])
+        return question
+
+    @staticmethod
+    def _search_query(text, any_word=False):
+        """
+        Internal use: turn free text into an FTS5 query that matches all of
+        its words (or any of them), with each word quoted so punctuation in
+        the text can't be taken for query syntax.
+
+        >>> Question._search_query('Who wrote "Hamlet"?')
+        '"Who" AND "wrote" AND "Hamlet"'
+        >>> Question._search_query('Who wrote', any_word=True)
+        '"Who" OR "wrote"'
+        """
+
+        words = re.findall(r'[^\W_]+', text)
+        return (' OR ' if any_word else ' AND ').join('"{}"'.format(word) for word in words)
+
+    @classmethod
+    def search(cls, text, category=None, limit=20, offset=0, any_word=False):
+        """
+        Return the questions whose text or answers contain all the words in
+        `text`, best match first, optionally only those in `category`.
+        Matches in the question count for more than matches in the answers.
+
+        >>> [question.question for question in Question.search('c1_d0_q6')]
+        ['c1_d0_q6']
+        >>> [question.id for question in Question.search('c0_d1_q1_A2')]
+        [3]
+        >>> Question.search('"')
+        []
+        """
+
+        query = cls._search_query(text, any_word)
+        if not query:
+            return []
+        sql = ('SELECT questions.* FROM questions_search'
+               ' JOIN questions ON questions.question_id = questions_search.rowid'
+               ' WHERE questions_search MATCH ?')
+        values = [query]
+        if category is not None:
+            sql += ' AND questions.category = ?'
+            values.append(category)
+        sql += ' ORDER BY bm25(questions_search, 10.0, 1.0), questions.question_id LIMIT ? OFFSET ?'
+        values.extend((limit, offset))
+        return [cls(*row) for row in conn.execute(sql, values)]
+
+    @classmethod
+    def find_similar(cls, text, category=None, limit=5, threshold=0.8):
+        """
+        Return existing questions that look like duplicates of a new question
+        with the given text: of the questions sharing words with it, those
+        whose words are at least `threshold` similar, most similar first.
+
+        >>> Question.find_similar('C1 d0 q6?')[0].question
+        'c1_d0_q6'
+        >>> Question.find_similar('Something else entirely')
+        []
+        """
+
+        words = ' '.join(re.findall(r'[^\W_]+', text.lower()))
+        similar = []
+        for question in cls.search(text, category, limit=20, any_word=True):
+            other = ' '.join(re.findall(r'[^\W_]+', question.question.lower()))
+            ratio = difflib.SequenceMatcher(None, words, other).ratio()
+            if ratio >= threshold:
+                similar.append((ratio, question))
+        similar.sort(key=lambda item: item[0], reverse=True)
+        return [question for ratio, question in similar[:limit]]
+
     def flag(self):
         return Flag.create(self.id)
 
@@ -293,6 +936,10 @@ class Question(Model):
         return Answer.find_all(question_id=self.id)
 
 
+# Games are chosen from the questions of each category in selection's indexes.
+Question.add_hook(selection.questions_changed)
+
+
 class Category(Model):
     """
     A model that represents a category in the database.
@@ -303,12 +950,34 @@ class Category(Model):
 
     Class methods:
     * Category.create(category_name)
+
+    Categories are kept in memory, as they are read on most pages and
+    hardly ever change; those returned by the find* methods are shared, so
+    they are read-only.  Changes made by other processes are noticed by
+    versions.check().
+
+    >>> category = Category.find(id=1)
+    >>> category.name = 'Renamed'
+    Traceback (most recent call last):
+      ...
+    AttributeError: <Category 1> is cached and read-only
+    >>> Category.find(id='1') is category, Category.find(name='cat0').id
+    (True, 0)
     """
 
+    _fields = ('id', 'name')
+    _columns = ('category_id', 'category')
+    __slots__ = _fields + ('_frozen',)
+
     def __init__(self, category_id, name):
         self.id = category_id
         self.name = name
 
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError('{!r} is cached and read-only'.format(self))
+        object.__setattr__(self, name, value)
+
     @classmethod
     def _table_name(cls):
         return 'categories'
@@ -317,17 +986,17 @@ class Category(Model):
     def create(cls, name):
         cur = conn.cursor()
         cur.execute('INSERT INTO categories VALUES(NULL,?)', (name,))
+        cls._changed('insert', cur.lastrowid)
         conn.commit()
         return cls(cur.lastrowid, name)
 
     def create_question(self, question, answers):
-        question = Question.create(question, self.id)
-        for index, answer in enumerate(answers):
-            if index == 0:
-                Answer.create(question.id, 1, answer)
-            else:
-                Answer.create(question.id, 0, answer)
-        return question
+        return Question.create_with_answers(question, self.id, answers)
+
+
+Category._table_cache = TableCache(Category._load_table, CATEGORY_CACHE_SIZE)
+Category.add_hook(lambda changes: Category._table_cache.invalidate())
+versions.watch('categories', Category._table_cache.invalidate)
 
 
 class Flag(Model):
@@ -342,6 +1011,10 @@ class Flag(Model):
     * Flag.create(question_id)
     """
 
+    _fields = ('id', 'question_id')
+    _columns = ('flag_id', 'question_id')
+    __slots__ = _fields
+
     def __init__(self, flag_id, question_id):
         self.id = flag_id
         self.question_id = question_id
@@ -350,6 +1023,7 @@ class Flag(Model):
     def create(cls, question_id):
         cur = conn.cursor()
         cur.execute('INSERT INTO flags VALUES(NULL,?)', (question_id,))
+        cls._changed('insert', cur.lastrowid)
         conn.commit()
         return cls(cur.lastrowid, question_id)
 
@@ -371,6 +1045,10 @@ class Answer(Model):
     * Answer.create(answer_id, question_id, correct, text)
     """
 
+    _fields = ('id', 'question_id', 'correct', 'text')
+    _columns = ('answer_id', 'question_id', 'correct', 'answer_text')
+    __slots__ = _fields
+
     def __init__(self, answer_id, question_id, correct, text):
         self.id = answer_id
         self.question_id = question_id
@@ -381,6 +1059,7 @@ class Answer(Model):
     def create(cls, question_id, correct, text):
         cur = conn.cursor()
         cur.execute('INSERT INTO answers VALUES(NULL,?,?,?)', (question_id, correct, text))
+        cls._changed('insert', cur.lastrowid)
         conn.commit()
         return cls(cur.lastrowid, question_id, correct, text)
 
@@ -388,6 +1067,18 @@ class Answer(Model):
         return Question.find(id=self.question_id)
 
 
+def _bank_changed(changes):
+    # The answer counters aren't in the question bank.
+    if any(change.action != 'update' or set(change.fields) - {'questions_answered', 'questions_correct'} for change in changes):
+        question_bank.changed()
+
+
+# The question bank holds questions, answers and categories.
+Question.add_hook(_bank_changed)
+Answer.add_hook(_bank_changed)
+Category.add_hook(_bank_changed)
+
+
 class Score(Model):
     """
     A model that represents the score of a User in a certain Category.
@@ -397,21 +1088,106 @@ class Score(Model):
     * category_id  - the category ID
     * questions_answered - the number of questions the user has answered
     * questions_correct  - the number of questions the user answered correctly
+    * streak             - the number of questions answered correctly in a row, up to now
+    * best_streak        - the most questions the user has answered correctly in a row
+    * easy_answered, easy_correct, medium_answered, medium_correct,
+      hard_answered, hard_correct - the numbers of questions answered
+      (correctly) for each difficulty
+
+    Scores are updated with each answer by Score.record(), and can be
+    recomputed from all the answers with db/rebuild_scores.py.
     """
 
-    def __init__(self, user_id, category_id, num_answered, num_correct):
+    _fields = ('user_id', 'category_id', 'num_answered', 'num_correct', 'streak', 'best_streak',
+               'easy_answered', 'easy_correct', 'medium_answered', 'medium_correct', 'hard_answered', 'hard_correct')
+    _columns = _fields
+    _key = ('user_id', 'category_id')
+    __slots__ = _fields + ('category_name',)
+
+    def __init__(self, user_id, category_id, num_answered, num_correct, streak=0, best_streak=0,
+                 easy_answered=0, easy_correct=0, medium_answered=0, medium_correct=0, hard_answered=0, hard_correct=0):
         self.user_id = user_id
         self.category_id = category_id
         self.num_answered = num_answered
         self.num_correct = num_correct
+        self.streak = streak
+        self.best_streak = best_streak
+        self.easy_answered = easy_answered
+        self.easy_correct = easy_correct
+        self.medium_answered = medium_answered
+        self.medium_correct = medium_correct
+        self.hard_answered = hard_answered
+        self.hard_correct = hard_correct
 
     @classmethod
     def create(cls, user_id, category_id):
         cur = conn.cursor()
-        cur.execute('INSERT INTO scores VALUES(?,?,0,0)', (user_id, category_id))
+        cur.execute('INSERT INTO scores(user_id, category_id, num_answered, num_correct) VALUES(?,?,0,0)', (user_id, category_id))
+        cls._changed('insert', (user_id, category_id))
         conn.commit()
         return cls(user_id, category_id, 0, 0)
 
+    @staticmethod
+    def record(cur, user_id, category_id, difficulty, correct):
+        """
+        Add an answer to a question of the given difficulty (0, 1 or 2) to
+        the user's score in the category, creating the score if need be.
+        Nothing is committed, so the update is part of the caller's
+        transaction.
+        """
+
+        band = min(max(int(difficulty), 0), 2)
+        correct = 1 if correct else 0
+        splits = [0] * 6
+        splits[band * 2] = 1
+        splits[band * 2 + 1] = correct
+        cur.execute('''INSERT INTO scores VALUES(?, ?, 1, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                       ON CONFLICT(user_id, category_id) DO UPDATE SET
+                       num_answered = num_answered + 1,
+                       num_correct = num_correct + excluded.num_correct,
+                       streak = CASE WHEN excluded.num_correct THEN streak + 1 ELSE 0 END,
+                       best_streak = max(best_streak, CASE WHEN excluded.num_correct THEN streak + 1 ELSE 0 END),
+                       easy_answered = easy_answered + excluded.easy_answered,
+                       easy_correct = easy_correct + excluded.easy_correct,
+                       medium_answered = medium_answered + excluded.medium_answered,
+                       medium_correct = medium_correct + excluded.medium_correct,
+                       hard_answered = hard_answered + excluded.hard_answered,
+                       hard_correct = hard_correct + excluded.hard_correct''',
+                    [user_id, category_id, correct, correct, correct] + splits)
+        band_name = ('easy', 'medium', 'hard')[band]
+        Score._changed('update', (user_id, category_id),
+                       ('num_answered', 'num_correct', 'streak', 'best_streak', band_name + '_answered', band_name + '_correct'))
+
+    @classmethod
+    def find_for_user(cls, user_id):
+        """
+        Return all of a user's scores, with the name of each one's category
+        as `category_name`, in order of category name.
+        """
+
+        scores = []
+        for row in conn.execute('SELECT scores.*, categories.category FROM scores'
+                                ' JOIN categories ON categories.category_id = scores.category_id'
+                                ' WHERE scores.user_id = ? ORDER BY categories.category', (user_id,)):
+            score = cls(*row[:-1])
+            score.category_name = row[-1]
+            scores.append(score)
+        return scores
+
+    @staticmethod
+    def leaderboard(top):
+        """
+        Return the (username, percentage) of the `top` players with the
+        best percentage of correct answers, averaged over the categories
+        they have answered questions in, best first.  Categories with no
+        answers, and scores of users who no longer exist, are left out.
+        """
+
+        return conn.execute('SELECT users.username, AVG(100.0 * scores.num_correct / scores.num_answered) AS percentage'
+                            ' FROM scores JOIN users ON users.user_id = scores.user_id'
+                            ' WHERE scores.num_answered > 0 GROUP BY scores.user_id'
+                            ' ORDER BY percentage DESC LIMIT ?', (top,)).fetchall()
+
     def update_score(self, correct_answer):
         if correct_answer:
             self.num_correct += 1
@@ -419,6 +1195,7 @@ class Score(Model):
         cur = conn.cursor()
         cur.execute('UPDATE scores SET num_answered=?,num_correct=? WHERE user_id=? AND category_id=?',
                     (self.num_answered, self.num_correct, self.user_id, self.category_id))
+        self._changed('update', (self.user_id, self.category_id), ('num_answered', 'num_correct'))
         conn.commit()
 
     def get_user(self):
@@ -440,6 +1217,11 @@ class QuestionResult(Model):
     * correct     - whether the answer was correct or not (mostly for convenience)
     """
 
+    _fields = ('game_id', 'question_id', 'user_id', 'answer_id', 'correct')
+    _columns = _fields
+    _key = ('game_id', 'question_id', 'user_id')
+    __slots__ = _fields
+
     def __init__(self, game_id, question_id, user_id, answer_id, correct):
         self.game_id = game_id
         self.question_id = question_id
@@ -452,6 +1234,7 @@ class QuestionResult(Model):
         cur = conn.cursor()
         cur.execute('INSERT INTO questionresults VALUES(?, ?, ?, ?, ?)',
                     (game_id, question_id, user_id, answer_id, correct))
+        cls._changed('insert', (game_id, question_id, user_id))
         conn.commit()
         return cls(game_id, question_id, user_id, answer_id, correct)
 
@@ -480,8 +1263,21 @@ class Game(Model):
     * difficulty        - what difficulty the game is
     * category_id       - what category the game is in
     * score             - the current score in the game
+
+    Games being played are best fetched with Game.find_active(), which keeps
+    them in memory with their questions and answers loaded.  Changes to a
+    game are written straight to the database either way.
     """
 
+    _fields = ('id', 'user_id', 'question_ids', 'question_index', 'time_started', 'time_completed',
+               'difficulty', 'category_id', 'score')
+    _columns = ('game_id', 'user_id', 'questions', 'question_index', 'time_started', 'time_completed',
+                'difficulty', 'category_id', 'score')
+    __slots__ = _fields + ('questions', 'answers')
+
+    # Game id -> Game, for the games returned by find_active().
+    _active = LRUCache(ACTIVE_GAMES_MAX, ttl=ACTIVE_GAME_TTL)
+
     def __init__(self, game_id, user_id, question_ids, question_index, time_started, time_completed, difficulty, category_id, score):
         if not question_ids:
             raise ValueError('a game must have questions (id {})'.format(game_id))
@@ -497,6 +1293,56 @@ class Game(Model):
         self.difficulty = difficulty
         self.category_id = category_id
         self.score = score
+        # Filled in by preload(): the questions, and question id -> answers.
+        self.questions = None
+        self.answers = None
+
+    @classmethod
+    def find_active(cls, game_id):
+        """
+        Return the game with the given id with its questions and answers
+        preloaded, from memory if it was fetched recently, or None.
+        Games that have ended are not kept.
+        """
+
+        versions.check(conn)
+        game = cls._active.get(game_id)
+        if game is None:
+            game = cls.find(game_id=game_id)
+            if game is None or game.is_end():
+                return game
+            game.preload()
+            cls._active.put(game_id, game)
+        return game
+
+    def preload(self):
+        """
+        Load the game's questions and answers, so they are not fetched
+        again: from the question bank if there is an up to date one (see
+        question_bank.py), or else from the database.
+        """
+
+        bank = question_bank.current(conn)
+        if bank is not None:
+            rows = [bank.question(question_id) for question_id in self.question_ids]
+            if None not in rows:
+                self.questions = [Question(*row) for row in rows]
+                self.answers = {question_id: [Answer(*row) for row in bank.answers(question_id)] for question_id in self.question_ids}
+                return
+
+        placeholders = ','.join('?' * len(self.question_ids))
+        questions = {row['question_id']: Question(*row) for row in
+                     conn.execute('SELECT * FROM questions WHERE question_id IN ({})'.format(placeholders), self.question_ids)}
+        answers = {question_id: [] for question_id in self.question_ids}
+        for row in conn.execute('SELECT * FROM answers WHERE question_id IN ({}) ORDER BY answer_id'.format(placeholders), self.question_ids):
+            answers[row['question_id']].append(Answer(*row))
+        self.questions = [questions.get(question_id) for question_id in self.question_ids]
+        self.answers = answers
+
+    def _finished(self):
+        """Forget the game once it has ended, as it will not be played again."""
+        if self.is_end():
+            self._active.pop(self.id)
 
     @classmethod
     def create(cls, user_id, category_id, difficulty, n=5):
@@ -513,31 +1359,130 @@ class Game(Model):
 
         curr_time = time.time()
         cur.execute('INSERT INTO games VALUES(NULL, ?, ?, 0, ?, 0, ?, ?, 0)',
-                    (user_id, ','.join(map(str, question_ids)), curr_time, category_id, difficulty))
+                    (user_id, ','.join(map(str, question_ids)), curr_time, difficulty, category_id))
+        cls._changed('insert', cur.lastrowid)
         conn.commit()
         return cls(cur.lastrowid, user_id, question_ids, 0, curr_time, 0, difficulty, category_id, 0)
 
-    def submit_answer(self, question_id, answer_id):
-        correct = 0
-        question = Question.find(question_id=question_id)
-        answer = Answer.find(answer_id=answer_id)
+    @classmethod
+    def create_adaptive(cls, user_id, category_id, n=5):
+        """
+        Like Game.create(), but with questions from any difficulty whose
+        ratings are near the user's skill rating, avoiding questions the user
+        has seen recently (see selection.py).
+        """
 
-        if question and answer:
-            if question.id == answer.question_id:
-                cur = conn.cursor()
+        question_ids = selection.select(conn, user_id, category_id, n)
+        if not question_ids:
+            return None
 
-                if answer.correct:
-                    correct = 1
-                    cur.execute('UPDATE games SET score = score + 1 WHERE game_id = ?', (self.id,))
-                    self.score += 1
+        # Record the band of the questions' average difficulty rating.
+        skill = ratings.get(conn.cursor(), 'user_ratings', 'user_id', user_id)[0]
+        band = round(selection.target_rating(skill) / ratings.BAND_WIDTH + ratings.MIDDLE_BAND)
+        difficulty = min(max(band, 0), 2)
 
-                QuestionResult.create(self.id, question_id, self.user_id, answer_id, correct)
+        curr_time = time.time()
+        cur = conn.cursor()
+        cur.execute('INSERT INTO games VALUES(NULL, ?, ?, 0, ?, 0, ?, ?, 0)',
+                    (user_id, ','.join(map(str, question_ids)), curr_time, difficulty, category_id))
+        cls._changed('insert', cur.lastrowid)
+        conn.commit()
+        return cls(cur.lastrowid, user_id, question_ids, 0, curr_time, 0, difficulty, category_id, 0)
+
+    def submit_answer(self, question_id, answer_id):
+        """
+        Record an answer to the game's current question, and return 1 if it
+        was correct or else 0.  Raises StaleGameError, recording nothing, if
+        the game has moved on from the question this Game is on.
+        """
+
+        correct = 0
+        if self.answers is not None:
+            answer = [answer for answer in self.answers.get(question_id, ()) if answer.id == int(answer_id)]
+            answer = answer[0] if answer else None
+            question = self.questions[self.question_ids.index(question_id)] if answer else None
+        else:
+            question = Question.find(question_id=question_id)
+            answer = Answer.find(answer_id=answer_id)
+            if not question or (answer and question.id != answer.question_id):
+                answer = None
+
+        if answer:
+            cur = conn.cursor()
+            correct = 1 if answer.correct else 0
+            try:
+                # Another process may have moved the game on since it was
+                # cached, so the update only applies to the question we are on.
+                cur.execute('UPDATE games SET score = score + ? WHERE game_id = ? AND question_index = ?',
+                            (correct, self.id, self.question_index))
+                if cur.rowcount != 1:
+                    conn.rollback()
+                    self._active.pop(self.id)
+                    raise StaleGameError('game {} is no longer on question {}'.format(self.id, self.question_index))
+                if correct:
+                    self._changed('update', self.id, ('score',))
+
+                cur.execute('INSERT INTO questionresults VALUES(?, ?, ?, ?, ?)',
+                            (self.id, question_id, self.user_id, answer.id, correct))
+                QuestionResult._changed('insert', (self.id, question_id, self.user_id))
                 cur.execute('UPDATE questions SET questions_answered = questions_answered + 1, questions_correct = questions_correct + ? WHERE question_id = ?',
                             (correct, question_id))
-                conn.commit()
+                Question._changed('update', question_id, ('questions_answered', 'questions_correct'))
+                ratings.update(cur, self.user_id, question_id, correct)
+                Score.record(cur, self.user_id, self.category_id, question.difficulty, correct)
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+            self.score += correct
+            conn.commit()
 
         return correct
 
+    def record_results(self, results, question_index):
+        """
+        Record a batch of answers and move the game on to `question_index`,
+        with a single commit.
+
+        `results` is a list of (question_id, user_id, answer_id, correct)
+        tuples, which may come from several users playing the same game;
+        only the game owner's correct answers count towards `score`.
+        """
+
+        score = self.score + sum(correct for question_id, user_id, answer_id, correct in results if user_id == self.user_id)
+        time_completed = time.time() if question_index >= len(self.question_ids) else self.time_completed
+
+        # If any of the writes fails, none of them are kept and the game
+        # is left as it was.
+        cur = conn.cursor()
+        try:
+            cur.executemany('INSERT INTO questionresults VALUES(?, ?, ?, ?, ?)',
+                            [(self.id, question_id, user_id, answer_id, correct)
+                             for question_id, user_id, answer_id, correct in results])
+            cur.executemany('UPDATE questions SET questions_answered = questions_answered + 1, questions_correct = questions_correct + ? WHERE question_id = ?',
+                            [(correct, question_id) for question_id, user_id, answer_id, correct in results])
+            for question_id, user_id, answer_id, correct in results:
+                QuestionResult._changed('insert', (self.id, question_id, user_id))
+                Question._changed('update', question_id, ('questions_answered', 'questions_correct'))
+                ratings.update(cur, user_id, question_id, correct)
+                Score.record(cur, user_id, self.category_id, self._question_difficulty(question_id), correct)
+
+            cur.execute('UPDATE games SET score = ?, question_index = ?, time_completed = ? WHERE game_id = ?',
+                        (score, question_index, time_completed, self.id))
+            self._changed('update', self.id, ('score', 'question_index', 'time_completed'))
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        self.score = score
+        self.question_index = question_index
+        self.time_completed = time_completed
+        conn.commit()
+        self._finished()
+
+    def _question_difficulty(self, question_id):
+        if self.questions is not None:
+            return self.questions[self.question_ids.index(question_id)].difficulty
+        return Question._query('SELECT difficulty', id=question_id)['difficulty']
+
     def is_end(self):
         """Return a boolean indicating whether the game has ended."""
         return self.question_index >= len(self.question_ids)
@@ -550,6 +1495,8 @@ class Game(Model):
         return results
 
     def get_questions(self):
+        if self.questions is not None:
+            return list(self.questions)
         questions = []
         for id in self.question_ids:
             questions.append(Question.find(question_id=id))
@@ -560,6 +1507,8 @@ class Game(Model):
         return self.get_question(self.question_index)
 
     def get_question(self, index):
+        if self.questions is not None:
+            return self.questions[index]
         current_question_id = self.question_ids[index]
         question = Question.find(question_id=current_question_id)
 
@@ -569,10 +1518,21 @@ class Game(Model):
         cur = conn.cursor()
         cur.execute('UPDATE games SET question_index = question_index + 1 WHERE game_id=?', (self.id,))
         self.question_index += 1
+        self._changed('update', self.id, ('question_index',))
         conn.commit()
+        self._finished()
         return self.score
 
-conn = sqlite3.connect('db/trivia.db')
+    def get_answers(self, question_id):
+        """Return the answers to one of the game's questions."""
+        if self.answers is not None:
+            return list(self.answers[question_id])
+        return Answer.find_all(question_id=question_id)
+
+versions.watch('games', Game._active.clear)
+
+
+conn = sqlite3.connect('db/trivia.db', factory=Connection)
 conn.row_factory = sqlite3.Row
 
 if __name__ == '__main__':
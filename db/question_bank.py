@@ -0,0 +1,279 @@
+'''
+A read-only snapshot of the questions, their answers and the categories, in
+a compact binary file that server processes map into memory.
+
+Questions and answers are read for every game but hardly ever change.  The
+snapshot ("question bank") holds them in fixed-size records with the ids in
+sorted arrays, so a question is found by a binary search of the mapped file
+without copying anything, and only the texts of the questions asked for are
+decoded.  All the processes using a bank share one copy of it in the page
+cache.
+
+A bank is published by writing a new file and renaming it over the old one
+(see export_questions.py), so readers never see half a file: current() notices
+the new file and swaps to it, while anything still holding the old bank keeps
+a valid mapping of the old file.
+
+Each bank records the version of the data it was made from, the total of the
+change counts of its tables in table_versions (see create_db.py).  current()
+only returns a bank that is up to date; once questions, answers or
+categories change, callers read from the database until a new bank is
+published.
+
+File layout, all little-endian:
+
+* header: magic, format version, data version, the numbers of categories,
+  questions and answers, and the offsets of the sections below
+* category ids (int64, sorted), then a (name offset, name length) record for
+  each category
+* question ids (int64, sorted), then for each question its difficulty,
+  text, category text and the index and number of its answers
+* answer ids and question ids (int64), then for each answer whether it is
+  correct and its text
+* texts, UTF-8
+'''
+
+import bisect
+import mmap
+import os
+import sqlite3
+import struct
+
+from . import versions
+
+__all__ = ['QuestionBank', 'export', 'use', 'current']
+
+MAGIC = b'QZQB'
+FORMAT_VERSION = 1
+
+# Magic, format version, data version, counts of categories, questions and
+# answers, offsets of the category, question, answer and text sections.
+HEADER = struct.Struct('<4sIQIIIQQQQ')
+# Name offset and length.
+CATEGORY = struct.Struct('<II')
+# Difficulty, text offset and length, category offset and length, index of
+# the first answer, number of answers.
+QUESTION = struct.Struct('<dIIIIII')
+# Correct, text offset and length.
+ANSWER = struct.Struct('<III')
+
+# The tables a bank is made from.
+TABLES = ('categories', 'questions', 'answers')
+
+
+def data_version(conn):
+    """Return the version of the data in the database that a bank would hold."""
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute('SELECT coalesce(sum(version), 0) FROM table_versions WHERE table_name IN ({})'.format(
+        ', '.join('?' * len(TABLES))), TABLES)
+    return cur.fetchone()[0]
+
+
+class _Texts(object):
+    """Internal use: collects the texts of a bank, each stored once."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = {}
+
+    def add(self, text):
+        encoded = text.encode('utf-8')
+        if encoded not in self.offsets:
+            self.offsets[encoded] = len(self.data)
+            self.data += encoded
+        return self.offsets[encoded], len(encoded)
+
+
+def export(conn, path):
+    """
+    Write a bank of everything in the database to `path`, replacing any bank
+    already there in one step, and return its data version.
+    """
+
+    cur = conn.cursor()
+    cur.row_factory = None
+    # One read transaction, so the tables and the version agree.
+    cur.execute('BEGIN')
+    try:
+        version = data_version(conn)
+        categories = cur.execute('SELECT category_id, category FROM categories ORDER BY category_id').fetchall()
+        questions = cur.execute('SELECT question_id, question, category, difficulty FROM questions ORDER BY question_id').fetchall()
+        answers = cur.execute('SELECT answer_id, question_id, correct, answer_text FROM answers ORDER BY question_id, answer_id').fetchall()
+    finally:
+        cur.execute('COMMIT')
+
+    texts = _Texts()
+    first_answers = {}
+    for index, (answer_id, question_id, correct, text) in enumerate(answers):
+        first_answers.setdefault(question_id, [index, 0])[1] += 1
+
+    sections = []
+    sections.append(struct.pack('<{}q'.format(len(categories)), *(row[0] for row in categories)) +
+                    b''.join(CATEGORY.pack(*texts.add(name)) for category_id, name in categories))
+    sections.append(struct.pack('<{}q'.format(len(questions)), *(row[0] for row in questions)) +
+                    b''.join(QUESTION.pack(float(difficulty), *(texts.add(text) + texts.add(str(category)) +
+                                                                tuple(first_answers.get(question_id, (0, 0)))))
+                             for question_id, text, category, difficulty in questions))
+    sections.append(struct.pack('<{}q'.format(len(answers)), *(row[0] for row in answers)) +
+                    struct.pack('<{}q'.format(len(answers)), *(row[1] for row in answers)) +
+                    b''.join(ANSWER.pack(1 if correct else 0, *texts.add(text)) for answer_id, question_id, correct, text in answers))
+    sections.append(bytes(texts.data))
+
+    offsets = []
+    offset = HEADER.size
+    for section in sections:
+        # Keep the int64 arrays aligned.
+        offset += -offset % 8
+        offsets.append(offset)
+        offset += len(section)
+
+    temp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, version, len(categories), len(questions), len(answers), *offsets))
+        for offset, section in zip(offsets, sections):
+            f.write(bytes(offset - f.tell()))
+            f.write(section)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    return version
+
+
+class QuestionBank(object):
+    """
+    A bank file mapped into memory.  Its methods return rows as tuples of
+    the arguments of the models' constructors (see models.py), except that
+    questions have None for their answer counts, which change too often to
+    be kept in a bank.
+
+    Raises ValueError if the file is not a bank of this format.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        if len(self._map) < HEADER.size:
+            raise ValueError('{} is not a question bank'.format(path))
+        (magic, format_version, self.version, categories, questions, answers,
+         category_offset, question_offset, answer_offset, self._text_offset) = HEADER.unpack_from(self._map)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError('{} is not a question bank of version {}'.format(path, FORMAT_VERSION))
+
+        # Views of the id arrays, searched in place.
+        self._category_ids = view[category_offset:category_offset + 8 * categories].cast('q')
+        self._categories = category_offset + 8 * categories
+        self._question_ids = view[question_offset:question_offset + 8 * questions].cast('q')
+        self._questions = question_offset + 8 * questions
+        self._answer_ids = view[answer_offset:answer_offset + 8 * answers].cast('q')
+        self._answer_question_ids = view[answer_offset + 8 * answers:answer_offset + 16 * answers].cast('q')
+        self._answers = answer_offset + 16 * answers
+
+    def __len__(self):
+        return len(self._question_ids)
+
+    def _text(self, offset, length):
+        start = self._text_offset + offset
+        return str(self._map[start:start + length], 'utf-8')
+
+    @staticmethod
+    def _index(ids, key):
+        try:
+            key = int(key)
+        except (TypeError, ValueError):
+            return None
+        index = bisect.bisect_left(ids, key)
+        if index < len(ids) and ids[index] == key:
+            return index
+        return None
+
+    def question(self, question_id):
+        """Return the row of the question with the given id, or None."""
+        index = self._index(self._question_ids, question_id)
+        if index is None:
+            return None
+        difficulty, text_offset, text_length, category_offset, category_length, first, count = \
+            QUESTION.unpack_from(self._map, self._questions + index * QUESTION.size)
+        return (self._question_ids[index], self._text(text_offset, text_length), None, None,
+                self._text(category_offset, category_length), difficulty)
+
+    def answers(self, question_id):
+        """Return the rows of the answers to a question, in order of id."""
+        index = self._index(self._question_ids, question_id)
+        if index is None:
+            return []
+        first, count = QUESTION.unpack_from(self._map, self._questions + index * QUESTION.size)[5:]
+        answers = []
+        for i in range(first, first + count):
+            correct, text_offset, text_length = ANSWER.unpack_from(self._map, self._answers + i * ANSWER.size)
+            answers.append((self._answer_ids[i], self._answer_question_ids[i], correct, self._text(text_offset, text_length)))
+        return answers
+
+    def category(self, category_id):
+        """Return the row of the category with the given id, or None."""
+        index = self._index(self._category_ids, category_id)
+        if index is None:
+            return None
+        return (self._category_ids[index], self._text(*CATEGORY.unpack_from(self._map, self._categories + index * CATEGORY.size)))
+
+
+# The bank file in use, the (inode, size, mtime) of the file when it was
+# last opened, and the bank if it is up to date.
+_path = None
+_file = None
+_bank = None
+
+
+def use(path):
+    """Read questions from the bank published at `path`, whenever it is up to date."""
+    global _path, _file, _bank
+    _path = path
+    _file = _bank = None
+
+
+def changed():
+    """
+    Stop using the bank, as its tables have changed; the next call of
+    current() checks whether the published bank is up to date.
+    """
+
+    global _file, _bank
+    _file = _bank = None
+
+
+versions.watch('categories', changed)
+versions.watch('questions', changed)
+versions.watch('answers', changed)
+
+
+def current(conn):
+    """
+    Return the published bank if it is up to date with the database, or
+    None.  Costs a stat() of the file and versions.check(), unless a new bank
+    has been published or the data has changed.
+    """
+
+    global _file, _bank
+    if _path is None:
+        return None
+    versions.check(conn)
+    try:
+        stat = os.stat(_path)
+    except OSError:
+        _file = _bank = None
+        return None
+    key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    if key != _file:
+        _file = key
+        try:
+            bank = QuestionBank(_path)
+        except ValueError:
+            bank = None
+        try:
+            up_to_date = bank is not None and bank.version == data_version(conn)
+        except sqlite3.OperationalError:
+            # A database without table_versions can't say.
+            up_to_date = False
+        _bank = bank if up_to_date else None
+    return _bank
@@ -0,0 +1,221 @@
+'''
+Skill ratings for users and difficulty ratings for questions.
+
+Ratings follow the Rasch model: a user with skill `s` answers a question with
+difficulty `d` correctly with probability 1 / (1 + exp(d - s)), so ratings
+are on a logit scale centred on 0.  They are kept in the user_ratings and
+question_ratings tables, which are updated a little after every answer by
+update(), in the same way as Elo ratings.  recompute() fits all the ratings
+again from every answer in questionresults; it needs NumPy.
+'''
+
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['expected', 'question_prior', 'get', 'update', 'recompute']
+
+# The rating of a user with no answers.
+INITIAL_RATING = 0.0
+
+# update() moves a rating by up to K times the surprise of an answer, with K
+# shrinking from RATING_K as more answers are seen, down to RATING_K_MIN.
+RATING_K = 0.4
+RATING_K_MIN = 0.05
+RATING_K_DECAY = 0.05
+
+# Questions that have never been answered are rated by their difficulty band
+# (0 for easy, 1 for medium, 2 for hard): BAND_WIDTH per band away from
+# MIDDLE_BAND.  See question_prior().
+MIDDLE_BAND = 1
+BAND_WIDTH = 1.0
+
+# The strength of recompute()'s pull of ratings towards their priors
+# (INITIAL_RATING for users, question_prior() for questions), which keeps the
+# ratings of users and questions with only right (or only wrong) answers
+# finite.
+REGULARIZATION = 1.0
+
+
+def expected(skill, difficulty):
+    """
+    Return the probability that a user with `skill` answers a question with
+    `difficulty` correctly.
+
+    >>> expected(0.0, 0.0)
+    0.5
+    >>> round(expected(1.0, 0.0), 3), round(expected(0.0, 1.0), 3)
+    (0.731, 0.269)
+    """
+
+    return 1.0 / (1.0 + math.exp(difficulty - skill))
+
+
+def question_prior(difficulty):
+    """
+    Return the rating of a question in difficulty band `difficulty` before
+    anyone has answered it.
+
+    >>> question_prior(0), question_prior(1), question_prior(2)
+    (-1.0, 0.0, 1.0)
+    """
+
+    if difficulty is None:
+        return INITIAL_RATING
+    return (difficulty - MIDDLE_BAND) * BAND_WIDTH
+
+
+def k_factor(answered):
+    """
+    Return how far update() moves a rating with `answered` answers.
+
+    >>> k_factor(0)
+    0.4
+    >>> k_factor(1000)
+    0.05
+    """
+
+    return max(RATING_K_MIN, RATING_K / (1 + RATING_K_DECAY * answered))
+
+
+def get(cur, table, key, key_value):
+    """
+    Return the (rating, answered) pair for the row of `table` whose `key`
+    is `key_value`.  Without a row, a question is rated by question_prior()
+    and anything else has INITIAL_RATING.
+    """
+
+    if table == 'question_ratings':
+        cur.execute('SELECT question_ratings.rating, question_ratings.answered, questions.difficulty'
+                    ' FROM questions LEFT JOIN question_ratings ON question_ratings.question_id = questions.question_id'
+                    ' WHERE questions.question_id = ?', (key_value,))
+        row = cur.fetchone()
+        if row is not None and row[0] is None:
+            return question_prior(row[2]), 0
+    else:
+        cur.execute('SELECT rating, answered FROM {} WHERE {} = ?'.format(table, key), (key_value,))
+        row = cur.fetchone()
+    if row is None:
+        return INITIAL_RATING, 0
+    return row[0], row[1]
+
+
+def update(cur, user_id, question_id, correct):
+    """
+    Update the ratings of a user and a question after the user answered the
+    question.  Nothing is committed, so the update is part of the caller's
+    transaction.  Returns the new (skill, difficulty) ratings.
+    """
+
+    skill, user_answered = get(cur, 'user_ratings', 'user_id', user_id)
+    difficulty, question_answered = get(cur, 'question_ratings', 'question_id', question_id)
+    surprise = (1.0 if correct else 0.0) - expected(skill, difficulty)
+    skill += k_factor(user_answered) * surprise
+    difficulty -= k_factor(question_answered) * surprise
+    cur.execute('INSERT OR REPLACE INTO user_ratings VALUES(?, ?, ?)', (user_id, skill, user_answered + 1))
+    cur.execute('INSERT OR REPLACE INTO question_ratings VALUES(?, ?, ?)', (question_id, difficulty, question_answered + 1))
+    return skill, difficulty
+
+
+def _load_priors(conn, question_ids):
+    """Return an array of the question_prior() of each of `question_ids`."""
+    cur = conn.cursor()
+    cur.row_factory = None
+    difficulties = dict(cur.execute('SELECT question_id, difficulty FROM questions'))
+    return numpy.array([question_prior(difficulties.get(question_id)) for question_id in question_ids.tolist()],
+                       dtype=numpy.float64)
+
+
+def _load_answers(conn, chunk_size):
+    """Return arrays of the user ids, question ids and correctness of every answer."""
+    cur = conn.cursor()
+    # Plain tuples are much faster to fetch than sqlite3.Row objects.
+    cur.row_factory = None
+    cur.execute('SELECT user_id, question_id, coalesce(correct, 0) FROM questionresults')
+    chunks = []
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        chunks.append(numpy.array(rows, dtype=numpy.int64))
+    if not chunks:
+        return numpy.zeros((3, 0), dtype=numpy.int64)
+    return numpy.concatenate(chunks).T
+
+
+def recompute(conn, iterations=20, regularization=REGULARIZATION, chunk_size=1 << 20):
+    """
+    Fit every rating from all the answers in questionresults, replacing the
+    ratings kept by update(), and commit.  Returns the number of answers.
+
+    This fits the Rasch model to all the answers at once rather than replaying
+    them one at a time, taking a Newton step for all the users and then for
+    all the questions on each iteration.  Each step is a few passes over
+    arrays of all the answers, so tens of millions of answers take minutes.
+
+    >>> import sqlite3
+    >>> conn = sqlite3.connect(':memory:')
+    >>> conn.executescript('''
+    ...     CREATE TABLE questions(question_id INTEGER PRIMARY KEY, difficulty INTEGER);
+    ...     CREATE TABLE questionresults(game_id, question_id, user_id, answer_id, correct);
+    ...     CREATE TABLE user_ratings(user_id INTEGER PRIMARY KEY, rating REAL, answered INTEGER);
+    ...     CREATE TABLE question_ratings(question_id INTEGER PRIMARY KEY, rating REAL, answered INTEGER);
+    ... ''') and None
+    >>> conn.executemany('INSERT INTO questions VALUES(?, ?)', [(1, 1), (2, 1), (3, 1), (4, 0), (5, 2)]) and None
+    >>> conn.executemany('INSERT INTO questionresults VALUES(0, ?, ?, 0, ?)',
+    ...     [(1, 1, 1), (2, 1, 1), (3, 1, 0), (1, 2, 1), (2, 2, 0), (3, 2, 0), (4, 1, 1), (5, 1, 1)]) and None
+    >>> recompute(conn)
+    8
+    >>> skills = [row[0] for row in conn.execute('SELECT rating FROM user_ratings ORDER BY user_id')]
+    >>> skills[0] > 0 > skills[1]
+    True
+    >>> difficulties = [row[0] for row in conn.execute('SELECT rating FROM question_ratings ORDER BY question_id')]
+    >>> difficulties[0] < difficulties[1] < difficulties[2]
+    True
+
+    Questions with the same answers are still rated by their band:
+
+    >>> difficulties[3] < difficulties[4]
+    True
+    >>> list(conn.execute('SELECT question_id, answered FROM question_ratings'))
+    [(1, 2), (2, 2), (3, 2), (4, 1), (5, 1)]
+    """
+
+    if numpy is None:
+        raise RuntimeError('recomputing ratings needs NumPy')
+
+    users, questions, correct = _load_answers(conn, chunk_size)
+    user_ids, users = numpy.unique(users, return_inverse=True)
+    question_ids, questions = numpy.unique(questions, return_inverse=True)
+    correct = correct.astype(numpy.float64)
+    user_answered = numpy.bincount(users, minlength=len(user_ids))
+    question_answered = numpy.bincount(questions, minlength=len(question_ids))
+
+    skill = numpy.full(len(user_ids), INITIAL_RATING)
+    priors = _load_priors(conn, question_ids)
+    difficulty = priors.copy()
+    for _ in range(iterations):
+        for ratings, prior, index, sign in ((skill, INITIAL_RATING, users, 1.0), (difficulty, priors, questions, -1.0)):
+            p = 1.0 / (1.0 + numpy.exp(difficulty[questions] - skill[users]))
+            # Gradient and curvature of the log likelihood, with a Gaussian
+            # prior centred on each rating's prior.
+            gradient = sign * numpy.bincount(index, correct - p, len(ratings)) - regularization * (ratings - prior)
+            curvature = numpy.bincount(index, p * (1.0 - p), len(ratings)) + regularization
+            ratings += gradient / curvature
+
+    conn.execute('DELETE FROM user_ratings')
+    conn.executemany('INSERT INTO user_ratings VALUES(?, ?, ?)',
+                     zip(user_ids.tolist(), skill.tolist(), user_answered.tolist()))
+    conn.execute('DELETE FROM question_ratings')
+    conn.executemany('INSERT INTO question_ratings VALUES(?, ?, ?)',
+                     zip(question_ids.tolist(), difficulty.tolist(), question_answered.tolist()))
+    conn.commit()
+    return len(correct)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+'''
+Recompute every user's scores in each category from all the answers
+recorded so far, replacing the running totals kept as they answer.
+'''
+
+import sqlite3
+import time
+
+conn = sqlite3.connect('trivia.db')
+start = time.time()
+conn.execute('DELETE FROM scores')
+# Answers are numbered in the order they were recorded by the questionresults
+# rowid.  Each wrong answer starts a new run, so a run's streak is the number
+# of right answers in it, and the current streak is the last run's.
+conn.execute("""
+    WITH answers AS (
+        SELECT questionresults.user_id, games.category_id, coalesce(questionresults.correct, 0) AS correct,
+               min(max(CAST(questions.difficulty AS INTEGER), 0), 2) AS band,
+               SUM(1 - coalesce(questionresults.correct, 0)) OVER (
+                   PARTITION BY questionresults.user_id, games.category_id ORDER BY questionresults.rowid) AS run
+        FROM questionresults
+        JOIN games ON games.game_id = questionresults.game_id
+        JOIN questions ON questions.question_id = questionresults.question_id
+    ),
+    runs AS (
+        SELECT user_id, category_id, run, SUM(correct) AS length
+        FROM answers GROUP BY user_id, category_id, run
+    ),
+    last_runs AS (
+        SELECT user_id, category_id, MAX(run) AS run, MAX(length) AS best_streak
+        FROM runs GROUP BY user_id, category_id
+    )
+    INSERT INTO scores
+    SELECT answers.user_id, answers.category_id, COUNT(*), SUM(correct),
+           (SELECT length FROM runs WHERE runs.user_id = answers.user_id AND runs.category_id = answers.category_id
+                                          AND runs.run = last_runs.run),
+           last_runs.best_streak,
+           SUM(band = 0), SUM(band = 0 AND correct), SUM(band = 1), SUM(band = 1 AND correct),
+           SUM(band = 2), SUM(band = 2 AND correct)
+    FROM answers
+    JOIN last_runs ON last_runs.user_id = answers.user_id AND last_runs.category_id = answers.category_id
+    GROUP BY answers.user_id, answers.category_id
+""")
+conn.commit()
+count = conn.execute('SELECT COUNT(*) FROM scores').fetchone()[0]
+print('Rebuilt {} scores in {:.1f}s'.format(count, time.time() - start))
@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+
+'''
+Fit every user's and question's rating again from all the answers recorded
+so far.  Needs NumPy.
+'''
+
+import sqlite3
+import time
+
+import ratings
+
+conn = sqlite3.connect('trivia.db')
+start = time.time()
+count = ratings.recompute(conn)
+print('Recomputed ratings from {} answers in {:.1f}s'.format(count, time.time() - start))
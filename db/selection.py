@@ -0,0 +1,208 @@
+'''
+Choosing questions whose difficulty rating is close to a player's skill.
+
+Each category's questions are kept in memory sorted by rating (see
+ratings.py), so the questions nearest a target rating are found with a
+binary search and a walk outwards from there.  Walking outwards also moves
+into the neighbouring difficulty bands when the nearest questions have all
+been seen.  Questions from a player's recent games are skipped, using a
+bitmap of question ids.
+'''
+
+import bisect
+import math
+import random
+
+from . import ratings
+from . import versions
+from .cache import LRUCache, SharedCache
+
+__all__ = ['QuestionIndex', 'SeenQuestions', 'select']
+
+# The chance of answering correctly that selected questions aim for.
+TARGET_SUCCESS = 0.7
+
+# Questions from this many of a player's most recent games are not repeated
+# while there are others to choose from.
+RECENT_GAMES = 20
+
+# Questions are picked at random from this many times as many of the nearest
+# unseen questions, so games with the same player and category differ.
+CANDIDATES_PER_QUESTION = 3
+
+# How many categories' indexes to keep, and for how many seconds before they
+# are rebuilt with the latest ratings.
+INDEX_CACHE_SIZE = 100
+INDEX_TTL = 5 * 60
+
+# The most bytes a pickled index may take up in a shared index cache (see
+# share_indexes()); bigger ones are built by each process.
+SHARED_INDEX_SIZE = 256 * 1024
+
+
+class QuestionIndex(object):
+    """
+    The questions of one category sorted by difficulty rating.
+
+    >>> index = QuestionIndex([(1.0, 10), (-1.0, 11), (0.1, 12), (2.0, 13)])
+    >>> index.nearest(0.0, 2)
+    [12, 11]
+    >>> index.nearest(0.0, 2, seen=lambda question_id: question_id == 12)
+    [11, 10]
+    >>> index.nearest(5.0, 10)
+    [13, 10, 12, 11]
+    """
+
+    def __init__(self, rated_questions):
+        rated_questions = sorted(rated_questions)
+        self.ratings = [rating for rating, question_id in rated_questions]
+        self.question_ids = [question_id for rating, question_id in rated_questions]
+
+    def __len__(self):
+        return len(self.question_ids)
+
+    @classmethod
+    def load(cls, conn, category_id):
+        """
+        Build the index of a category.  Questions that have never been
+        answered are rated by ratings.question_prior().
+        """
+
+        cur = conn.execute('SELECT question_ratings.rating, questions.difficulty, questions.question_id'
+                           ' FROM questions LEFT JOIN question_ratings ON question_ratings.question_id = questions.question_id'
+                           ' WHERE questions.category = ?', (category_id,))
+        return cls((ratings.question_prior(difficulty) if rating is None else rating, question_id)
+                   for rating, difficulty, question_id in cur)
+
+    def nearest(self, target, k, seen=None):
+        """
+        Return the ids of up to `k` questions rated closest to `target`,
+        closest first, skipping those for which `seen(question_id)` is true.
+        """
+
+        found = []
+        below = bisect.bisect_left(self.ratings, target) - 1
+        above = below + 1
+        while len(found) < k and (below >= 0 or above < len(self.ratings)):
+            if above >= len(self.ratings) or (below >= 0 and target - self.ratings[below] <= self.ratings[above] - target):
+                question_id = self.question_ids[below]
+                below -= 1
+            else:
+                question_id = self.question_ids[above]
+                above += 1
+            if seen is None or not seen(question_id):
+                found.append(question_id)
+        return found
+
+
+class SeenQuestions(object):
+    """
+    A set of question ids stored as a bitmap, one bit per question id.
+
+    >>> seen = SeenQuestions([3, 17])
+    >>> 3 in seen, 4 in seen, 17 in seen, 1000 in seen
+    (True, False, True, False)
+    >>> seen.add(1000)
+    >>> 1000 in seen, len(seen.bits)
+    (True, 126)
+    """
+
+    def __init__(self, question_ids=()):
+        self.bits = bytearray()
+        for question_id in question_ids:
+            self.add(question_id)
+
+    def add(self, question_id):
+        byte = question_id >> 3
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(byte + 1 - len(self.bits)))
+        self.bits[byte] |= 1 << (question_id & 7)
+
+    def __contains__(self, question_id):
+        byte = question_id >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] & (1 << (question_id & 7)))
+
+    @classmethod
+    def load(cls, conn, user_id, games=RECENT_GAMES):
+        """Return the questions in a user's most recent games."""
+        seen = cls()
+        for row in conn.execute('SELECT questions FROM games WHERE user_id = ? ORDER BY game_id DESC LIMIT ?', (user_id, games)):
+            for question_id in row[0].split(','):
+                seen.add(int(question_id))
+        return seen
+
+
+# Category id -> QuestionIndex.
+_indexes = LRUCache(INDEX_CACHE_SIZE, ttl=INDEX_TTL)
+versions.watch('questions', lambda: _indexes.clear())
+
+
+def share_indexes(path):
+    """
+    Keep the indexes in a SharedCache in the file `path` rather than in
+    this process, so that server processes using the same file build each
+    index only once between them.
+    """
+
+    global _indexes
+    _indexes = SharedCache(path, INDEX_CACHE_SIZE, slot_size=SHARED_INDEX_SIZE, ttl=INDEX_TTL)
+
+
+def get_index(conn, category_id):
+    """
+    Return the index of a category, building it if it is not cached.
+    Changed ratings are picked up when the index expires.
+    """
+
+    versions.check(conn)
+    index = _indexes.get(category_id)
+    if index is None:
+        index = QuestionIndex.load(conn, category_id)
+        _indexes.put(category_id, index)
+    return index
+
+
+def questions_changed(changes):
+    """
+    Drop the cached indexes when questions are added or removed, so new
+    questions can be chosen straight away.  Called by the models after
+    each commit that changes questions.
+    """
+
+    if any(change.action != 'update' for change in changes):
+        _indexes.clear()
+
+
+def target_rating(skill, success=TARGET_SUCCESS):
+    """
+    Return the difficulty rating a player with `skill` answers correctly
+    with probability `success`.
+
+    >>> target_rating(0.0, 0.5)
+    0.0
+    >>> round(target_rating(1.0, 0.7), 3)
+    0.153
+    """
+
+    return skill - math.log(success / (1.0 - success))
+
+
+def select(conn, user_id, category_id, n, success=TARGET_SUCCESS):
+    """
+    Return the ids of `n` questions from a category for a user, rated near
+    the difficulty the user answers correctly with probability `success`,
+    or fewer if the category has fewer questions.  Questions from the user's
+    recent games are only chosen if there are not enough others.
+    """
+
+    index = get_index(conn, category_id)
+    skill, answered = ratings.get(conn.cursor(), 'user_ratings', 'user_id', user_id)
+    target = target_rating(skill, success)
+    seen = SeenQuestions.load(conn, user_id)
+
+    candidates = index.nearest(target, n * CANDIDATES_PER_QUESTION, seen.__contains__)
+    if len(candidates) < n:
+        candidates.extend(index.nearest(target, n - len(candidates), lambda question_id: question_id not in seen))
+    # Keep the chosen questions in order of closeness to the target.
+    chosen = sorted(random.sample(range(len(candidates)), min(n, len(candidates))))
+    return [candidates[i] for i in chosen]
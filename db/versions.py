@@ -0,0 +1,98 @@
+'''
+Keeping in-memory caches in step with writes by other processes.
+
+Several server processes may share one database, and each keeps its own
+caches.  Changes made through the models in this process reach its caches
+through the model hooks (see models.py); this module notices the changes
+made by the others.
+
+SQLite's PRAGMA data_version changes when another connection commits to the
+database, which is cheap to ask about, and triggers (see create_db.py) count
+the changes to each cached table in table_versions.  So check() does nothing
+more than ask for data_version unless another process has committed, and then
+only invalidates the caches of the tables whose counts have moved.
+'''
+
+import sqlite3
+
+__all__ = ['watch', 'check', 'committed']
+
+# Table name -> the functions that invalidate the caches of the table.
+_watchers = {}
+
+# The data_version and table versions last seen by check().
+_data_version = None
+_versions = {}
+
+
+def watch(table, invalidate):
+    """Call `invalidate()` when check() finds that another process changed `table`."""
+    _watchers.setdefault(table, []).append(invalidate)
+
+
+def _read_versions(conn):
+    cur = conn.cursor()
+    cur.row_factory = None
+    try:
+        return dict(cur.execute('SELECT table_name, version FROM table_versions'))
+    except sqlite3.OperationalError:
+        # The database predates table_versions, so any table may have changed.
+        return None
+
+
+def check(conn):
+    """
+    Invalidate the caches of the tables that other processes have changed
+    since the last check.  Call it before reading a cache of a watched table.
+
+    >>> conn = sqlite3.connect('file:versions?mode=memory&cache=shared', uri=True)
+    >>> other = sqlite3.connect('file:versions?mode=memory&cache=shared', uri=True)
+    >>> conn.executescript(\'\'\'
+    ...     CREATE TABLE table_versions(table_name TEXT PRIMARY KEY, version INTEGER NOT NULL);
+    ...     INSERT INTO table_versions VALUES('categories', 0);
+    ...     INSERT INTO table_versions VALUES('questions', 0);
+    ... \'\'\') and None
+    >>> invalidated = []
+    >>> watch('categories', lambda: invalidated.append('categories'))
+    >>> watch('questions', lambda: invalidated.append('questions'))
+    >>> check(conn)
+    >>> _ = other.execute("UPDATE table_versions SET version = 1 WHERE table_name = 'questions'")
+    >>> other.commit()
+    >>> check(conn)
+    >>> check(conn)
+    >>> invalidated
+    ['questions']
+    >>> _watchers.clear()
+    """
+
+    global _data_version, _versions
+    data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+    if data_version == _data_version:
+        return
+    versions = _read_versions(conn)
+    if _data_version is not None:
+        for table, invalidates in _watchers.items():
+            if versions is None or _versions is None or versions.get(table) != _versions.get(table):
+                for invalidate in invalidates:
+                    invalidate()
+    _data_version = data_version
+    _versions = versions
+
+
+def committed(conn):
+    """
+    Take note of the changes this process has just committed, so check()
+    doesn't take them for another process's.  This process's caches learn
+    of them from the model hooks.
+    """
+
+    global _versions
+    # If another process has committed since the last check, its changes
+    # could be mistaken for ours, so they are left for check() to find.
+    if _data_version is not None and conn.execute('PRAGMA data_version').fetchone()[0] == _data_version:
+        _versions = _read_versions(conn)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,215 @@
+'''
+Versioned JSON API for the game flow, for clients that don't want HTML.
+
+All urls start with API_PREFIX (/api/v1) and need the same login cookie as
+the site.  Request bodies may be JSON objects or ordinary form fields.
+
+* POST /api/v1/games                 - create a game from category_id and
+                                       difficulty, or "auto" to match the
+                                       player's skill; returns the game with
+                                       all of its questions
+* GET  /api/v1/games/<id>            - the game's progress and score
+* GET  /api/v1/games/<id>/questions  - all of the game's questions
+* GET  /api/v1/games/<id>/question   - the question to answer next
+* POST /api/v1/games/<id>/answers    - answer the current question with
+                                       answer_id
+* GET  /api/v1/games/<id>/results    - the answers given so far
+
+Questions never include which answer is correct.  Their answers are shuffled
+the same way on every request, so the question list of a game never changes
+and is served with a Cache-Control header; every GET gets an ETag, and
+conditional requests are answered with 304 Not Modified.
+
+Errors are reported with the HTTP status and a body of {"error": message}.
+'''
+
+import functools
+import json
+import random
+
+from db.models import User, Game, QuestionResult, StaleGameError
+from . import get_uid
+
+API_PREFIX = '/api/v1'
+
+# How long clients may cache responses that never change, in seconds.
+CACHE_MAX_AGE = 24 * 60 * 60
+
+
+def write_json(request, data, status=200):
+    """Write `data` as compact JSON."""
+    request.set_status(status)
+    request.set_header('Content-Type', 'application/json; charset=UTF-8')
+    request.write(json.dumps(data, separators=(',', ':')))
+
+
+def api_error(request, status, message):
+    write_json(request, {'error': message}, status)
+
+
+def get_json_field(request, name):
+    """Return a field of a JSON request body, or else a form field, or None."""
+    if request.request.headers.get('Content-Type', '').startswith('application/json'):
+        if not hasattr(request, 'json_body'):
+            try:
+                request.json_body = json.loads(request.request.body.decode())
+            except ValueError:
+                request.json_body = {}
+            if not isinstance(request.json_body, dict):
+                request.json_body = {}
+        return request.json_body.get(name)
+    return request.get_field(name)
+
+
+def api_user(f):
+    """Decorator to require a logged-in user, providing request.user, or fail with 401."""
+    @functools.wraps(f)
+    def wrapped(request, *args, **kwargs):
+        user_id = get_uid(request)
+        request.user = User.find(id=user_id) if user_id is not None else None
+        if request.user is None:
+            api_error(request, 401, 'not logged in')
+            return
+        return f(request, *args, **kwargs)
+    return wrapped
+
+
+def api_game(f):
+    """
+    Decorator for handlers of a game url, which replaces the game id argument
+    with the Game, or fails with 404 unless the game belongs to the user.
+    """
+    @api_user
+    @functools.wraps(f)
+    def wrapped(request, game_id, *args, **kwargs):
+        game = Game.find_active(int(game_id))
+        if game is None or game.user_id != request.user.id:
+            api_error(request, 404, 'no such game')
+            return
+        return f(request, game, *args, **kwargs)
+    return wrapped
+
+
+def method_not_allowed(request, *args):
+    api_error(request, 405, 'method not allowed')
+
+
+def game_json(game):
+    return {
+        'id': game.id,
+        'category_id': game.category_id,
+        'difficulty': game.difficulty,
+        'question_index': game.question_index,
+        'question_count': len(game.question_ids),
+        'score': game.score,
+        'finished': game.is_end(),
+    }
+
+
+def question_json(game, index, question):
+    answers = [{'id': answer.id, 'text': answer.text} for answer in game.get_answers(question.id)]
+    # Seeded by game and question, so the order is stable across requests
+    # (and so cacheable) but differs between games.
+    random.Random('{}:{}'.format(game.id, question.id)).shuffle(answers)
+    return {'index': index, 'id': question.id, 'question': question.question, 'answers': answers}
+
+
+def questions_json(game):
+    return [question_json(game, index, question) for index, question in enumerate(game.get_questions())]
+
+
+@api_user
+def create_game_handler(request):
+    try:
+        category_id = int(get_json_field(request, 'category_id'))
+        difficulty = get_json_field(request, 'difficulty')
+        if difficulty != 'auto':
+            difficulty = float(difficulty)
+    except (TypeError, ValueError):
+        api_error(request, 400, 'category_id and difficulty are required')
+        return
+    if difficulty == 'auto':
+        game = Game.create_adaptive(request.user.id, category_id)
+    else:
+        game = Game.create(request.user.id, category_id, difficulty)
+    if game is None:
+        api_error(request, 404, 'there are no questions in this category and difficulty')
+        return
+    data = game_json(game)
+    data['questions'] = questions_json(game)
+    request.set_header('Location', '{}/games/{}'.format(API_PREFIX, game.id))
+    write_json(request, data, 201)
+
+
+@api_game
+def game_state_handler(request, game):
+    request.set_header('Cache-Control', 'no-cache')
+    write_json(request, game_json(game))
+
+
+@api_game
+def questions_handler(request, game):
+    request.set_header('Cache-Control', 'private, max-age={}'.format(CACHE_MAX_AGE))
+    write_json(request, questions_json(game))
+
+
+@api_game
+def current_question_handler(request, game):
+    if game.is_end():
+        api_error(request, 409, 'the game has finished')
+        return
+    request.set_header('Cache-Control', 'no-cache')
+    write_json(request, question_json(game, game.question_index, game.get_curr_question()))
+
+
+@api_game
+def answer_handler(request, game):
+    if game.is_end():
+        api_error(request, 409, 'the game has finished')
+        return
+    try:
+        answer_id = int(get_json_field(request, 'answer_id'))
+    except (TypeError, ValueError):
+        api_error(request, 400, 'answer_id is required')
+        return
+    question_id = game.question_ids[game.question_index]
+    answers = game.get_answers(question_id)
+    if answer_id not in [answer.id for answer in answers]:
+        api_error(request, 400, 'that is not an answer to the current question')
+        return
+
+    try:
+        correct = game.submit_answer(question_id, answer_id)
+    except StaleGameError:
+        api_error(request, 409, 'the game has moved on from that question')
+        return
+    game.game_nextquestion()
+    correct_answer = [answer for answer in answers if answer.correct]
+    data = game_json(game)
+    data['correct'] = bool(correct)
+    data['correct_answer_id'] = correct_answer[0].id if correct_answer else None
+    write_json(request, data)
+
+
+@api_game
+def results_handler(request, game):
+    if game.is_end():
+        request.set_header('Cache-Control', 'private, max-age={}'.format(CACHE_MAX_AGE))
+    else:
+        request.set_header('Cache-Control', 'no-cache')
+    # Other players' answers are stored against the game too if it was played in a room.
+    results = {result.question_id: result for result in QuestionResult.find_all(game_id=game.id, user_id=request.user.id)}
+    data = game_json(game)
+    data['results'] = []
+    for question_id in game.question_ids:
+        result = results.get(question_id)
+        if result is None:
+            continue
+        correct_answer = result.correct_answer()
+        data['results'].append({
+            'question_id': question_id,
+            'answer_id': result.answer_id,
+            'correct': bool(result.correct),
+            'correct_answer_id': correct_answer.id if correct_answer else None,
+        })
+    write_json(request, data)
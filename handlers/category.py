@@ -1,9 +1,15 @@
+from urllib.parse import urlencode
+
 from templating import render_template
 from db.models import Category, Question
 from .error import create_error
 from . import template_paths, grab_user
 
 
+# Questions shown on each page of a category.
+PAGE_SIZE = 50
+
+
 @grab_user
 def category_handler(request, category_id):
     cat = Category.find(category_id=category_id)
@@ -15,10 +21,17 @@ def category_handler(request, category_id):
     if request.user:
         u_name = request.user.username
 
+    # Only the question text is shown.
+    try:
+        questions, after = Question.find_page(after=request.get_field('after'), limit=PAGE_SIZE, fields=['question'], category=category_id)
+    except ValueError:
+        questions, after = Question.find_page(limit=PAGE_SIZE, fields=['question'], category=category_id)
+
     category_page = render_template(template_paths["submit_category"], {
         "user_name": u_name,
         "category_name": cat.name,
-        'questions': Question.find_iter(category=category_id)
+        'questions': questions,
+        'next_url': '/category/{}?{}'.format(category_id, urlencode({'after': after})) if after else ''
     })
     request.write(category_page)
 
@@ -31,6 +44,6 @@ def category_list_handler(request):
 
     list_categories_page = render_template(template_paths["categories"], {
         "user_name": u_name,
-        "categories": Category.find_iter()
+        "categories": Category.find_records()
     })
     request.write(list_categories_page)
@@ -1,4 +1,4 @@
-from db.models import User, Game
+from db.models import User, Game, StaleGameError
 from templating import render_template
 from db.models import User
 from . import template_paths
@@ -15,7 +15,10 @@ def game_handler(request):
     if user_id_cookie:
         user = User.find(user_id=int(user_id_cookie.decode()))
         if category_id is not None and difficulty is not None:
-            game = Game.create(user.id, int(category_id), float(difficulty))
+            if difficulty == 'auto':
+                game = Game.create_adaptive(user.id, int(category_id))
+            else:
+                game = Game.create(user.id, int(category_id), float(difficulty))
             if not game:
                 request.write('There are no questions in this category and difficulty. :(')
                 return
@@ -32,7 +35,7 @@ def get_question_handler(request, question_index):
     u_name = ""
     if u_id is not None:
         u_id = u_id.decode("UTF-8")
-        u_name = User.find(user_id=u_id)
+        u_name = User.find(['username'], user_id=u_id)
         u_name = u_name.username
 
     game_id = request.get_secure_cookie('game_id')
@@ -41,13 +44,13 @@ def get_question_handler(request, question_index):
         return
 
     game_id = game_id.decode()
-    game = Game.find(game_id=int(game_id))
+    game = Game.find_active(int(game_id))
     if game:
         question = game.get_question(int(question_index))
         if not question:
             create_error(request, "That question doesn't exist!")
             return
-        answers = question.get_answers()
+        answers = game.get_answers(question.id)
         random.shuffle(answers)
         request.write(render_template(template_paths["questions"],
             {"question": question, "answers": answers, "question_index": str(int(question_index)+1), "user_name":u_name}))
@@ -60,9 +63,14 @@ def submit_question_handler(request, answer_id):
     user_id_cookie = request.get_secure_cookie("user_id")
 
     if game_id and user_id_cookie and answer_id:
-        game = Game.find(game_id=int(game_id.decode()))
-        game.submit_answer(game.question_ids[game.question_index], answer_id)
-        score = game.game_nextquestion()
+        game = Game.find_active(int(game_id.decode()))
+        try:
+            game.submit_answer(game.question_ids[game.question_index], answer_id)
+        except StaleGameError:
+            # The game was played on elsewhere; show the question it is on.
+            game = Game.find_active(game.id)
+        else:
+            score = game.game_nextquestion()
         if game.question_index >= len(game.question_ids):
             request.redirect('/post_game')
         else:
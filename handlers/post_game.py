@@ -18,13 +18,13 @@ def post_game_handler(request):
     score = game.score
     if u_id is not None:
         u_id = u_id.decode("UTF-8")
-        u_name = User.find(user_id=u_id)
+        u_name = User.find(['username'], user_id=u_id)
         u_name = u_name.username.lower().capitalize()
 
     template_values = {}
     template_values['user_name'] = u_name
     template_values['score'] = score
-    template_values['questions'] = game.get_questions()
+    template_values['question_count'] = len(game.question_ids)
     template_values['question_results'] = game.get_question_results()
     post_game_page = render_template(template_paths["post_game"], template_values)
     request.write(post_game_page)
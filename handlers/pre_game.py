@@ -8,7 +8,7 @@ def pre_game_handler(request):
     u_name = ""
     if u_id is not None:
         u_id = u_id.decode("UTF-8")
-        u_name = User.find(user_id=u_id)
+        u_name = User.find(['username'], user_id=u_id)
         u_name = u_name.username
 
     pre_game_page = render_template(template_paths["pre_game"], {"user_name": u_name, 'categories': Category.find_all()})
@@ -1,16 +1,27 @@
+from urllib.parse import urlencode
+
 from templating import render_template
-from db.models import Game
-# from difficulty import difficulty
+from db.models import Game, Score
 from . import template_paths, require_user
 
 
+# Games shown on each page of a profile, newest first.
+PAGE_SIZE = 20
+
+
 @require_user
 def profile_handler(request):
     user = request.user
+    try:
+        games, after = Game.find_page('-id', after=request.get_field('after'), limit=PAGE_SIZE, user_id=user.id)
+    except ValueError:
+        games, after = Game.find_page('-id', limit=PAGE_SIZE, user_id=user.id)
     profile_page = render_template(template_paths["profile"], {
         "user_name": user.username,
         "email": user.email,
-        # "score": difficulty(user.id),
-        "games": Game.find_iter(user_id=user.id)
+        "scores": Score.find_for_user(user.id),
+        "games_played": Game.count(user_id=user.id),
+        "games": games,
+        "next_url": '/profile?' + urlencode({'after': after}) if after else ''
     })
     request.write(profile_page)
@@ -1,38 +1,49 @@
 from db.models import Question
-from db.models import Answer
 from db.models import Category
 from templating import render_template
 from db.models import User
 from . import template_paths
 
 
+FIELDS = ('question', 'correct_answer', 'wrong_answer_1', 'wrong_answer_2', 'wrong_answer_3', 'categories')
+
+
 def new_question_handler(request):
-    question = request.get_field("question")
-    correct_answer = request.get_field("correct_answer")
-    wrong_answer_1 = request.get_field("wrong_answer_1")
-    wrong_answer_2 = request.get_field("wrong_answer_2")
-    wrong_answer_3 = request.get_field("wrong_answer_3")
-    category = request.get_field("categories")
+    fields = {name: request.get_field(name) or '' for name in FIELDS}
+    question = fields["question"]
+    correct_answer = fields["correct_answer"]
+    wrong_answer_1 = fields["wrong_answer_1"]
+    wrong_answer_2 = fields["wrong_answer_2"]
+    wrong_answer_3 = fields["wrong_answer_3"]
+    category = fields["categories"]
+
+    # Show the user any questions that look the same before adding theirs,
+    # unless they have already seen them and submitted again.
+    if not request.get_field("confirm"):
+        duplicates = Question.find_similar(question, category)
+        if duplicates:
+            write_form(request, fields, duplicates)
+            return
 
     #print(question, correct_answer, wrong_answer_1, wrong_answer_2, wrong_answer_3, category)
-    question = Question.create(question, category)
-    Answer.create(question.id, True, correct_answer)
-    Answer.create(question.id, False, wrong_answer_1)
-    Answer.create(question.id, False, wrong_answer_2)
-    Answer.create(question.id, False, wrong_answer_3)
+    Question.create_with_answers(question, category, [correct_answer, wrong_answer_1, wrong_answer_2, wrong_answer_3])
     request.redirect('/category/' + category)
 
-def new_question_form(request):
+def write_form(request, fields, duplicates):
     u_id = request.get_secure_cookie ('user_id')
     u_name = ""
     if u_id is not None:
         u_id = u_id.decode("UTF-8")
-        u_name = User.find(user_id=u_id)
+        u_name = User.find(['username'], user_id=u_id)
         u_name = u_name.username
     list_of_categories = Category.find_all()
-    question_new = render_template(template_paths["submit"], {"list_of_categories": list_of_categories,"user_name":u_name})
+    question_new = render_template(template_paths["submit"], {"list_of_categories": list_of_categories,"user_name":u_name,
+                                                              "fields": fields, "duplicates": duplicates})
     request.write(question_new)
 
+def new_question_form(request):
+    write_form(request, dict.fromkeys(FIELDS, ''), [])
+
 def get_question_handler(request, question_id):
   request.write("""<!DOCTYPE html>
 <html>
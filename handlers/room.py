@@ -0,0 +1,238 @@
+'''
+Multiplayer game rooms.
+
+Players join a game at /game/room/<game_id> and the page connects to
+/game/room/<game_id>/socket.  Every connection to the same game shares one
+GameRoom, which holds the game's questions and answers in memory, pushes each
+question to all the players at once and collects their answers.  Answers are
+written to the database in one batch when a question closes, either because
+every player has answered or because QUESTION_TIME ran out.
+
+Messages are JSON objects with a "type" field.  Players send:
+
+* {"type": "start"}                    - start the game (game owner only)
+* {"type": "answer", "answer_id": 12}  - answer the current question
+
+and receive:
+
+* {"type": "players", "players": [...]}  - someone joined or left
+* {"type": "question", "index": 0, "question": "...", "answers": [...]}
+* {"type": "answered", "count": 2}       - how many players have answered
+* {"type": "results", "question_id": 3, "correct_answer_id": 12, "players": [...]}
+* {"type": "end", "players": [...]}
+* {"type": "error", "message": "..."}   - the answers couldn't be saved, and
+                                         the question is sent again
+
+where "players" lists {"id", "username", "score"} objects, best score first.
+'''
+
+import json
+import random
+
+import tornado.ioloop
+import tornado.websocket
+from tornado.log import app_log
+
+from db.models import User, Game
+from templating import render_template
+from . import get_template, require_user
+from .error import create_error
+
+# Seconds players have to answer a question.
+QUESTION_TIME = 20
+
+
+class GameRoom(object):
+    """The in-memory state of a game shared by several players."""
+
+    # Game id -> GameRoom, for games that are being played.
+    rooms = {}
+
+    def __init__(self, game):
+        self.game = game
+        self.questions = game.get_questions()
+        self.answers = {question.id: game.get_answers(question.id) for question in self.questions}
+        self.index = game.question_index
+        self.started = False
+        # User id -> username and score, for everyone who has joined.
+        self.usernames = {}
+        self.scores = {}
+        # Missing a question would leave a player behind, so players who
+        # can't keep up are disconnected.  room.js reconnects them, and
+        # join() sends them the open question again.
+        self.connections = tornado.websocket.BroadcastGroup(policy=tornado.websocket.BroadcastGroup.DISCONNECT)
+        # User id -> Answer, for the current question.
+        self.answered = {}
+        # The timeout that closes the current question; None between questions.
+        self.timeout = None
+
+    @classmethod
+    def get(cls, game_id):
+        """Return the room for a game, or None if the game does not exist or has ended."""
+        room = cls.rooms.get(game_id)
+        if room is None:
+            game = Game.find_active(game_id)
+            if game is None or game.is_end():
+                return None
+            room = cls.rooms[game_id] = cls(game)
+        return room
+
+    def players(self):
+        players = [{'id': user_id, 'username': username, 'score': self.scores[user_id]}
+                   for user_id, username in self.usernames.items()]
+        players.sort(key=lambda player: player['score'], reverse=True)
+        return players
+
+    def playing(self):
+        """Return the ids of the users who are connected."""
+        return {connection.user.id for connection in self.connections}
+
+    def broadcast(self, message):
+        self.connections.broadcast(message)
+
+    def join(self, connection):
+        user = connection.user
+        self.connections.add(connection)
+        self.usernames[user.id] = user.username
+        self.scores.setdefault(user.id, 0)
+        self.broadcast({'type': 'players', 'players': self.players()})
+        if self.timeout is not None:
+            connection.write_message(self.question_message())
+
+    def leave(self, connection):
+        # The connection may already have been dropped from the group by a
+        # broadcast, so the checks below run whether or not it is found.
+        self.connections.discard(connection)
+        if not self.connections:
+            # Nobody is left, so stop the clock and drop the room.  The
+            # questions closed so far are in the database, and the room is
+            # recreated from there if someone comes back.
+            if self.timeout is not None:
+                tornado.ioloop.IOLoop.current().remove_timeout(self.timeout)
+                self.timeout = None
+            self.rooms.pop(self.game.id, None)
+            return
+        self.broadcast({'type': 'players', 'players': self.players()})
+        if self.timeout is not None and self.playing() <= set(self.answered):
+            self.close_question()
+
+    def start(self, connection):
+        if self.started or connection.user.id != self.game.user_id:
+            return
+        self.started = True
+        self.ask()
+
+    def question_message(self):
+        question = self.questions[self.index]
+        answers = [{'id': answer.id, 'text': answer.text} for answer in self.answers[question.id]]
+        random.shuffle(answers)
+        return {'type': 'question', 'index': self.index,
+                'question': question.question, 'answers': answers}
+
+    def ask(self):
+        self.answered = {}
+        io_loop = tornado.ioloop.IOLoop.current()
+        self.timeout = io_loop.add_timeout(io_loop.time() + QUESTION_TIME, self.close_question)
+        self.broadcast(self.question_message())
+
+    def answer(self, connection, answer_id):
+        user_id = connection.user.id
+        if self.timeout is None or user_id in self.answered:
+            # No question is open, or this player has already answered it.
+            return
+        question = self.questions[self.index]
+        for answer in self.answers[question.id]:
+            if answer.id == answer_id:
+                break
+        else:
+            return
+        self.answered[user_id] = answer
+        self.broadcast({'type': 'answered', 'count': len(self.answered)})
+        if self.playing() <= set(self.answered):
+            self.close_question()
+
+    def close_question(self):
+        if self.timeout is not None:
+            tornado.ioloop.IOLoop.current().remove_timeout(self.timeout)
+            self.timeout = None
+
+        question = self.questions[self.index]
+        results = [(question.id, user_id, answer.id, 1 if answer.correct else 0)
+                   for user_id, answer in self.answered.items()]
+        try:
+            self.game.record_results(results, self.index + 1)
+        except Exception:
+            app_log.error('Could not save the results of game %d', self.game.id, exc_info=True)
+            # Nothing was saved, so the room stays on the question and
+            # the players answer it again.
+            self.broadcast({'type': 'error', 'message': "Your answers couldn't be saved, please answer again."})
+            self.ask()
+            return
+        for question_id, user_id, answer_id, correct in results:
+            self.scores[user_id] += correct
+        self.index += 1
+
+        correct_answer = [answer for answer in self.answers[question.id] if answer.correct]
+        self.broadcast({'type': 'results', 'question_id': question.id,
+                        'correct_answer_id': correct_answer[0].id if correct_answer else None,
+                        'players': self.players()})
+        if self.index < len(self.questions):
+            self.ask()
+        else:
+            self.broadcast({'type': 'end', 'players': self.players()})
+            self.rooms.pop(self.game.id, None)
+            for connection in list(self.connections):
+                self.connections.discard(connection)
+                connection.close()
+
+
+class GameRoomHandler(tornado.websocket.WebSocketHandler):
+    """A player's connection to a GameRoom."""
+
+    def get_compression_options(self):
+        # Without context takeover, a message broadcast to the room is
+        # compressed once for all the players instead of once per player.
+        return {'server_no_context_takeover': True}
+
+    def open(self, game_id):
+        self.room = None
+        user_id = self.get_secure_cookie('user_id')
+        self.user = User.find(user_id=int(user_id.decode())) if user_id else None
+        if self.user is None:
+            self.close(reason='not logged in')
+            return
+        self.room = GameRoom.get(int(game_id))
+        if self.room is None:
+            self.close(reason='no such game')
+            return
+        self.room.join(self)
+
+    def on_message(self, message):
+        if self.room is None:
+            return
+        try:
+            message = json.loads(message)
+            kind = message['type']
+        except (ValueError, TypeError, KeyError):
+            return
+        if kind == 'start':
+            self.room.start(self)
+        elif kind == 'answer' and isinstance(message.get('answer_id'), int):
+            self.room.answer(self, message['answer_id'])
+
+    def on_close(self):
+        if self.room is not None:
+            self.room.leave(self)
+
+
+@require_user
+def room_handler(request, game_id):
+    game = Game.find(game_id=int(game_id))
+    if game is None:
+        create_error(request, "That game doesn't exist!")
+        return
+    request.write(render_template(get_template('room'), {
+        'user_name': request.user.username,
+        'game_id': game.id,
+        'host': game.user_id == request.user.id,
+    }))
@@ -0,0 +1,31 @@
+from urllib.parse import urlencode
+
+from templating import render_template
+from db.models import Question
+from . import get_template, grab_user
+
+# Questions shown on each page of search results.
+PAGE_SIZE = 20
+
+
+def search_url(text, page):
+    return '/search?' + urlencode({'q': text, 'page': page})
+
+
+@grab_user
+def search_handler(request):
+    text = request.get_field('q') or ''
+    try:
+        page = max(int(request.get_field('page') or 1), 1)
+    except ValueError:
+        page = 1
+
+    # Fetch one extra question to tell whether there is a next page.
+    questions = Question.search(text, limit=PAGE_SIZE + 1, offset=(page - 1) * PAGE_SIZE)
+    request.write(render_template(get_template('search'), {
+        'user_name': request.user.username if request.user else '',
+        'query': text,
+        'questions': questions[:PAGE_SIZE],
+        'prev_url': search_url(text, page - 1) if page > 1 else '',
+        'next_url': search_url(text, page + 1) if len(questions) > PAGE_SIZE else '',
+    }))
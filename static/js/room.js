@@ -0,0 +1,121 @@
+// Client for a multiplayer game room; see handlers/room.py for the protocol.
+(function () {
+	var room = document.getElementById('room');
+	var scheme = location.protocol === 'https:' ? 'wss://' : 'ws://';
+	var url = scheme + location.host + '/game/room/' + room.getAttribute('data-game-id') + '/socket';
+	// Milliseconds to wait before reconnecting, doubled after each failed
+	// attempt up to MAX_RETRY_DELAY.
+	var RETRY_DELAY = 1000;
+	var MAX_RETRY_DELAY = 30000;
+	var retryDelay = RETRY_DELAY;
+	var socket;
+	var finished = false;
+	// Index of the question this player has answered, so that a question
+	// sent again after reconnecting isn't offered twice.
+	var answeredIndex = null;
+	// A message to show with the next question.
+	var notice = '';
+
+	function send(message) {
+		socket.send(JSON.stringify(message));
+	}
+
+	function text(id, value) {
+		document.getElementById(id).textContent = value;
+	}
+
+	function showPlayers(players) {
+		var list = document.getElementById('players');
+		list.innerHTML = '';
+		players.forEach(function (player) {
+			var item = document.createElement('li');
+			item.textContent = player.username + ': ' + player.score;
+			list.appendChild(item);
+		});
+	}
+
+	function showQuestion(message) {
+		text('question_index', 'Question ' + (message.index + 1));
+		text('question', message.question);
+		text('status', notice);
+		notice = '';
+		var list = document.getElementById('answers');
+		list.innerHTML = '';
+		if (message.index === answeredIndex) {
+			text('status', 'Waiting for the other players...');
+			return;
+		}
+		message.answers.forEach(function (answer) {
+			var item = document.createElement('li');
+			var link = document.createElement('a');
+			link.href = '#';
+			link.textContent = answer.text;
+			link.onclick = function () {
+				send({type: 'answer', answer_id: answer.id});
+				answeredIndex = message.index;
+				list.innerHTML = '';
+				text('status', 'Waiting for the other players...');
+				return false;
+			};
+			item.appendChild(link);
+			list.appendChild(item);
+		});
+	}
+
+	var start = document.getElementById('start');
+	if (start) {
+		start.onclick = function () {
+			send({type: 'start'});
+			start.parentNode.removeChild(start);
+		};
+	}
+
+	function onMessage(event) {
+		var message = JSON.parse(event.data);
+		if (message.type === 'players' || message.type === 'results') {
+			showPlayers(message.players);
+		} else if (message.type === 'question') {
+			showQuestion(message);
+		} else if (message.type === 'answered') {
+			text('status', message.count + ' answered');
+		} else if (message.type === 'error') {
+			// The question is sent again, to be answered again.
+			answeredIndex = null;
+			notice = message.message;
+		} else if (message.type === 'end') {
+			finished = true;
+			showPlayers(message.players);
+			text('question_index', 'Game over!');
+			text('question', '');
+			document.getElementById('answers').innerHTML = '';
+		}
+	}
+
+	function onClose(event) {
+		if (event.reason) {
+			text('status', event.reason);
+		}
+		// A normal closure with a reason means the server turned us away
+		// (not logged in, no such game); anything else, such as being
+		// dropped for falling behind (1008) or a lost network (1006), is
+		// worth another try.  On rejoining, the room sends the current
+		// question again.
+		if (finished || (event.code === 1000 && event.reason)) {
+			return;
+		}
+		setTimeout(connect, retryDelay);
+		retryDelay = Math.min(retryDelay * 2, MAX_RETRY_DELAY);
+	}
+
+	function connect() {
+		socket = new WebSocket(url);
+		socket.onopen = function () {
+			retryDelay = RETRY_DELAY;
+			text('status', '');
+		};
+		socket.onmessage = onMessage;
+		socket.onclose = onClose;
+	}
+
+	connect();
+})();
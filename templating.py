@@ -7,10 +7,16 @@ This code parses the templates into python and html.
 The python code can then be evaluated and added to the html to be displayed by a web browser
 '''
 import html
+
+from assets import static_url
+
 IF_TAG = ' if '
 INCLUDE_TAG = ' include '
 FOR_TAG = ' for '
 
+# Names available to every template, unless the scope overrides them.
+TEMPLATE_GLOBALS = {'static_url': static_url}
+
 class ParseError(Exception):
     '''
     Defines an exception for errors encounterd while parsing
@@ -342,7 +348,7 @@ def render_template(path, scope):
     with open(path) as p:
         lines = [line.strip() for line in p]
         template = ''.join(lines)
-    return Parser(template).eval(scope)
+    return Parser(template).eval(dict(TEMPLATE_GLOBALS, **scope))
 
 if __name__ == "__main__":
     import doctest
@@ -31,5 +31,9 @@ cd ..
 
 echo 'Running tests...'
 python3 templating.py || status=$?
+python3 -m db.cache || status=$?
+python3 -m db.versions || status=$?
+python3 -m db.ratings || status=$?
+python3 -m db.selection || status=$?
 python3 -m db.models || status=$?
 python3 -m tornado.testing tests/pages.py || status=$?
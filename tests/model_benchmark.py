@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+'''
+Measures the time and memory taken to load a million questions as Models,
+as records from Model.find_records(), and as plain sqlite3.Row objects.
+For comparison it also loads them as objects of a copy of the Question
+model with a __dict__, as models were before they had __slots__.
+
+Run it from the top of the repository:
+
+    $ python3 tests/model_benchmark.py [rows]
+'''
+
+import gc
+import os
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import models
+
+
+class DictQuestion(object):
+    def __init__(self, question_id, question, questions_answered, questions_correct, category, difficulty):
+        self.id = question_id
+        self.question = question
+        self.questions_answered = questions_answered
+        self.questions_correct = questions_correct
+        self.category = category
+        self.difficulty = difficulty
+
+
+def measure(name, load):
+    # Time and memory are measured separately, as tracing allocations slows
+    # them down.
+    gc.collect()
+    start = time.perf_counter()
+    rows = load()
+    elapsed = time.perf_counter() - start
+    del rows
+    gc.collect()
+    tracemalloc.start()
+    rows = load()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('{:<24} {:>6.2f}s {:>8.1f} MB {:>8.1f} MB peak'.format(name, elapsed, size / 2 ** 20, peak / 2 ** 20))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    conn.execute('CREATE TABLE questions(question_id INTEGER PRIMARY KEY, question TEXT, questions_answered INTEGER,'
+                 ' questions_correct INTEGER, category TEXT, difficulty REAL)')
+    conn.executemany('INSERT INTO questions VALUES(?, ?, 0, 0, ?, ?)',
+                     ((i, 'Question {}'.format(i), str(i % 10), i % 3) for i in range(count)))
+    conn.commit()
+    # Load through the models module, as the site does.
+    models.conn = conn
+
+    print('Loading {} questions'.format(count))
+    measure('sqlite3.Row', lambda: conn.execute('SELECT * FROM questions').fetchall())
+    measure('Model with __dict__', lambda: [DictQuestion(*row) for row in conn.execute('SELECT * FROM questions')])
+    measure('Model with __slots__', models.Question.find_all)
+    measure('Model.find_records()', models.Question.find_records)
+
+
+if __name__ == '__main__':
+    main()
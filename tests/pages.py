@@ -1,16 +1,40 @@
-from tornado.testing import AsyncHTTPTestCase
+from tornado import gen
+from tornado.httpclient import HTTPRequest
+from tornado.testing import AsyncHTTPTestCase, gen_test
 from tornado.web import create_signed_value
+from tornado.websocket import websocket_connect
 import re
 import random
+import handlers.category
+import handlers.profile
 from db.models import User
 from db.models import Category
 from db.models import Question
+from db.models import Answer
+from db.models import Game
+from db.models import QuestionResult
+from db.models import Score
+from db.models import Model, Change
+from db import models
+from db import ratings
+from db import selection
+from db import question_bank
+from db.cache import SharedCache
+import gzip
 import html
+import json
+import os
+import shutil
 import sqlite3
+import subprocess
+import sys
+import tempfile
+from urllib.parse import urlencode
 # Define regex patters to search for nav bar links
 pre_game_pattern = re.compile(r'href\ *\=\ *\"\/pre_game\"')
 submit_pattern = re.compile(r'href\ *\=\ *\"\/question\"')
 profile_pattern = re.compile(r'href\ *\=\ *\"\/profile\"')
+next_page_pattern = re.compile(r'\<a href\=\"([^"]*after=[^"]*)\"\>')
 home_pattern = re.compile(r'href\ *\=\ *\"\/"')
 logout_pattern = re.compile(r'href\ *\=\ *\"\/logout"')
 link_patterns = {'pre_game': pre_game_pattern, 'submit': submit_pattern, 'home': home_pattern, 'logout': logout_pattern, 'profile': profile_pattern}
@@ -238,6 +262,563 @@ class HTTPTestCase(AsyncHTTPTestCase):
         self.check_link(page_html, "home", "logout")
         self.check_link(page_html, "pre_game", "logout")
 
+    def test_08_static_asset_tests(self):
+        '''
+        Check that stylesheets are linked by fingerprinted urls and served
+        with immutable caching and precompressed bodies
+        '''
+        page_html = self.check_page('/', method='GET')
+        match = re.search(r'href\=\"(\/static\/css\/csstemplate\.css\?v\=[0-9a-f]+)\"', page_html)
+        if not match:
+            raise PageError('csstemplate.css is not linked by a fingerprinted url')
+        response = self.fetch(match.group(1), headers={'Accept-Encoding': 'identity'})
+        if 'immutable' not in response.headers.get('Cache-Control', ''):
+            raise PageError('Fingerprinted asset is not served as immutable')
+        # Imports inside the stylesheet should be fingerprinted too
+        if not re.search(rb"@import url\('\./fonts\.css\?v\=[0-9a-f]+'\)", response.body):
+            raise PageError('Stylesheet imports are not fingerprinted')
+
+        gzipped = self.fetch(match.group(1), headers={'Accept-Encoding': 'gzip'}, decompress_response=False)
+        if gzipped.headers.get('Content-Encoding') != 'gzip' or gzip.decompress(gzipped.body) != response.body:
+            raise PageError('Stylesheet is not served gzipped')
+
+        stale = self.fetch('/static/css/csstemplate.css?v=stale')
+        if 'immutable' in stale.headers.get('Cache-Control', ''):
+            raise PageError('Stale fingerprint is served as immutable')
+
+    def test_09_static_preload_tests(self):
+        '''
+        Check that preloaded assets are served from memory and rebuilt when
+        they change on disk
+        '''
+        from assets import StaticAssetHandler
+        image = 'static/images/scrabble.jpg'
+        with open(image, 'rb') as f:
+            data = f.read()
+        StaticAssetHandler.build(preload=True)
+        try:
+            response = self.fetch('/static/images/scrabble.jpg')
+            if response.body != data or response.headers.get('Content-Type') != 'image/jpeg':
+                raise PageError('Preloaded image is not served intact')
+            gzipped = self.fetch('/static/css/csstemplate.css', headers={'Accept-Encoding': 'gzip'}, decompress_response=False)
+            if gzipped.headers.get('Vary') != 'Accept-Encoding':
+                raise PageError('Precompressed stylesheet has a bad Vary header: {}'.format(gzipped.headers.get('Vary')))
+            # Compressed variants are only served in place of their source
+            variant = self.fetch('/static/css/csstemplate.css.gz')
+            if variant.code != 404:
+                raise PageError('Variant key was served with status {}'.format(variant.code))
+
+            if StaticAssetHandler.changed():
+                raise PageError('Assets are reported as changed straight after a build')
+            st = os.stat(image)
+            os.utime(image, (st.st_atime, st.st_mtime + 10))
+            try:
+                if not StaticAssetHandler.changed():
+                    raise PageError('Modified asset was not noticed')
+                StaticAssetHandler.refresh()
+                if StaticAssetHandler.changed():
+                    raise PageError('Assets were not rebuilt after a modification')
+            finally:
+                os.utime(image, (st.st_atime, st.st_mtime))
+        finally:
+            StaticAssetHandler.build()
+
+    @gen_test
+    def test_10_game_room_tests(self):
+        '''
+        Check that two players can play one game together over websockets
+        '''
+        global cookies
+        host = User.find(username='testUser')
+        guest = User.find(username='awesomealex')
+        game = Game.create(host.id, 1, 0)
+        guest_cookie = 'user_id=' + create_signed_value(self.app.settings['cookie_secret'], 'user_id', str(guest.id)).decode()
+
+        response = yield self.http_client.fetch(self.get_url('/game/room/{}'.format(game.id)), headers={'Cookie': cookies})
+        if 'id="start"' not in response.body.decode():
+            raise PageError('The game owner has no start button in the room')
+
+        @gen.coroutine
+        def receive(connection, kind):
+            while True:
+                message = yield connection.read_message()
+                if message is None:
+                    raise GameError('Connection closed while waiting for a {} message'.format(kind))
+                message = json.loads(message)
+                if message['type'] == kind:
+                    return message
+
+        url = 'ws://localhost:{}/game/room/{}/socket'.format(self.get_http_port(), game.id)
+        players = []
+        for cookie in (cookies, guest_cookie):
+            connection = yield websocket_connect(HTTPRequest(url, headers={'Cookie': cookie}), io_loop=self.io_loop, compression_options={})
+            players.append(connection)
+            yield receive(connection, 'players')
+        host_connection, guest_connection = players
+
+        host_connection.write_message(json.dumps({'type': 'start'}))
+        for index in range(len(game.question_ids)):
+            questions = yield [receive(connection, 'question') for connection in players]
+            if questions[0]['question'] != questions[1]['question'] or questions[0]['index'] != index:
+                raise GameError('Players were sent different questions: {}'.format(questions))
+            if index == 0:
+                # A player who reconnects is sent the open question again
+                guest_connection.close()
+                guest_connection = yield websocket_connect(HTTPRequest(url, headers={'Cookie': guest_cookie}), io_loop=self.io_loop, compression_options={})
+                players[1] = guest_connection
+                question = yield receive(guest_connection, 'question')
+                if question['index'] != index or question['question'] != questions[0]['question']:
+                    raise GameError('A reconnecting player was sent the wrong question: {}'.format(question))
+            answers = [Answer.find(answer_id=answer['id']) for answer in questions[0]['answers']]
+            # The host always answers correctly and the guest never does.
+            def answer():
+                host_connection.write_message(json.dumps({'type': 'answer', 'answer_id': [a.id for a in answers if a.correct][0]}))
+                guest_connection.write_message(json.dumps({'type': 'answer', 'answer_id': [a.id for a in answers if not a.correct][0]}))
+            if index == 1:
+                # Answers that can't be saved leave the room on the question
+                conn = sqlite3.connect('db/trivia.db')
+                self.addCleanup(conn.close)
+                conn.execute('INSERT INTO questionresults VALUES(?, ?, ?, ?, 0)', (game.id, answers[0].question_id, guest.id, answers[0].id))
+                conn.commit()
+                answer()
+                yield [receive(connection, 'error') for connection in players]
+                again = yield [receive(connection, 'question') for connection in players]
+                if [question['index'] for question in again] != [index, index]:
+                    raise GameError('A question whose answers were not saved was not asked again: {}'.format(again))
+                conn.execute('DELETE FROM questionresults WHERE game_id = ? AND question_id = ?', (game.id, answers[0].question_id))
+                conn.commit()
+            answer()
+            results = yield [receive(connection, 'results') for connection in players]
+            if results[0]['players'][0]['score'] != index + 1:
+                raise GameError('Bad scores after question {}: {}'.format(index, results[0]['players']))
+
+        end = yield receive(guest_connection, 'end')
+        scores = {player['username']: player['score'] for player in end['players']}
+        if scores != {'testUser': len(game.question_ids), 'awesomealex': 0}:
+            raise GameError('Incorrect final scores: {}'.format(scores))
+
+        game = Game.find(game_id=game.id)
+        if game.score != len(game.question_ids) or not game.is_end():
+            raise GameError('Game was not saved: score {}, question {}'.format(game.score, game.question_index))
+        results = QuestionResult.find_all(game_id=game.id, user_id=guest.id)
+        if len(results) != len(game.question_ids) or any(result.correct for result in results):
+            raise GameError("The guest's answers were not saved")
+
+        # A batch that can't be saved leaves nothing behind for the next commit
+        question = Question.find(question_id=results[0].question_id)
+        other = [user for user in User.find_all() if user.id not in (host.id, guest.id)][0]
+        try:
+            game.record_results([(question.id, other.id, results[0].answer_id, 1),
+                                 (question.id, guest.id, results[0].answer_id, 1)], game.question_index)
+        except sqlite3.IntegrityError:
+            pass
+        else:
+            raise GameError('An answer was recorded twice')
+        models.conn.commit()
+        if QuestionResult.find_all(game_id=game.id, user_id=other.id) or \
+                Question.find(question_id=question.id).questions_answered != question.questions_answered:
+            raise GameError('The writes of a failed batch were committed')
+        if Game.find(game_id=game.id).score != game.score:
+            raise GameError('The score of a failed batch was saved')
+
+    def test_11_api_tests(self):
+        '''
+        Check that a whole game can be played through the JSON API
+        '''
+        global cookies
+        headers = {'Cookie': cookies, 'Content-Type': 'application/json'}
+        response = self.fetch('/api/v1/games', method='POST', headers=headers, body=json.dumps({'category_id': 1, 'difficulty': 0}))
+        if response.code != 201:
+            raise GameError('Could not create a game through the API: {}'.format(response.body))
+        game = json.loads(response.body.decode())
+        if len(game['questions']) != 5 or any('correct' in answer for question in game['questions'] for answer in question['answers']):
+            raise GameError('Bad questions in a new game: {}'.format(game['questions']))
+        url = '/api/v1/games/{}'.format(game['id'])
+
+        response = self.fetch(url + '/questions', headers=headers)
+        if json.loads(response.body.decode()) != game['questions'] or 'max-age' not in response.headers.get('Cache-Control', ''):
+            raise GameError('The question list is not stable and cacheable')
+        if self.fetch(url + '/questions', headers=dict(headers, **{'If-None-Match': response.headers['Etag']})).code != 304:
+            raise GameError('A conditional request for the question list was not answered with 304')
+
+        for index, question in enumerate(game['questions']):
+            current = json.loads(self.fetch(url + '/question', headers=headers).body.decode())
+            if current != question:
+                raise GameError('Current question {} does not match the list: {}'.format(index, current))
+            answers = [Answer.find(answer_id=answer['id']) for answer in question['answers']]
+            # Answer the even questions correctly, with a form body for the last one.
+            answer = [a for a in answers if bool(a.correct) == (index % 2 == 0)][0]
+            if index == 4:
+                response = self.fetch(url + '/answers', method='POST', headers={'Cookie': cookies}, body='answer_id={}'.format(answer.id))
+            else:
+                response = self.fetch(url + '/answers', method='POST', headers=headers, body=json.dumps({'answer_id': answer.id}))
+            result = json.loads(response.body.decode())
+            if result['correct'] != bool(answer.correct) or result['question_index'] != index + 1:
+                raise GameError('Bad answer result: {}'.format(result))
+
+        results = json.loads(self.fetch(url + '/results', headers=headers).body.decode())
+        if not results['finished'] or results['score'] != 3 or [r['correct'] for r in results['results']] != [True, False, True, False, True]:
+            raise GameError('Bad game results: {}'.format(results))
+        if self.fetch(url + '/question', headers=headers).code != 409:
+            raise GameError('A finished game still has a current question')
+        if game['id'] in Game._active:
+            raise GameError('A finished game was kept in the active game cache')
+        if self.fetch(url, headers={'Cookie': ''}).code != 401:
+            raise GameError('The API does not require a login')
+
+    def test_12_search_tests(self):
+        '''
+        Check question search and the duplicate check on submitted questions
+        '''
+        page_html = self.check_page('/search?q=c1_d0_q6', method='GET')
+        if '<li><a href="/category/1">c1_d0_q6</a></li>' not in page_html:
+            raise PageError('A question is missing from its search results')
+        # Answers are searched too
+        page_html = self.check_page('/search?q=c0_d1_q1_A2', method='GET')
+        if re.findall(r'\<li\>\<a href="[^"]*"\>([^<]*)\<', page_html) != ['c0_d1_q1']:
+            raise PageError('Wrong search results for an answer: {}'.format(page_html))
+
+        fields = {'question': 'C1 d0 q6?', 'correct_answer': 'Yes', 'wrong_answer_1': 'No',
+                  'wrong_answer_2': 'Maybe', 'wrong_answer_3': 'Zebra', 'categories': '1'}
+        page_html = self.fetch('/question', method='POST', body=urlencode(fields)).body.decode()
+        if 'Is your question already here?' not in page_html or '<li>c1_d0_q6</li>' not in page_html:
+            raise PageError('Possible duplicates were not shown for a new question')
+        if Question.find(question=fields['question']):
+            raise PageError('A possible duplicate was added without confirmation')
+        fields['confirm'] = '1'
+        response = self.fetch('/question', method='POST', body=urlencode(fields), follow_redirects=False)
+        if response.code != 302 or not Question.find(question=fields['question']):
+            raise PageError('A confirmed question was not added')
+        if [question.question for question in Question.search('zebra')] != [fields['question']]:
+            raise PageError('A new question is missing from the search index')
+        answers = Question.find(question=fields['question']).get_answers()
+        if sorted((answer.text, answer.correct) for answer in answers) != [('Maybe', 0), ('No', 0), ('Yes', 1), ('Zebra', 0)]:
+            raise PageError('A new question has the wrong answers: {}'.format(answers))
+
+    def test_13_paging_tests(self):
+        '''
+        Check that category and profile pages can be followed to the end
+        '''
+        global cookies
+        category_page_size, profile_page_size = handlers.category.PAGE_SIZE, handlers.profile.PAGE_SIZE
+        handlers.category.PAGE_SIZE = handlers.profile.PAGE_SIZE = 3
+        try:
+            questions = []
+            url = '/category/1'
+            while url:
+                page_html = self.check_page(url, method='GET')
+                questions.extend(html.unescape(question) for question in re.findall(r'\<li\>([^<]*)\<\/li\>', page_html))
+                url = html.unescape(next_page_pattern.search(page_html).group(1)) if next_page_pattern.search(page_html) else None
+            if questions != [question.question for question in Question.find_all(category=1)]:
+                raise PageError('Paging through a category gave {}'.format(questions))
+            # Later pages are read from the index alone
+            statements = []
+            models.conn.set_trace_callback(statements.append)
+            try:
+                Question.find_page(after='[7]', limit=3, fields=['question'], category='1')
+            finally:
+                models.conn.set_trace_callback(None)
+            plan = models.conn.execute('EXPLAIN QUERY PLAN ' + statements[-1]).fetchall()
+            if len(plan) != 1 or 'USING COVERING INDEX' not in plan[0][-1]:
+                raise PageError('A category page is not read from a covering index: {}'.format(plan))
+
+            scores = []
+            url = '/profile'
+            while url:
+                page_html = self.check_page(url, headers={'Cookie': cookies})
+                scores.extend(int(score) for score in re.findall(r'\<li\>Scored (\d+)\<\/li\>', page_html))
+                url = html.unescape(next_page_pattern.search(page_html).group(1)) if next_page_pattern.search(page_html) else None
+            user = User.find(username='testUser')
+            games = sorted(Game.find_all(user_id=user.id), key=lambda game: game.id, reverse=True)
+            if len(games) <= 3 or scores != [game.score for game in games]:
+                raise PageError('Paging through a profile gave {}'.format(scores))
+
+            # A bad cursor gives the first page rather than an error
+            for after in ('[{}]', '[[1]]', '[99999999999999999999]', '[true]', '[[[[[1]]]]]', '[' * 5000):
+                self.check_page('/category/1?' + urlencode({'after': after}), method='GET')
+        finally:
+            handlers.category.PAGE_SIZE, handlers.profile.PAGE_SIZE = category_page_size, profile_page_size
+
+    def test_14_rating_tests(self):
+        '''
+        Check that every answer updates the ratings, and that they can be recomputed
+        '''
+        conn = sqlite3.connect('db/trivia.db')
+        answered = dict(conn.execute('SELECT user_id, COUNT(*) FROM questionresults GROUP BY user_id'))
+        if dict(conn.execute('SELECT user_id, answered FROM user_ratings')) != answered:
+            raise GameError('User ratings were not updated for every answer')
+        answered = dict(conn.execute('SELECT question_id, COUNT(*) FROM questionresults GROUP BY question_id'))
+        if dict(conn.execute('SELECT question_id, answered FROM question_ratings')) != answered:
+            raise GameError('Question ratings were not updated for every answer')
+        # Questions nobody has answered are rated by their difficulty band
+        question_id, difficulty = conn.execute('SELECT question_id, difficulty FROM questions WHERE question_id NOT IN '
+                                               '(SELECT question_id FROM question_ratings) AND difficulty != ?', (ratings.MIDDLE_BAND,)).fetchone()
+        if ratings.get(conn.cursor(), 'question_ratings', 'question_id', question_id) != (ratings.question_prior(difficulty), 0):
+            raise GameError('An unanswered question is not rated by its band')
+
+        if ratings.numpy is not None:
+            if ratings.recompute(conn) != sum(answered.values()):
+                raise GameError('Ratings were not recomputed from every answer')
+            # Questions always answered correctly are rated easier than those never answered correctly.
+            rated = conn.execute('SELECT MAX(rating) FROM question_ratings WHERE question_id IN '
+                                 '(SELECT question_id FROM questionresults GROUP BY question_id HAVING MIN(correct) = 1)').fetchone()[0]
+            unrated = conn.execute('SELECT MIN(rating) FROM question_ratings WHERE question_id IN '
+                                   '(SELECT question_id FROM questionresults GROUP BY question_id HAVING MAX(correct) = 0)').fetchone()[0]
+            if rated is None or unrated is None or rated >= unrated:
+                raise GameError('Recomputed ratings do not reflect the answers: {} {}'.format(rated, unrated))
+
+    def test_15_adaptive_game_tests(self):
+        '''
+        Check that games matched to the player's skill avoid recently seen questions
+        '''
+        global cookies
+        user = User.find(username='testUser')
+        seen = set()
+        for game in Game.find_page('-id', limit=selection.RECENT_GAMES, user_id=user.id)[0]:
+            seen.update(game.question_ids)
+        unseen = {question.id for question in Question.find_all(category=1)} - seen
+
+        headers = {'Cookie': cookies, 'Content-Type': 'application/json'}
+        response = self.fetch('/api/v1/games', method='POST', headers=headers, body=json.dumps({'category_id': 1, 'difficulty': 'auto'}))
+        if response.code != 201:
+            raise GameError('Could not create a game matching the player: {}'.format(response.body))
+        question_ids = [question['id'] for question in json.loads(response.body.decode())['questions']]
+        categories = {Question.find(id=question_id).category for question_id in question_ids}
+        if len(set(question_ids)) != 5 or categories != {'1'}:
+            raise GameError('Bad questions in a game matching the player: {}'.format(question_ids))
+        if not (unseen <= set(question_ids) if len(unseen) <= 5 else set(question_ids) <= unseen):
+            raise GameError('Recently seen questions were repeated: {} (unseen {})'.format(question_ids, unseen))
+
+        response = self.fetch('/game/create', method='POST', headers={'Cookie': cookies}, body='category_id=0&difficulty=auto', follow_redirects=False)
+        if response.code != 302 or response.headers['Location'] != '/game/0':
+            raise GameError('Could not start a game matching the player from the lobby')
+
+    def test_16_score_tests(self):
+        '''
+        Check that scores kept as users answer match scores rebuilt from all the answers
+        '''
+        global cookies
+        conn = sqlite3.connect('db/trivia.db')
+        kept = conn.execute('SELECT * FROM scores ORDER BY user_id, category_id').fetchall()
+        answered = conn.execute('SELECT COUNT(*) FROM questionresults').fetchone()[0]
+        if not kept or sum(score[2] for score in kept) != answered:
+            raise GameError('Scores were not updated for every answer: {}'.format(kept))
+        subprocess.check_call([sys.executable, 'rebuild_scores.py'], cwd='db', stdout=subprocess.DEVNULL)
+        rebuilt = conn.execute('SELECT * FROM scores ORDER BY user_id, category_id').fetchall()
+        if rebuilt != kept:
+            raise GameError('Rebuilt scores differ:\n{}\n{}'.format(kept, rebuilt))
+
+        page_html = self.check_page('/profile', headers={'Cookie': cookies})
+        user = User.find(username='testUser')
+        for score in Score.find_for_user(user.id):
+            row = '<td>{}</td><td>{}/{}</td>'.format(html.escape(score.category_name), score.num_correct, score.num_answered)
+            if row not in page_html:
+                raise PageError('Score for {} missing from the profile'.format(score.category_name))
+
+    def test_17_leaderboard_tests(self):
+        '''
+        Check that the leaderboard ranks players by their average percentage over categories
+        '''
+        # A category nobody has answered in, and a player who has gone
+        category = Category.create('An unplayed category')
+        users = {user.id: user for user in User.find_all()}
+        for user_id in users:
+            Score.create(user_id, category.id)
+        models.conn.execute('INSERT INTO scores(user_id, category_id, num_answered, num_correct) VALUES(?, ?, 1, 1)',
+                            (max(users) + 1, category.id))
+        models.conn.commit()
+        percentages = {}
+        for score in Score.find_all():
+            if score.num_answered and score.user_id in users:
+                percentages.setdefault(score.user_id, []).append(100.0 * score.num_correct / score.num_answered)
+        ranking = sorted(percentages, key=lambda user_id: sum(percentages[user_id]) / len(percentages[user_id]), reverse=True)
+        page_html = self.check_page('/leaderboard', method='GET')
+        for user_id in ranking[:10]:
+            average = sum(percentages[user_id]) / len(percentages[user_id])
+            entry = '<li class="leadp">{}, {}%</li>'.format(html.escape(User.find(id=user_id).username), round(average, 2))
+            if entry not in page_html:
+                raise PageError('{} is missing from the leaderboard: {}'.format(entry, page_html))
+        if len(ranking) < 2 or page_html.index(html.escape(User.find(id=ranking[0]).username)) > page_html.index(html.escape(User.find(id=ranking[1]).username)):
+            raise PageError('The leaderboard is in the wrong order')
+
+    def test_18_change_hook_tests(self):
+        '''
+        Check that changes reach the model hooks once committed, and not if rolled back
+        '''
+        global cookies
+        changes = []
+        hook = Model.add_hook(changes.append)
+        try:
+            headers = {'Cookie': cookies, 'Content-Type': 'application/json'}
+            response = self.fetch('/api/v1/games', method='POST', headers=headers, body=json.dumps({'category_id': 1, 'difficulty': 0}))
+            game = json.loads(response.body.decode())
+            if changes != [[Change('insert', Game, game['id'], Game._fields)]]:
+                raise PageError('Creating a game was reported as {}'.format(changes))
+            del changes[:]
+            answer_id = game['questions'][0]['answers'][0]['id']
+            self.fetch('/api/v1/games/{}/answers'.format(game['id']), method='POST', headers=headers, body=json.dumps({'answer_id': answer_id}))
+            # The answer is committed, then the move on to the next question.
+            if {(change.action, change.model) for commit in changes for change in commit} != {
+                    ('update', Game), ('insert', QuestionResult), ('update', Question), ('update', Score)}:
+                raise PageError('Answering a question was reported as {}'.format(changes))
+
+            del changes[:]
+            Question.create_many([('An uncommitted question', 0, 0, 1, 0)], commit=False)
+            models.conn.rollback()
+            if changes:
+                raise PageError('A change that was rolled back was reported: {}'.format(changes))
+        finally:
+            Model.remove_hook(hook)
+
+        # New questions can be chosen straight away.
+        index = selection.get_index(models.conn, 1)
+        question = Question.create_with_answers('A brand new question', 1, ['Yes', 'No', 'Maybe', 'Zebra'])
+        if question.id not in selection.get_index(models.conn, 1).question_ids or question.id in index.question_ids:
+            raise PageError('A new question is missing from the selection index')
+
+    def test_19_category_cache_tests(self):
+        '''
+        Check that categories are read from memory, and that new ones are shown at once
+        '''
+        global cookies
+        cache = Category._table_cache
+        self.check_page('/pre_game', headers={'Cookie': cookies})
+        misses = cache.misses
+        self.check_page('/pre_game', headers={'Cookie': cookies})
+        self.check_page('/category/1', method='GET')
+        if cache.misses != misses:
+            raise PageError('Categories were read from the database again: {}'.format(cache.stats()))
+
+        # The cache finds what the database would
+        for value in (1, '1', ' 1', '1.0', '1abc', '١', None):
+            found = Category.find(id=value)
+            expected = models.conn.execute('SELECT category_id FROM categories WHERE category_id = ?', (value,)).fetchone()
+            if (found and found.id) != (expected and expected[0]):
+                raise PageError('The cache found {} for id {!r} rather than {}'.format(found, value, expected and expected[0]))
+
+        Category.create('A brand new category')
+        page_html = self.check_page('/pre_game', headers={'Cookie': cookies})
+        if 'A brand new category' not in page_html:
+            raise PageError('A new category is missing from the cache')
+
+    def test_20_cross_process_cache_tests(self):
+        '''
+        Check that caches notice writes made by other processes, but only to their tables
+        '''
+        global cookies
+        cache = Category._table_cache
+        self.check_page('/pre_game', headers={'Cookie': cookies})
+        misses = cache.misses
+        # Another process's connection
+        conn = sqlite3.connect('db/trivia.db')
+        conn.execute('INSERT INTO flags VALUES(NULL, 1)')
+        conn.commit()
+        self.check_page('/pre_game', headers={'Cookie': cookies})
+        if cache.misses != misses:
+            raise PageError('A write to another table invalidated the category cache')
+
+        conn.execute('INSERT INTO categories VALUES(NULL, "Another process\'s category")')
+        conn.commit()
+        conn.close()
+        page_html = self.check_page('/pre_game', headers={'Cookie': cookies})
+        if html.escape("Another process's category") not in page_html:
+            raise PageError('A category added by another process is missing from the cache')
+
+    def test_21_shared_cache_tests(self):
+        '''
+        Check that question indexes built by one server can be used by another through a shared cache
+        '''
+        global cookies
+        local_indexes = selection._indexes
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'shared_cache')
+        try:
+            selection.share_indexes(path)
+            self.addCleanup(selection._indexes.close)
+            headers = {'Cookie': cookies, 'Content-Type': 'application/json'}
+            response = self.fetch('/api/v1/games', method='POST', headers=headers, body=json.dumps({'category_id': 1, 'difficulty': 'auto'}))
+            if response.code != 201:
+                raise GameError('Could not create a game with shared indexes: {}'.format(response.body))
+            # Another server's view of the cache
+            other = SharedCache(path, selection.INDEX_CACHE_SIZE, slot_size=selection.SHARED_INDEX_SIZE)
+            self.addCleanup(other.close)
+            index = other.get(1)
+            if index is None or sorted(index.question_ids) != sorted(question.id for question in Question.find_all(category=1)):
+                raise GameError('The question index is missing from the shared cache')
+        finally:
+            selection._indexes = local_indexes
+
+    def test_22_question_bank_tests(self):
+        '''
+        Check that games read questions from an up to date question bank, and that new banks are swapped in
+        '''
+        global cookies
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'questions.bank')
+        question_bank.export(models.conn, path)
+        question_bank.use(path)
+        try:
+            bank = question_bank.current(models.conn)
+            if bank is None or len(bank) != Question.count():
+                raise GameError('A new question bank is not used')
+            for question in Question.find_all():
+                row = bank.question(question.id)
+                if row[:2] != (question.id, question.question) or row[4:] != (question.category, question.difficulty):
+                    raise GameError('Question {} is wrong in the bank: {}'.format(question.id, row))
+                if [Answer(*row).text for row in bank.answers(question.id)] != [answer.text for answer in question.get_answers()]:
+                    raise GameError('The answers of question {} are wrong in the bank'.format(question.id))
+
+            headers = {'Cookie': cookies, 'Content-Type': 'application/json'}
+            response = self.fetch('/api/v1/games', method='POST', headers=headers, body=json.dumps({'category_id': 1, 'difficulty': 0}))
+            game_id = json.loads(response.body.decode())['id']
+            game = Game.find_active(game_id)
+            # Questions from the bank don't have the answer counters.
+            if {question.questions_answered for question in game.questions} != {None}:
+                raise GameError('A game did not read its questions from the bank')
+            response = self.fetch('/api/v1/games/{}/question'.format(game_id), headers=headers)
+            if json.loads(response.body.decode())['question'] != game.questions[0].question:
+                raise GameError('The current question is wrong when read from the bank')
+
+            Question.create_with_answers('A question newer than the bank', 1, ['Yes', 'No', 'Maybe', 'Zebra'])
+            if question_bank.current(models.conn) is not None:
+                raise GameError('An out of date question bank was used')
+            question_bank.export(models.conn, path)
+            if question_bank.current(models.conn) is None or len(question_bank.current(models.conn)) != Question.count():
+                raise GameError('A newly published question bank was not swapped in')
+        finally:
+            question_bank.use(None)
+
+    def test_23_stale_game_tests(self):
+        '''
+        Check that a game played on by another process is not answered from a stale cache
+        '''
+        user = User.find(username='testUser')
+        game = Game.find_active(Game.create(user.id, 1, 0).id)
+        question_id = game.question_ids[0]
+        answer = [answer for answer in game.get_answers(question_id) if answer.correct][0]
+        # Another process's connection answers the first question
+        conn = sqlite3.connect('db/trivia.db')
+        self.addCleanup(conn.close)
+        conn.execute('INSERT INTO questionresults VALUES(?, ?, ?, ?, 1)', (game.id, question_id, user.id, answer.id))
+        conn.execute('UPDATE games SET score = 1, question_index = 1 WHERE game_id = ?', (game.id,))
+        conn.commit()
+
+        try:
+            game.submit_answer(question_id, answer.id)
+        except models.StaleGameError:
+            pass
+        else:
+            raise GameError('An answer to a question the game had moved past was recorded')
+        if Game.find(game_id=game.id).score != 1:
+            raise GameError('A stale answer changed the score')
+        fresh = Game.find_active(game.id)
+        if fresh is game or fresh.question_index != 1:
+            raise GameError('The active game cache kept a game another process played on')
+        if fresh.submit_answer(fresh.question_ids[1], fresh.get_answers(fresh.question_ids[1])[0].id) is None:
+            raise GameError('The current question could not be answered')
+
     def check_page(self, url, **headers):
         response = self.fetch(url, **headers)
         if response.error:
@@ -377,27 +377,39 @@ class HTTP1Connection(httputil.HTTPConnection):
                 self._write_callback = stack_context.wrap(callback)
             else:
                 future = self._write_future = Future()
-            data = b"\r\n".join(lines) + b"\r\n\r\n"
+            data = [b"\r\n".join(lines) + b"\r\n\r\n"]
             if chunk:
-                data += self._format_chunk(chunk)
-            self._pending_write = self.stream.write(data)
+                # Send the body along with the headers without copying
+                # it onto the end of the header block.
+                data.extend(self._format_chunk(chunk))
+            self._pending_write = self.stream.writev(data)
             self._pending_write.add_done_callback(self._on_write_complete)
         return future
 
-    def _format_chunk(self, chunk):
+    def _count_body_bytes(self, num_bytes):
         if self._expected_content_remaining is not None:
-            self._expected_content_remaining -= len(chunk)
+            self._expected_content_remaining -= num_bytes
             if self._expected_content_remaining < 0:
                 # Close the stream now to stop further framing errors.
                 self.stream.close()
                 raise httputil.HTTPOutputError(
                     "Tried to write more data than Content-Length")
-        if self._chunking_output and chunk:
+
+    def _format_chunk(self, chunk):
+        """Returns the list of strings that frame ``chunk`` on the wire.
+
+        ``chunk`` may be a list of strings, which are framed as a single
+        chunk without being joined.
+        """
+        chunks = chunk if isinstance(chunk, list) else [chunk]
+        size = sum(len(c) for c in chunks)
+        self._count_body_bytes(size)
+        if self._chunking_output and size:
             # Don't write out empty chunks because that means END-OF-STREAM
             # with chunked encoding
-            return utf8("%x" % len(chunk)) + b"\r\n" + chunk + b"\r\n"
+            return [utf8("%x" % size) + b"\r\n"] + chunks + [b"\r\n"]
         else:
-            return chunk
+            return chunks
 
     def write(self, chunk, callback=None):
         """Implements `.HTTPConnection.write`.
@@ -415,7 +427,39 @@ class HTTP1Connection(httputil.HTTPConnection):
                 self._write_callback = stack_context.wrap(callback)
             else:
                 future = self._write_future = Future()
-            self._pending_write = self.stream.write(self._format_chunk(chunk))
+            self._pending_write = self.stream.writev(self._format_chunk(chunk))
+            self._pending_write.add_done_callback(self._on_write_complete)
+        return future
+
+    def write_file(self, file, offset, count, callback=None):
+        """Writes ``count`` bytes of ``file``, starting at ``offset``, as
+        part of the message body.
+
+        Like `write`, but the data is handed to
+        `.BaseIOStream.write_file`, which can send it without copying it
+        through Python.  The connection takes ownership of ``file``.
+        """
+        future = None
+        if self.stream.closed():
+            file.close()
+            future = self._write_future = Future()
+            self._write_future.set_exception(iostream.StreamClosedError())
+        else:
+            if callback is not None:
+                self._write_callback = stack_context.wrap(callback)
+            else:
+                future = self._write_future = Future()
+            try:
+                self._count_body_bytes(count)
+            except httputil.HTTPOutputError:
+                file.close()
+                raise
+            if self._chunking_output and count:
+                self.stream.write(utf8("%x" % count) + b"\r\n")
+                self.stream.write_file(file, offset, count)
+                self._pending_write = self.stream.write(b"\r\n")
+            else:
+                self._pending_write = self.stream.write_file(file, offset, count)
             self._pending_write.add_done_callback(self._on_write_complete)
         return future
 
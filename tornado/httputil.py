@@ -540,7 +540,7 @@ class HTTPConnection(object):
         :arg headers: a `.HTTPHeaders` instance.
         :arg chunk: the first (optional) chunk of data.  This is an optimization
             so that small responses can be written in the same call as their
-            headers.
+            headers.  As with `write`, it may be a list of byte strings.
         :arg callback: a callback to be run when the write is complete.
 
         Returns a `.Future` if no callback is given.
@@ -550,6 +550,9 @@ class HTTPConnection(object):
     def write(self, chunk, callback=None):
         """Writes a chunk of body data.
 
+        ``chunk`` is a byte string or a list of byte strings, which are
+        written in order as if they had been joined.
+
         The callback will be run when the write is complete.  If no callback
         is given, returns a Future.
         """
@@ -836,9 +839,30 @@ def _parse_header(line):
                 value = value[1:-1]
                 value = value.replace('\\\\', '\\').replace('\\"', '"')
             pdict[name] = value
+        else:
+            pdict[p] = None
     return key, pdict
 
 
+def _encode_header(key, pdict):
+    """Inverse of _parse_header.
+
+    >>> _encode_header('permessage-deflate',
+    ...     {'client_max_window_bits': 15, 'client_no_context_takeover': None})
+    'permessage-deflate; client_max_window_bits=15; client_no_context_takeover'
+    """
+    if not pdict:
+        return key
+    out = [key]
+    # Sort the parameters just to make it easy to test.
+    for k, v in sorted(pdict.items()):
+        if v is None:
+            out.append(k)
+        else:
+            out.append('%s=%s' % (k, v))
+    return '; '.join(out)
+
+
 def doctests():
     import doctest
     return doctest.DocTestSuite()
@@ -33,6 +33,7 @@ import os
 import socket
 import sys
 import re
+import threading
 
 from tornado.concurrent import TracebackFuture
 from tornado import ioloop
@@ -74,6 +75,12 @@ _ERRNO_INPROGRESS = (errno.EINPROGRESS,)
 if hasattr(errno, "WSAEINPROGRESS"):
     _ERRNO_INPROGRESS += (errno.WSAEINPROGRESS,)
 
+# The most buffers we pass to a single sendmsg or writev call.
+try:
+    _IOV_MAX = min(os.sysconf("SC_IOV_MAX"), 1024)
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = 16
+
 #######################################################
 class StreamClosedError(IOError):
     """Exception raised by `IOStream` methods when the stream is closed.
@@ -141,11 +148,19 @@ class BaseIOStream(object):
                                    self.max_buffer_size // 2)
         self.max_write_buffer_size = max_write_buffer_size
         self.error = None
-        self._read_buffer = collections.deque()
+        # Data read from the fd but not yet consumed is
+        # _read_buffer[_read_buffer_pos:_read_buffer_pos + _read_buffer_size].
+        # The buffer is a bytearray with free space for the next read
+        # after the data, or, after a single small read, a bytes object
+        # which _consume() can return without copying.
+        self._read_buffer = b""
+        self._read_buffer_pos = 0
+        self._read_scratch = None
         self._write_buffer = collections.deque()
         self._read_buffer_size = 0
         self._write_buffer_size = 0
-        self._write_buffer_frozen = False
+        # Bytes of _write_buffer[0] that have already been written.
+        self._write_buffer_pos = 0
         self._read_delimiter = None
         self._read_regex = None
         self._read_max_bytes = None
@@ -184,13 +199,48 @@ class BaseIOStream(object):
         """
         raise NotImplementedError()
 
-    def read_from_fd(self):
-        """Attempts to read from the underlying file.
+    # The most buffers _handle_write passes to write_buffers_to_fd at once.
+    _max_write_buffers = 1
 
-        Returns ``None`` if there was nothing to read (the socket
-        returned `~errno.EWOULDBLOCK` or equivalent), otherwise
-        returns the data.  When possible, should return no more than
-        ``self.read_chunk_size`` bytes at a time.
+    def write_buffers_to_fd(self, buffers):
+        """Attempts to write a list of buffers to the underlying file,
+        in order, as if they were one string.
+
+        Returns the number of bytes written.  ``buffers`` holds at most
+        ``_max_write_buffers`` entries; subclasses that raise that limit
+        should send them with a single gathering system call such as
+        ``writev``.  The default implementation writes the first buffer.
+        """
+        return self.write_to_fd(buffers[0])
+
+    def write_file_to_fd(self, region):
+        """Attempts to write part of a `write_file` region to the
+        underlying file.
+
+        Returns the number of bytes written.  The default implementation
+        reads the region in chunks and passes them to `write_to_fd`;
+        subclasses may override it to avoid copying the data through
+        Python.
+        """
+        if region.chunk is None:
+            region.chunk = region.read(128 * 1024)
+            if not region.chunk:
+                raise IOError(errno.EIO, "Unexpected end of file")
+        # On a short write (or an exception) the unsent data stays in
+        # region.chunk, so a retry passes the very same object (see the
+        # OpenSSL note in _handle_write).
+        num_bytes = self.write_to_fd(region.chunk)
+        region.chunk = region.chunk[num_bytes:] or None
+        return num_bytes
+
+    def read_from_fd(self, buf):
+        """Attempts to read from the underlying file into ``buf``.
+
+        Reads up to ``len(buf)`` bytes, storing them at the start of
+        ``buf``.  Returns ``None`` if there was nothing to read (the
+        socket returned `~errno.EWOULDBLOCK` or equivalent), otherwise
+        returns the number of bytes read.  At end of file, should close
+        the stream and return ``None``.
         """
         raise NotImplementedError()
 
@@ -281,7 +331,19 @@ class BaseIOStream(object):
         self._read_bytes = num_bytes
         self._read_partial = partial
         self._streaming_callback = stack_context.wrap(streaming_callback)
-        self._try_inline_read()
+        try:
+            if (num_bytes > self.max_buffer_size and not partial and
+                    streaming_callback is None):
+                # The whole result would have to be buffered.
+                raise UnsatisfiableReadError(
+                    "read of %d bytes exceeds max_buffer_size %d" % (
+                        num_bytes, self.max_buffer_size))
+            self._try_inline_read()
+        except UnsatisfiableReadError as e:
+            # Handle this the same way as in _handle_events.
+            gen_log.info("Unsatisfiable read, closing connection: %s" % e)
+            self.close(exc_info=True)
+            return future
         return future
 
     def read_until_close(self, callback=None, streaming_callback=None):
@@ -324,21 +386,65 @@ class BaseIOStream(object):
         .. versionchanged:: 4.0
             Now returns a `.Future` if no callback is given.
         """
-        assert isinstance(data, bytes_type)
+        return self.writev((data,), callback)
+
+    def writev(self, buffers, callback=None):
+        """Asynchronously write a sequence of byte strings to this stream.
+
+        This is equivalent to calling `write` with each string in turn,
+        but the strings are queued before any of them is sent, so that
+        streams which support it (plain sockets and pipes on platforms
+        with ``sendmsg``/``writev``) can send them with a single system
+        call instead of joining them first.
+
+        ``callback`` and the returned `.Future` behave as for `write`.
+        """
         self._check_closed()
-        # We use bool(_write_buffer) as a proxy for write_buffer_size>0,
-        # so never put empty strings in the buffer.
-        if data:
-            if (self.max_write_buffer_size is not None and
-                    self._write_buffer_size + len(data) > self.max_write_buffer_size):
-                raise StreamBufferFullError("Reached maximum read buffer size")
-            # Break up large contiguous strings before inserting them in the
-            # write buffer, so we don't have to recopy the entire thing
-            # as we slice off pieces to send to the socket.
-            WRITE_BUFFER_CHUNK_SIZE = 128 * 1024
-            for i in range(0, len(data), WRITE_BUFFER_CHUNK_SIZE):
-                self._write_buffer.append(data[i:i + WRITE_BUFFER_CHUNK_SIZE])
-            self._write_buffer_size += len(data)
+        size = 0
+        for data in buffers:
+            assert isinstance(data, bytes_type)
+            size += len(data)
+        if (self.max_write_buffer_size is not None and
+                self._write_buffer_size + size > self.max_write_buffer_size):
+            raise StreamBufferFullError("Reached maximum read buffer size")
+        for data in buffers:
+            # We use bool(_write_buffer) as a proxy for write_buffer_size>0,
+            # so never put empty strings in the buffer.
+            if data:
+                self._write_buffer.append(data)
+        self._write_buffer_size += size
+        return self._start_write(callback)
+
+    def write_file(self, file, offset, count, callback=None):
+        """Asynchronously write ``count`` bytes of ``file``, starting at
+        ``offset``, to this stream.
+
+        ``file`` is a file object opened in binary mode.  The stream takes
+        ownership of it and closes it once the region has been written or
+        the stream is closed.  Data passed to `write` before this call is
+        sent first, and data passed afterwards is sent after the region.
+
+        Where possible (plain `IOStream` sockets on platforms with
+        `os.sendfile`) the region is sent by the kernel without being
+        copied through Python; other streams read it in chunks and write
+        it like any other data.  The file is read lazily, so it must not
+        shrink before it has been written.
+
+        ``callback`` and the returned `.Future` behave as for `write`.
+        """
+        try:
+            self._check_closed()
+        except StreamClosedError:
+            file.close()
+            raise
+        if count > 0:
+            self._write_buffer.append(_FileRegion(file, offset, count))
+            self._write_buffer_size += count
+        else:
+            file.close()
+        return self._start_write(callback)
+
+    def _start_write(self, callback):
         if callback is not None:
             self._write_callback = stack_context.wrap(callback)
             future = None
@@ -419,6 +525,9 @@ class BaseIOStream(object):
             # Clear the buffers so they can be cleared immediately even
             # if the IOStream object is kept alive by a reference cycle.
             # TODO: Clear the read buffer too; it currently breaks some tests.
+            for chunk in self._write_buffer or ():
+                if isinstance(chunk, _FileRegion):
+                    chunk.close()
             self._write_buffer = None
 
     def reading(self):
@@ -679,8 +788,38 @@ class BaseIOStream(object):
         to read (i.e. the read returns EWOULDBLOCK or equivalent).  On
         error closes the socket and raises an exception.
         """
+        chunk_size = self.read_chunk_size
+        size = self._read_buffer_size
+        read_bytes = self._read_bytes
         try:
-            chunk = self.read_from_fd()
+            if size or (read_bytes is not None and read_bytes > chunk_size):
+                # Receive straight into the space after the buffered data,
+                # making room for more of a pending read_bytes than one
+                # chunk.  The length of a read may come from the peer, so
+                # the room made is capped and the buffer grows (doubling)
+                # only as the data arrives.
+                want = chunk_size
+                if read_bytes is not None and read_bytes > size:
+                    want = max(chunk_size, min(
+                        read_bytes - size,
+                        self.max_buffer_size - size,
+                        _MAX_READ_RESERVE_CHUNKS * chunk_size))
+                buf = self._read_buffer
+                end = self._read_buffer_pos + size
+                if type(buf) is not bytearray or len(buf) - end < want:
+                    self._reserve_read_buffer(want)
+                    buf = self._read_buffer
+                    end = size
+                num_bytes = self.read_from_fd(
+                    memoryview(buf)[end:end + chunk_size])
+            else:
+                buf = self._read_scratch
+                if buf is None or len(buf) != chunk_size:
+                    buf = self._read_scratch = _read_scratch(chunk_size)
+                num_bytes = self.read_from_fd(buf)
+                if num_bytes:
+                    self._read_buffer = buf[:num_bytes].tobytes()
+                    self._read_buffer_pos = 0
         except (socket.error, IOError, OSError) as e:
             # ssl.SSLError is a subclass of socket.error
             if e.args[0] in _ERRNO_CONNRESET:
@@ -691,15 +830,38 @@ class BaseIOStream(object):
                 return
             self.close(exc_info=True)
             raise
-        if chunk is None:
+        if not num_bytes:
             return 0
-        self._read_buffer.append(chunk)
-        self._read_buffer_size += len(chunk)
+        self._read_buffer_size += num_bytes
         if self._read_buffer_size > self.max_buffer_size:
             gen_log.error("Reached maximum read buffer size")
             self.close()
             raise StreamBufferFullError("Reached maximum read buffer size")
-        return len(chunk)
+        return num_bytes
+
+    def _reserve_read_buffer(self, count):
+        """Makes room for ``count`` more bytes after the buffered data,
+        moving the data to the start of the buffer.
+
+        The buffer is never resized in place (only replaced), so a
+        memoryview of it that outlives a read cannot get in the way.
+        """
+        buf = self._read_buffer
+        pos = self._read_buffer_pos
+        size = self._read_buffer_size
+        # A bytes buffer is immutable, so it is always replaced.
+        if type(buf) is bytearray and size + count <= len(buf):
+            # Dropping the consumed prefix frees enough space.
+            with memoryview(buf) as view:
+                view[:size] = view[pos:pos + size]
+        else:
+            new_buf = _take_read_buffer(max(size + count, 2 * len(buf)))
+            with memoryview(buf) as view:
+                new_buf[:size] = view[pos:pos + size]
+            self._read_buffer = new_buf
+            if type(buf) is bytearray:
+                _release_read_buffer(buf)
+        self._read_buffer_pos = 0
 
     def _run_streaming_callback(self):
         if self._streaming_callback is not None and self._read_buffer_size:
@@ -732,39 +894,35 @@ class BaseIOStream(object):
             num_bytes = min(self._read_bytes, self._read_buffer_size)
             return num_bytes
         elif self._read_delimiter is not None:
-            # Multi-byte delimiters (e.g. '\r\n') may straddle two
-            # chunks in the read buffer, so we can't easily find them
-            # without collapsing the buffer.  However, since protocols
-            # using delimited reads (as opposed to reads of a known
-            # length) tend to be "line" oriented, the delimiter is likely
-            # to be in the first few chunks.  Merge the buffer gradually
-            # since large merges are relatively expensive and get undone in
-            # _consume().
-            if self._read_buffer:
-                while True:
-                    loc = self._read_buffer[0].find(self._read_delimiter)
-                    if loc != -1:
-                        delimiter_len = len(self._read_delimiter)
-                        self._check_max_bytes(self._read_delimiter,
-                                              loc + delimiter_len)
-                        return loc + delimiter_len
-                    if len(self._read_buffer) == 1:
-                        break
-                    _double_prefix(self._read_buffer)
+            # The buffer is contiguous, so the delimiter can be searched
+            # for in place, even when it straddles two reads.
+            if self._read_buffer_size:
+                loc = self._read_buffer.find(
+                    self._read_delimiter, self._read_buffer_pos,
+                    self._read_buffer_pos + self._read_buffer_size)
+                if loc != -1:
+                    loc -= self._read_buffer_pos
+                    delimiter_len = len(self._read_delimiter)
+                    self._check_max_bytes(self._read_delimiter,
+                                          loc + delimiter_len)
+                    return loc + delimiter_len
                 self._check_max_bytes(self._read_delimiter,
-                                      len(self._read_buffer[0]))
+                                      self._read_buffer_size)
         elif self._read_regex is not None:
-            if self._read_buffer:
-                while True:
-                    m = self._read_regex.search(self._read_buffer[0])
-                    if m is not None:
-                        self._check_max_bytes(self._read_regex, m.end())
-                        return m.end()
-                    if len(self._read_buffer) == 1:
-                        break
-                    _double_prefix(self._read_buffer)
+            if self._read_buffer_size:
+                # Search a view of just the unread data, so that ``^``,
+                # ``\b`` and lookbehinds see where it starts, as they
+                # would in a separate string.
+                with memoryview(self._read_buffer)[
+                        self._read_buffer_pos:
+                        self._read_buffer_pos + self._read_buffer_size] as unread:
+                    m = self._read_regex.search(unread)
+                    loc = m.end() if m is not None else None
+                if loc is not None:
+                    self._check_max_bytes(self._read_regex, loc)
+                    return loc
                 self._check_max_bytes(self._read_regex,
-                                      len(self._read_buffer[0]))
+                                      self._read_buffer_size)
         return None
 
     def _check_max_bytes(self, delimiter, size):
@@ -777,32 +935,45 @@ class BaseIOStream(object):
     def _handle_write(self):
         while self._write_buffer:
             try:
-                if not self._write_buffer_frozen:
-                    # On windows, socket.send blows up if given a
-                    # write buffer that's too large, instead of just
-                    # returning the number of bytes it was able to
-                    # process.  Therefore we must not call socket.send
-                    # with more than 128KB at a time.
-                    _merge_prefix(self._write_buffer, 128 * 1024)
-                num_bytes = self.write_to_fd(self._write_buffer[0])
+                if isinstance(self._write_buffer[0], _FileRegion):
+                    region = self._write_buffer[0]
+                    num_bytes = self.write_file_to_fd(region)
+                    if num_bytes == 0:
+                        break
+                    region.offset += num_bytes
+                    region.remaining -= num_bytes
+                    self._write_buffer_size -= num_bytes
+                    if not region.remaining:
+                        self._write_buffer.popleft()
+                        region.close()
+                    continue
+                # On windows, socket.send blows up if given a write
+                # buffer that's too large, instead of just returning the
+                # number of bytes it was able to process.  Therefore we
+                # must not call socket.send with more than 128KB at a time.
+                #
+                # With OpenSSL, if we couldn't write the entire buffer,
+                # the very same buffer must be used on the next call to
+                # send.  Views of the unwritten part of the first string
+                # satisfy that, since the string is never copied or
+                # merged with its neighbours.
+                # (http://bugs.python.org/issue8240)
+                buffers = _gather_prefix(self._write_buffer,
+                                         self._write_buffer_pos,
+                                         self._max_write_buffers,
+                                         128 * 1024)
+                num_bytes = self.write_buffers_to_fd(buffers)
                 if num_bytes == 0:
-                    # With OpenSSL, if we couldn't write the entire buffer,
-                    # the very same string object must be used on the
-                    # next call to send.  Therefore we suppress
-                    # merging the write buffer after an incomplete send.
-                    # A cleaner solution would be to set
-                    # SSL_MODE_ACCEPT_MOVING_WRITE_BUFFER, but this is
-                    # not yet accessible from python
-                    # (http://bugs.python.org/issue8240)
-                    self._write_buffer_frozen = True
                     break
-                self._write_buffer_frozen = False
-                _merge_prefix(self._write_buffer, num_bytes)
-                self._write_buffer.popleft()
                 self._write_buffer_size -= num_bytes
+                # Drop the strings that were written completely and
+                # remember how far we got into the next one.
+                pos = self._write_buffer_pos + num_bytes
+                while pos and pos >= len(self._write_buffer[0]):
+                    pos -= len(self._write_buffer.popleft())
+                self._write_buffer_pos = pos
             except (socket.error, IOError, OSError) as e:
                 if e.args[0] in _ERRNO_WOULDBLOCK:
-                    self._write_buffer_frozen = True
                     break
                 else:
                     if e.args[0] not in _ERRNO_CONNRESET:
@@ -826,9 +997,22 @@ class BaseIOStream(object):
     def _consume(self, loc):
         if loc == 0:
             return b""
-        _merge_prefix(self._read_buffer, loc)
+        buf = self._read_buffer
+        pos = self._read_buffer_pos
+        if pos == 0 and loc == len(buf) and type(buf) is bytes:
+            data = buf
+        else:
+            data = memoryview(buf)[pos:pos + loc].tobytes()
         self._read_buffer_size -= loc
-        return self._read_buffer.popleft()
+        if self._read_buffer_size:
+            self._read_buffer_pos = pos + loc
+        else:
+            # Don't hold on to the memory of an idle stream.
+            if type(buf) is bytearray:
+                _release_read_buffer(buf)
+            self._read_buffer = b""
+            self._read_buffer_pos = 0
+        return data
 
     def _check_closed(self):
         if self.closed():
@@ -942,22 +1126,37 @@ class IOStream(BaseIOStream):
                                        socket.SO_ERROR)
         return socket.error(errno, os.strerror(errno))
 
-    def read_from_fd(self):
+    def read_from_fd(self, buf):
         try:
-            chunk = self.socket.recv(self.read_chunk_size)
+            num_bytes = self.socket.recv_into(buf)
         except socket.error as e:
             if e.args[0] in _ERRNO_WOULDBLOCK:
                 return None
             else:
                 raise
-        if not chunk:
+        if not num_bytes:
             self.close()
             return None
-        return chunk
+        return num_bytes
 
     def write_to_fd(self, data):
         return self.socket.send(data)
 
+    if hasattr(socket.socket, "sendmsg"):
+        _max_write_buffers = _IOV_MAX
+
+        def write_buffers_to_fd(self, buffers):
+            return self.socket.sendmsg(buffers)
+
+    if hasattr(os, "sendfile"):
+        def write_file_to_fd(self, region):
+            num_bytes = os.sendfile(self.socket.fileno(), region.file.fileno(),
+                                    region.offset, region.remaining)
+            if num_bytes == 0:
+                # sendfile only returns 0 at the end of the file.
+                raise IOError(errno.EIO, "Unexpected end of file")
+            return num_bytes
+
     def connect(self, address, callback=None, server_hostname=None):
         """Connects the socket to a remote address without blocking.
 
@@ -1050,7 +1249,7 @@ class IOStream(BaseIOStream):
                 self._write_callback or self._write_future or
                 self._connect_callback or self._connect_future or
                 self._pending_callbacks or self._closed or
-                self._read_buffer or self._write_buffer):
+                self._read_buffer_size or self._write_buffer):
             raise ValueError("IOStream is not idle; cannot convert to SSL")
         if ssl_options is None:
             ssl_options = {}
@@ -1235,6 +1434,9 @@ class SSLIOStream(IOStream):
             return
         super(SSLIOStream, self)._handle_read()
 
+    # sendfile would bypass the encryption layer.
+    write_file_to_fd = BaseIOStream.write_file_to_fd
+
     def _handle_write(self):
         if self._ssl_accepting:
             self._do_ssl_handshake()
@@ -1274,7 +1476,7 @@ class SSLIOStream(IOStream):
                                       do_handshake_on_connect=False)
         self._add_io_state(old_state)
 
-    def read_from_fd(self):
+    def read_from_fd(self, buf):
         if self._ssl_accepting:
             # If the handshake hasn't finished yet, there can't be anything
             # to read (attempting to read may or may not raise an exception
@@ -1286,7 +1488,7 @@ class SSLIOStream(IOStream):
             # The recv() method blocks (at least in python 2.6) if it is
             # called when there is nothing to read, so we have to use
             # read() instead.
-            chunk = self.socket.read(self.read_chunk_size)
+            num_bytes = self.socket.read(len(buf), buf)
         except ssl.SSLError as e:
             # SSLError is a subclass of socket.error, so this except
             # block must come first.
@@ -1299,10 +1501,16 @@ class SSLIOStream(IOStream):
                 return None
             else:
                 raise
-        if not chunk:
+        if not num_bytes:
             self.close()
             return None
-        return chunk
+        return num_bytes
+
+    # SSL sockets do not support sendmsg; write one buffer at a time.
+    _max_write_buffers = 1
+
+    def write_buffers_to_fd(self, buffers):
+        return self.write_to_fd(buffers[0])
 
 
 class PipeIOStream(BaseIOStream):
@@ -1327,9 +1535,15 @@ class PipeIOStream(BaseIOStream):
     def write_to_fd(self, data):
         return os.write(self.fd, data)
 
-    def read_from_fd(self):
+    if hasattr(os, "writev"):
+        _max_write_buffers = _IOV_MAX
+
+        def write_buffers_to_fd(self, buffers):
+            return os.writev(self.fd, buffers)
+
+    def read_from_fd(self, buf):
         try:
-            chunk = os.read(self.fd, self.read_chunk_size)
+            num_bytes = os.readv(self.fd, [buf])
         except (IOError, OSError) as e:
             if errno_from_exception(e) in _ERRNO_WOULDBLOCK:
                 return None
@@ -1340,57 +1554,118 @@ class PipeIOStream(BaseIOStream):
                 return None
             else:
                 raise
-        if not chunk:
+        if not num_bytes:
             self.close()
             return None
-        return chunk
-
+        return num_bytes
 
-def _double_prefix(deque):
-    """Grow by doubling, but don't split the second chunk just because the
-    first one is small.
-    """
-    new_len = max(len(deque[0]) * 2,
-                  (len(deque[0]) + len(deque[1])))
-    _merge_prefix(deque, new_len)
 
+_scratch = threading.local()
 
-def _merge_prefix(deque, size):
-    """Replace the first entries in a deque of strings with a single
-    string of up to size bytes.
+# Read buffers released by idle streams are kept for reuse by the next
+# stream that needs a large one: allocating (and faulting in) a fresh
+# buffer for every large message costs more than copying the data.
+_MAX_POOLED_BUFFERS = 4
+_MAX_POOLED_BUFFER_SIZE = 4 * 1024 * 1024
 
-    >>> d = collections.deque(['abc', 'de', 'fghi', 'j'])
-    >>> _merge_prefix(d, 5); print(d)
-    deque(['abcde', 'fghi', 'j'])
+# A pending read_bytes makes room for at most this many read chunks
+# ahead of the data that has arrived.
+_MAX_READ_RESERVE_CHUNKS = 16
 
-    Strings will be split as necessary to reach the desired size.
-    >>> _merge_prefix(d, 7); print(d)
-    deque(['abcdefg', 'hi', 'j'])
 
-    >>> _merge_prefix(d, 3); print(d)
-    deque(['abc', 'defg', 'hi', 'j'])
+def _read_scratch(size):
+    """Returns a writable memoryview of ``size`` bytes for `read_from_fd`.
 
-    >>> _merge_prefix(d, 100); print(d)
-    deque(['abcdefghij'])
+    Streams with nothing buffered read into this memory, which is shared
+    by all streams on the current thread; the data is copied out as soon
+    as ``read_from_fd`` returns.  This saves allocating (and zeroing)
+    ``read_chunk_size`` bytes for every read of a small message.
     """
-    if len(deque) == 1 and len(deque[0]) <= size:
+    view = getattr(_scratch, "view", None)
+    if view is None or len(view) < size:
+        view = _scratch.view = memoryview(bytearray(size))
+    return view[:size]
+
+
+def _take_read_buffer(size):
+    """Returns a bytearray of at least ``size`` bytes for a read buffer."""
+    pool = getattr(_scratch, "pool", None)
+    if pool:
+        # The pool is sorted by size, so this is the smallest that fits.
+        for i, buf in enumerate(pool):
+            if len(buf) >= size:
+                del pool[i]
+                return buf
+    return bytearray(size)
+
+
+def _release_read_buffer(buf):
+    """Offers a read buffer that is no longer used to `_take_read_buffer`."""
+    if not 65536 <= len(buf) <= _MAX_POOLED_BUFFER_SIZE:
         return
-    prefix = []
-    remaining = size
-    while deque and remaining > 0:
-        chunk = deque.popleft()
-        if len(chunk) > remaining:
-            deque.appendleft(chunk[remaining:])
-            chunk = chunk[:remaining]
-        prefix.append(chunk)
-        remaining -= len(chunk)
-    # This data structure normally just contains byte strings, but
-    # the unittest gets messy if it doesn't use the default str() type,
-    # so do the merge based on the type of data that's actually present.
-    if prefix:
-        deque.appendleft(type(prefix[0])().join(prefix))
-    if not deque:
-        deque.appendleft(b"")
+    pool = getattr(_scratch, "pool", None)
+    if pool is None:
+        pool = _scratch.pool = []
+    if len(pool) == _MAX_POOLED_BUFFERS:
+        if len(pool[0]) >= len(buf):
+            return
+        # Keep the largest buffers.
+        del pool[0]
+    pool.append(buf)
+    pool.sort(key=len)
+
+
+class _FileRegion(object):
+    """A region of an open file queued by `BaseIOStream.write_file`."""
+    __slots__ = ('file', 'offset', 'remaining', 'chunk')
+
+    def __init__(self, file, offset, count):
+        self.file = file
+        self.offset = offset
+        self.remaining = count
+        # Data read but not yet written by the copying fallback.
+        self.chunk = None
+
+    def __len__(self):
+        return self.remaining
+
+    def read(self, size):
+        self.file.seek(self.offset)
+        return self.file.read(min(size, self.remaining))
+
+    def close(self):
+        self.file.close()
+
+
+def _gather_prefix(deque, offset, max_buffers, max_first):
+    """Returns the byte strings at the start of a deque of write buffers
+    as a list for `BaseIOStream.write_buffers_to_fd`.
+
+    The first ``offset`` bytes of the first string have already been
+    written and are skipped, without copying the rest.  At most
+    ``max_buffers`` strings are returned and the list ends before any
+    `_FileRegion`.  With a single buffer, no more than ``max_first``
+    bytes are returned.
+
+    >>> d = collections.deque([b'abc', b'de', b'fghi', b'j'])
+    >>> [bytes(b) for b in _gather_prefix(d, 1, 3, 1024)]
+    [b'bc', b'de', b'fghi']
+    >>> [bytes(b) for b in _gather_prefix(d, 1, 1, 1)]
+    [b'b']
+    >>> d.insert(2, _FileRegion(None, 0, 10))
+    >>> [bytes(b) for b in _gather_prefix(d, 0, 16, 1024)]
+    [b'abc', b'de']
+    """
+    first = memoryview(deque[0])[offset:]
+    if max_buffers == 1:
+        return [first[:max_first]]
+    buffers = [first]
+    for i in range(1, min(len(deque), max_buffers)):
+        data = deque[i]
+        if isinstance(data, _FileRegion):
+            break
+        buffers.append(data)
+    return buffers
 
 
 def doctests():
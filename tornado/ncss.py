@@ -46,21 +46,27 @@ for logger in (tornado.log.access_log, tornado.log.app_log, tornado.log.gen_log,
 SERVER_RUNNING_LOG_STRING_TEMPLATE = 'Reloading... waiting for requests on http://{}:{}'
 
 class Server:
-    __slots__ = ('cookie_secret', 'default_handler', 'debug', 'handlers', 'hostname', 'port', 'static_path')
+    __slots__ = ('compress_response', 'cookie_secret', 'default_handler', 'debug', 'handlers', 'hostname', 'port', 'static_handler_class', 'static_path')
 
-    def __init__(self, *, hostname='', port=8888, static_path='static', debug=True):
+    def __init__(self, *, hostname='', port=8888, static_path='static', static_handler_class=None, compress_response=False, debug=True):
         if type(hostname) is not str:
             raise ValueError('hostname must be a string')
         if type(port) is not int or port <= 0:
             raise ValueError('port must be a positive integer')
         if type(static_path) is not str or not static_path:
             raise ValueError('static must be a non-empty string')
+        if static_handler_class is not None and not (inspect.isclass(static_handler_class) and issubclass(static_handler_class, tornado.web.StaticFileHandler)):
+            raise ValueError('static_handler_class must be a StaticFileHandler class')
+        if type(compress_response) is not bool:
+            raise ValueError('compress_response must be a boolean')
         if type(debug) is not bool:
             raise ValueError('debug must be a boolean')
 
         self.hostname = hostname
         self.port = port
         self.static_path = static_path
+        self.static_handler_class = static_handler_class
+        self.compress_response = compress_response
         self.debug = debug
         self.handlers = []
         self.cookie_secret = None
@@ -182,9 +188,13 @@ class Server:
         else:
             default_handler_class = None
 
+        if self.static_handler_class is not None:
+            kwargs.setdefault('static_handler_class', self.static_handler_class)
+
         # Create the app, in debug mode (autoreload) as requested.
         app = tornado.web.Application(
             self.handlers,
+            compress_response=self.compress_response,
             cookie_secret=cookie_secret,
             debug=self.debug,
             default_handler_class=default_handler_class,
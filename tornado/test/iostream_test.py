@@ -18,6 +18,7 @@ import platform
 import socket
 import ssl
 import sys
+import tempfile
 
 
 def _server_ssl_options():
@@ -516,9 +517,9 @@ class TestIOStreamMixin(object):
             client.write(b'a')
             # Stub out read_from_fd to make it fail.
 
-            def fake_read_from_fd():
+            def fake_read_from_fd(buf):
                 os.close(server.socket.fileno())
-                server.__class__.read_from_fd(server)
+                server.__class__.read_from_fd(server, buf)
             server.read_from_fd = fake_read_from_fd
             # This log message is from _handle_read (not read_from_fd).
             with ExpectLog(gen_log, "error on read"):
@@ -694,6 +695,36 @@ class TestIOStreamMixin(object):
             server.close()
             client.close()
 
+    def test_write_file(self):
+        server, client = self.make_iostream_pair()
+        try:
+            f = tempfile.TemporaryFile()
+            f.write(b"0123456789" * 30000)
+            server.write(b"head:")
+            server.write_file(f, 10, 200000)
+            server.write(b":tail")
+            client.read_bytes(200010, self.stop)
+            data = self.wait()
+            self.assertEqual(data, b"head:" + b"0123456789" * 20000 + b":tail")
+            self.assertTrue(f.closed)
+        finally:
+            server.close()
+            client.close()
+
+    def test_write_file_close(self):
+        # A file whose region has not been written yet is closed along
+        # with the stream.
+        server, client = self.make_iostream_pair()
+        try:
+            f = tempfile.TemporaryFile()
+            f.write(b"a" * 16 * 1024 * 1024)
+            server.write_file(f, 0, 16 * 1024 * 1024)
+            server.close()
+            self.assertTrue(f.closed)
+        finally:
+            server.close()
+            client.close()
+
     def test_small_reads_from_large_buffer(self):
         # 10KB buffer size, 100KB available to read.
         # Read 1KB at a time and make sure that the buffer is not eagerly
@@ -724,6 +755,102 @@ class TestIOStreamMixin(object):
             server.close()
             client.close()
 
+    def test_reads_across_chunks(self):
+        # With a tiny read_chunk_size delimiters straddle reads, and the
+        # data after each match must stay buffered for the next read.
+        server, client = self.make_iostream_pair(read_chunk_size=7)
+        try:
+            record = b"header\r\n\r\n0123456789abcdef"
+            server.write(record * 20 + b"x" * 1000)
+            for i in range(20):
+                client.read_until(b"\r\n\r\n", self.stop)
+                self.assertEqual(self.wait(), b"header\r\n\r\n")
+                client.read_until_regex(b"[0-9]+a", self.stop)
+                self.assertEqual(self.wait(), b"0123456789a")
+                client.read_bytes(5, self.stop)
+                self.assertEqual(self.wait(), b"bcdef")
+            client.read_bytes(1000, self.stop)
+            self.assertEqual(self.wait(), b"x" * 1000)
+            self.assertEqual(client._read_buffer_size, 0)
+        finally:
+            server.close()
+            client.close()
+
+    def test_writev(self):
+        # Buffers larger than the socket buffer are only partly written
+        # by each call, so later sends resume in the middle of a string.
+        server, client = self.make_iostream_pair()
+        try:
+            buffers = [b"a" * 300000, b"", b"bc", b"d" * 70000, b"e"]
+            written = []
+            server.writev(buffers, callback=lambda: written.append(True))
+            client.read_bytes(370003, self.stop)
+            self.assertEqual(self.wait(), b"".join(buffers))
+            self.assertEqual(written, [True])
+            self.assertEqual(server._write_buffer_size, 0)
+            self.assertEqual(server._write_buffer_pos, 0)
+        finally:
+            server.close()
+            client.close()
+
+    def test_writev_with_file(self):
+        server, client = self.make_iostream_pair()
+        try:
+            f = tempfile.TemporaryFile()
+            f.write(b"0123456789" * 30000)
+            server.writev([b"he", b"ad:"])
+            server.write_file(f, 10, 200000)
+            server.writev([b":t", b"ail"])
+            client.read_bytes(200010, self.stop)
+            data = self.wait()
+            self.assertEqual(data, b"head:" + b"0123456789" * 20000 + b":tail")
+        finally:
+            server.close()
+            client.close()
+
+    def test_read_until_regex_anchored(self):
+        # Patterns see the unread data as a string of its own, even when
+        # it follows consumed data in the same read.
+        server, client = self.make_iostream_pair()
+        try:
+            server.write(b"xyzab\r\nxab\r\n")
+            client.read_bytes(3, self.stop)
+            self.assertEqual(self.wait(), b"xyz")
+            client.read_until_regex(b"^ab\r\n", self.stop)
+            self.assertEqual(self.wait(), b"ab\r\n")
+            client.read_until_regex(b"(?<!x)ab\r\n|^x", self.stop)
+            self.assertEqual(self.wait(), b"x")
+        finally:
+            server.close()
+            client.close()
+
+    def test_read_bytes_reserve_bounded(self):
+        # A long read makes room for the data only as it arrives.
+        server, client = self.make_iostream_pair()
+        try:
+            client.read_bytes(50 * 1024 * 1024, self.stop)
+            server.write(b"a")
+            self.io_loop.add_timeout(self.io_loop.time() + 0.05, self.stop)
+            self.wait()
+            self.assertEqual(client._read_buffer_size, 1)
+            self.assertLessEqual(len(client._read_buffer),
+                                 2 * 16 * client.read_chunk_size)
+        finally:
+            server.close()
+            client.close()
+
+    def test_read_bytes_max_buffer_size(self):
+        server, client = self.make_iostream_pair(max_buffer_size=1024)
+        client.set_close_callback(lambda: self.stop("closed"))
+        try:
+            with ExpectLog(gen_log, "Unsatisfiable read"):
+                client.read_bytes(1025, self.stop)
+                data = self.wait()
+            self.assertEqual(data, "closed")
+        finally:
+            server.close()
+            client.close()
+
 
 class TestIOStreamWebHTTP(TestIOStreamWebMixin, AsyncHTTPTestCase):
     def _make_client_iostream(self):
@@ -1066,6 +1066,31 @@ class StaticFileTest(WebTestCase):
         self.assertEqual(response.code, 404)
 
 
+class StaticFileSendfileTest(WebTestCase):
+    def get_handlers(self):
+        class Handler(StaticFileHandler):
+            files_opened = 0
+
+            @classmethod
+            def get_content_file(cls, abspath):
+                cls.files_opened += 1
+                return super(Handler, cls).get_content_file(abspath)
+
+        self.handler_class = Handler
+        return [('/static/(.*)', Handler, dict(path=relpath('static')))]
+
+    def test_write_file(self):
+        # Plain HTTP/1 responses are sent from the file itself rather
+        # than read through get_content.
+        response = self.fetch('/static/robots.txt')
+        self.assertEqual(response.body, b"User-agent: *\nDisallow: /\n")
+        response = self.fetch('/static/robots.txt', headers={
+            'Range': 'bytes=12-'})
+        self.assertEqual(response.code, 206)
+        self.assertEqual(response.body, b"*\nDisallow: /\n")
+        self.assertEqual(self.handler_class.files_opened, 2)
+
+
 @wsgi_safe
 class StaticDefaultFilenameTest(WebTestCase):
     def get_app_kwargs(self):
@@ -1384,6 +1409,39 @@ class GzipTestCase(SimpleHandlerTestCase):
         self.assertEqual(response.headers['Vary'],
                          'Accept-Language, Accept-Encoding')
 
+    def test_vary_accept_encoding_present(self):
+        response = self.fetch('/?vary=Accept-Encoding')
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+
+
+@wsgi_safe
+class MultipleWriteTest(SimpleHandlerTestCase):
+    class Handler(RequestHandler):
+        def get(self):
+            # Several buffered chunks in each flush, which are handed
+            # to the connection as a list rather than joined.
+            self.write('hello ')
+            self.write('world')
+            self.flush()
+            self.write(', ')
+            self.write('again')
+
+    def get_app_kwargs(self):
+        return dict(gzip=True)
+
+    def test_multiple_writes(self):
+        response = self.fetch('/', use_gzip=False)
+        self.assertEqual(response.body, b'hello world, again')
+
+    def test_multiple_writes_gzip(self):
+        response = self.fetch('/')
+        self.assertEqual(
+            response.headers.get(
+                'Content-Encoding',
+                response.headers.get('X-Consumed-Content-Encoding')),
+            'gzip')
+        self.assertEqual(response.body, b'hello world, again')
+
 
 @wsgi_safe
 class PathArgsInPrepareTest(WebTestCase):
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#
+# Compares the websocket masking implementations in tornado.util (and the
+# C extension, if it has been built) across a range of payload sizes.
+#
+# Usage:
+#   python -m tornado.test.websocket_mask_benchmark
+#   python -m tornado.test.websocket_mask_benchmark --sizes=125,65536 --seconds=1
+
+from __future__ import absolute_import, division, print_function, with_statement
+
+import os
+import timeit
+
+from tornado.options import define, options, parse_command_line
+from tornado import util
+
+try:
+    from tornado import speedups
+except ImportError:
+    speedups = None
+
+define('sizes', type=int, multiple=True,
+       default=[0, 16, 125, 1024, 16 * 1024, 64 * 1024, 1024 * 1024],
+       help='payload sizes to measure, in bytes')
+define('seconds', type=float, default=0.2,
+       help='approximate time to spend on each measurement')
+define('python_max_size', type=int, default=64 * 1024,
+       help='skip the byte-at-a-time implementation above this size')
+
+
+def implementations():
+    impls = [('python', util._websocket_mask_python)]
+    if hasattr(int, 'from_bytes'):
+        impls.append(('int', util._websocket_mask_int))
+    if util.numpy is not None:
+        impls.append(('numpy', util._websocket_mask_numpy))
+    if hasattr(int, 'from_bytes'):
+        impls.append(('vectorized', util._websocket_mask_vectorized))
+    if speedups is not None:
+        impls.append(('speedups', speedups.websocket_mask))
+    return impls
+
+
+def measure(func, mask, data):
+    """Returns the best time per call of ``func(mask, data)``, in seconds."""
+    timer = timeit.Timer(lambda: func(mask, data))
+    number = 1
+    while timer.timeit(number) < options.seconds / 10:
+        number *= 2
+    return min(timer.repeat(5, number)) / number
+
+
+def main():
+    parse_command_line()
+    impls = implementations()
+    mask = os.urandom(4)
+    print('%10s  ' % 'bytes' + '  '.join('%12s' % name for name, func in impls))
+    for size in options.sizes:
+        data = os.urandom(size)
+        expected = util._websocket_mask_python(mask, data)
+        row = []
+        for name, func in impls:
+            if name == 'python' and size > options.python_max_size:
+                row.append('%12s' % '-')
+                continue
+            assert func(mask, data) == expected, name
+            row.append('%10.2fus' % (measure(func, mask, data) * 1e6))
+        print('%10d  ' % size + '  '.join(row))
+    print('selected: %s' % util._websocket_mask.__name__)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,22 @@
 from __future__ import absolute_import, division, print_function, with_statement
 
 import traceback
+import zlib
 
 from tornado.concurrent import Future
+from tornado import gen
 from tornado.httpclient import HTTPError, HTTPRequest
 from tornado.log import gen_log, app_log
 from tornado.testing import AsyncHTTPTestCase, gen_test, bind_unused_port, ExpectLog
 from tornado.test.util import unittest
 from tornado.web import Application, RequestHandler
 from tornado.util import u
+from tornado.escape import utf8
 
 try:
     import tornado.websocket
-    from tornado.util import _websocket_mask_python
+    from tornado.util import _websocket_mask_python, _websocket_mask_int, _websocket_mask_numpy, _websocket_mask_vectorized
+    from tornado.util import numpy
 except ImportError:
     # The unittest module presents misleading errors on ImportError
     # (it acts as if websocket_test could not be found, hiding the underlying
@@ -21,7 +25,7 @@ except ImportError:
     traceback.print_exc()
     raise
 
-from tornado.websocket import WebSocketHandler, websocket_connect, WebSocketError
+from tornado.websocket import WebSocketHandler, websocket_connect, WebSocketError, BroadcastGroup
 
 try:
     from tornado import speedups
@@ -284,6 +288,221 @@ class WebSocketTest(AsyncHTTPTestCase):
         self.assertEqual(cm.exception.code, 403)
 
 
+class BroadcastHandler(WebSocketHandler):
+    def initialize(self, groups):
+        self.groups = groups
+
+    def open(self, name):
+        self.groups[name].add(self)
+        self.write_message('joined')
+
+
+class BroadcastTest(AsyncHTTPTestCase):
+    def get_app(self):
+        self.groups = dict(
+            all=BroadcastGroup(),
+            drop=BroadcastGroup(max_write_buffer_size=64 * 1024),
+            disconnect=BroadcastGroup(max_write_buffer_size=64 * 1024,
+                                      policy=BroadcastGroup.DISCONNECT),
+        )
+        return Application([
+            ('/(.*)', BroadcastHandler, dict(groups=self.groups)),
+        ])
+
+    @gen.coroutine
+    def connect(self, name):
+        ws = yield websocket_connect(
+            'ws://localhost:%d/%s' % (self.get_http_port(), name),
+            io_loop=self.io_loop)
+        response = yield ws.read_message()
+        self.assertEqual(response, 'joined')
+        raise gen.Return(ws)
+
+    def fill(self, group):
+        # Nothing runs on the IOLoop during this loop, so the clients
+        # can't read and the messages pile up in the servers' buffers.
+        message = b'x' * (1024 * 1024)
+        for i in range(100):
+            if not group.broadcast(message, binary=True):
+                return message
+        self.fail('broadcast was never held back')
+
+    @gen_test
+    def test_broadcast(self):
+        clients = []
+        for i in range(3):
+            clients.append((yield self.connect('all')))
+        group = self.groups['all']
+        self.assertEqual(len(group), 3)
+        self.assertEqual(group.broadcast(u('hello \u00e9')), 3)
+        self.assertEqual(group.broadcast({'a': 1}), 3)
+        self.assertEqual(group.broadcast(b'\xff' * 70000, binary=True), 3)
+        for ws in clients:
+            response = yield ws.read_message()
+            self.assertEqual(response, u('hello \u00e9'))
+            response = yield ws.read_message()
+            self.assertEqual(response, '{"a": 1}')
+            response = yield ws.read_message()
+            self.assertEqual(response, b'\xff' * 70000)
+            ws.close()
+
+    @gen_test
+    def test_broadcast_drop(self):
+        ws = yield self.connect('drop')
+        message = self.fill(self.groups['drop'])
+        self.assertEqual(len(self.groups['drop']), 1)
+        # The messages that were queued arrive intact.
+        response = yield ws.read_message()
+        self.assertEqual(response, message)
+        ws.close()
+
+    @gen_test
+    def test_broadcast_disconnect(self):
+        ws = yield self.connect('disconnect')
+        self.fill(self.groups['disconnect'])
+        self.assertEqual(len(self.groups['disconnect']), 0)
+        while (yield ws.read_message()) is not None:
+            pass
+        self.assertEqual(ws.close_code, 1008)
+
+
+class CompressionHandler(BroadcastHandler):
+    def initialize(self, groups, compression_options):
+        BroadcastHandler.initialize(self, groups)
+        self.compression_options = compression_options
+
+    def get_compression_options(self):
+        return self.compression_options
+
+    def on_message(self, message):
+        self.write_message(message, isinstance(message, bytes))
+
+
+class CompressionTest(AsyncHTTPTestCase):
+    # Compresses well, like a question with its answers.
+    MESSAGE = u('{"question": "Which of these is a planet?", "answers": '
+                '["Pluto", "Mars", "Ceres", "The Moon"]}') * 4
+
+    def get_app(self):
+        self.groups = dict(default=BroadcastGroup(), fresh=BroadcastGroup())
+        return Application([
+            ('/(default)', CompressionHandler,
+             dict(groups=self.groups, compression_options={})),
+            ('/(fresh)', CompressionHandler,
+             dict(groups=self.groups, compression_options=dict(
+                 compression_level=9, compression_threshold=16,
+                 server_no_context_takeover=True,
+                 client_no_context_takeover=True))),
+        ], websocket_max_message_size=64 * 1024)
+
+    @gen.coroutine
+    def connect(self, name, compression_options=None):
+        ws = yield websocket_connect(
+            'ws://localhost:%d/%s' % (self.get_http_port(), name),
+            io_loop=self.io_loop, compression_options=compression_options)
+        response = yield ws.read_message()
+        self.assertEqual(response, 'joined')
+        raise gen.Return(ws)
+
+    @gen_test
+    def test_echo(self):
+        ws = yield self.connect('default', {})
+        self.assertIsNotNone(ws.protocol._compressor)
+        self.assertTrue(ws.protocol._compressor.persistent)
+        for message in [self.MESSAGE, self.MESSAGE, u('hi'), b'\x00\xff' * 100]:
+            ws.write_message(message, binary=isinstance(message, bytes))
+            response = yield ws.read_message()
+            self.assertEqual(response, message)
+        ws.close()
+
+    @gen_test
+    def test_not_offered(self):
+        ws = yield self.connect('default')
+        self.assertIsNone(ws.protocol._compressor)
+        handler, = self.groups['default']
+        self.assertIsNone(handler.ws_connection._compressor)
+        ws.write_message(self.MESSAGE)
+        response = yield ws.read_message()
+        self.assertEqual(response, self.MESSAGE)
+        ws.close()
+
+    @gen_test
+    def test_no_context_takeover(self):
+        ws = yield self.connect('fresh', {})
+        handler, = self.groups['fresh']
+        self.assertFalse(ws.protocol._compressor.persistent)
+        self.assertFalse(handler.ws_connection._compressor.persistent)
+        for i in range(3):
+            ws.write_message(self.MESSAGE)
+            response = yield ws.read_message()
+            self.assertEqual(response, self.MESSAGE)
+        ws.close()
+
+    @gen_test
+    def test_threshold(self):
+        ws = yield self.connect('fresh', {})
+        handler, = self.groups['fresh']
+        message = utf8(self.MESSAGE)
+        header, data = handler.ws_connection._format_message(0x1, message)
+        self.assertTrue(ord(header[:1]) & 0x40)
+        self.assertLess(len(data), len(message) // 4)
+        header, data = handler.ws_connection._format_message(0x1, b'tiny')
+        self.assertFalse(ord(header[:1]) & 0x40)
+        self.assertEqual(data, b'tiny')
+        ws.close()
+
+    @gen_test
+    def test_broadcast(self):
+        clients = [(yield self.connect('fresh', {})),
+                   (yield self.connect('fresh', {})),
+                   (yield self.connect('fresh'))]
+        clients.append((yield self.connect('default', {})))
+        group = self.groups['fresh']
+        for handler in self.groups['default']:
+            group.add(handler)
+        for i in range(2):
+            self.assertEqual(group.broadcast(self.MESSAGE), 4)
+        for ws in clients:
+            for i in range(2):
+                response = yield ws.read_message()
+                self.assertEqual(response, self.MESSAGE)
+            ws.close()
+
+    @gen.coroutine
+    def assert_too_big(self, ws, message):
+        ws.write_message(message, binary=True)
+        response = yield ws.read_message()
+        self.assertIsNone(response)
+        self.assertEqual(ws.close_code, 1009)
+
+    @gen_test
+    def test_message_too_big(self):
+        ws = yield self.connect('default')
+        yield self.assert_too_big(ws, b'x' * (64 * 1024 + 1))
+
+    @gen_test
+    def test_decompressed_message_too_big(self):
+        # A few hundred bytes on the wire that would inflate to 10MB.
+        ws = yield self.connect('default', {})
+        message = b'\x00' * (10 * 1024 * 1024)
+        self.assertLess(len(zlib.compress(message)), 64 * 1024)
+        yield self.assert_too_big(ws, message)
+
+    def test_accept_offer_window_bits(self):
+        protocol = tornado.websocket.WebSocketProtocol13.__new__(
+            tornado.websocket.WebSocketProtocol13)
+        protocol._compression_options = {}
+        accept = protocol._accept_deflate_offer
+        self.assertEqual(accept({'server_max_window_bits': None}), {})
+        self.assertEqual(accept({'server_max_window_bits': '10'}),
+                         {'server_max_window_bits': '10'})
+        self.assertIsNone(accept({'server_max_window_bits': '8'}))
+        self.assertIsNone(accept({'server_max_window_bits': '16'}))
+        self.assertEqual(accept({'client_max_window_bits': '8'}),
+                         {'client_max_window_bits': '8'})
+        self.assertIsNone(accept({'client_max_window_bits': '7'}))
+
+
 class MaskFunctionMixin(object):
     # Subclasses should define self.mask(mask, data)
     def test_mask(self):
@@ -301,12 +520,36 @@ class MaskFunctionMixin(object):
                                    b'\x00\x01\x02\x03\x04\x05'),
                          b'\xff\xfa\xff\xff\xfb\xfe')
 
+    def test_mask_long(self):
+        # Long enough to use whole words, with a partial word at the end.
+        data = bytes(bytearray(range(256))) * 10 + b'xyz'
+        self.assertEqual(self.mask(b'\x13\x9a\x00\xfe', data),
+                         _websocket_mask_python(b'\x13\x9a\x00\xfe', data))
+
 
 class PythonMaskFunctionTest(MaskFunctionMixin, unittest.TestCase):
     def mask(self, mask, data):
         return _websocket_mask_python(mask, data)
 
 
+@unittest.skipIf(not hasattr(int, 'from_bytes'), "int.from_bytes not present")
+class IntMaskFunctionTest(MaskFunctionMixin, unittest.TestCase):
+    def mask(self, mask, data):
+        return _websocket_mask_int(mask, data)
+
+
+@unittest.skipIf(numpy is None, "numpy module not present")
+class NumpyMaskFunctionTest(MaskFunctionMixin, unittest.TestCase):
+    def mask(self, mask, data):
+        return _websocket_mask_numpy(mask, data)
+
+
+@unittest.skipIf(not hasattr(int, 'from_bytes'), "int.from_bytes not present")
+class VectorizedMaskFunctionTest(MaskFunctionMixin, unittest.TestCase):
+    def mask(self, mask, data):
+        return _websocket_mask_vectorized(mask, data)
+
+
 @unittest.skipIf(speedups is None, "tornado.speedups module not present")
 class CythonMaskFunctionTest(MaskFunctionMixin, unittest.TestCase):
     def mask(self, mask, data):
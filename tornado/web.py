@@ -823,17 +823,19 @@ class RequestHandler(object):
         .. versionchanged:: 4.0
            Now returns a `.Future` if no callback is given.
         """
-        chunk = b"".join(self._write_buffer)
+        # The buffered chunks are passed on as a list, so that they can
+        # be sent with a single gathering write instead of being joined.
+        chunks = self._write_buffer
         self._write_buffer = []
         if not self._headers_written:
             self._headers_written = True
             for transform in self._transforms:
-                self._status_code, self._headers, chunk = \
-                    transform.transform_first_chunk(
-                        self._status_code, self._headers, chunk, include_footers)
+                self._status_code, self._headers, chunks = \
+                    transform.transform_first_chunks(
+                        self._status_code, self._headers, chunks, include_footers)
             # Ignore the chunk and only write the headers for HEAD requests
             if self.request.method == "HEAD":
-                chunk = None
+                chunks = None
 
             # Finalize the cookie headers (which have been stored in a side
             # object so an outgoing cookie could be overwritten before it
@@ -846,13 +848,13 @@ class RequestHandler(object):
                                                     self._status_code,
                                                     self._reason)
             return self.request.connection.write_headers(
-                start_line, self._headers, chunk, callback=callback)
+                start_line, self._headers, chunks, callback=callback)
         else:
             for transform in self._transforms:
-                chunk = transform.transform_chunk(chunk, include_footers)
+                chunks = transform.transform_chunks(chunks, include_footers)
             # Ignore the chunk and only write the headers for HEAD requests
             if self.request.method != "HEAD":
-                return self.request.connection.write(chunk, callback=callback)
+                return self.request.connection.write(chunks, callback=callback)
             else:
                 future = Future()
                 future.set_result(None)
@@ -2164,6 +2166,20 @@ class StaticFileHandler(RequestHandler):
         self.set_header("Content-Length", content_length)
 
         if include_body:
+            content_file = None
+            if hasattr(self.request.connection, "write_file"):
+                content_file = self.get_content_file(self.absolute_path)
+            if content_file is not None:
+                try:
+                    yield self.flush()
+                except Exception:
+                    content_file.close()
+                    raise
+                if not self._body_transformed():
+                    yield self.request.connection.write_file(
+                        content_file, start or 0, content_length)
+                    return
+                content_file.close()
             content = self.get_content(self.absolute_path, start, end)
             if isinstance(content, bytes_type):
                 content = [content]
@@ -2325,6 +2341,40 @@ class StaticFileHandler(RequestHandler):
                         assert remaining == 0
                     return
 
+    @classmethod
+    def get_content_file(cls, abspath):
+        """Returns an open binary file holding the content at the given
+        absolute path, or None.
+
+        When a file is returned, the connection supports it (plain HTTP/1
+        connections do) and no output transform needs to rewrite the body,
+        the response is sent directly from the file with
+        `.BaseIOStream.write_file` (``os.sendfile`` where available)
+        instead of being read through `get_content`.
+
+        Subclasses that override `get_content` to serve something other
+        than the file at ``abspath`` must override this method as well;
+        the default returns None for them, which always uses
+        `get_content`.
+        """
+        if cls.get_content.__func__ is not StaticFileHandler.get_content.__func__:
+            return None
+        return open(abspath, "rb")
+
+    def _body_transformed(self):
+        """Returns True if an output transform will rewrite the body.
+
+        Only meaningful once the headers have been flushed, since that
+        is when transforms decide what to do.
+        """
+        for transform in self._transforms or ():
+            if isinstance(transform, GZipContentEncoding):
+                if transform._gzipping:
+                    return True
+            elif type(transform).transform_chunk is not OutputTransform.transform_chunk:
+                return True
+        return False
+
     @classmethod
     def get_content_version(cls, abspath):
         """Returns a version string for the resource at the given path.
@@ -2515,6 +2565,25 @@ class OutputTransform(object):
     def transform_chunk(self, chunk, finishing):
         return chunk
 
+    def transform_first_chunks(self, status_code, headers, chunks, finishing):
+        """Like `transform_first_chunk`, but for a list of byte strings.
+
+        Returns a list too.  The default implementation joins the
+        strings and calls `transform_first_chunk`; transforms which can
+        leave the body alone should override it so that the strings are
+        not copied.
+        """
+        status_code, headers, chunk = self.transform_first_chunk(
+            status_code, headers, b"".join(chunks), finishing)
+        return status_code, headers, [chunk]
+
+    def transform_chunks(self, chunks, finishing):
+        """Like `transform_chunk`, but for a list of byte strings.
+
+        See `transform_first_chunks`.
+        """
+        return [self.transform_chunk(b"".join(chunks), finishing)]
+
 
 class GZipContentEncoding(OutputTransform):
     """Applies the gzip content encoding to the response.
@@ -2540,42 +2609,56 @@ class GZipContentEncoding(OutputTransform):
         return ctype.startswith('text/') or ctype in self.CONTENT_TYPES
 
     def transform_first_chunk(self, status_code, headers, chunk, finishing):
+        status_code, headers, chunks = self.transform_first_chunks(
+            status_code, headers, [chunk], finishing)
+        return status_code, headers, b"".join(chunks)
+
+    def transform_chunk(self, chunk, finishing):
+        return b"".join(self.transform_chunks([chunk], finishing))
+
+    def transform_first_chunks(self, status_code, headers, chunks, finishing):
         if 'Vary' in headers:
-            headers['Vary'] += b', Accept-Encoding'
+            # Handlers that pick a precompressed representation themselves
+            # (and so set Content-Encoding) already vary on Accept-Encoding.
+            vary = [v.strip().lower() for v in _unicode(headers['Vary']).split(',')]
+            if 'accept-encoding' not in vary:
+                headers['Vary'] += b', Accept-Encoding'
         else:
             headers['Vary'] = b'Accept-Encoding'
         if self._gzipping:
             ctype = _unicode(headers.get("Content-Type", "")).split(";")[0]
             self._gzipping = self._compressible_type(ctype) and \
-                (not finishing or len(chunk) >= self.MIN_LENGTH) and \
+                (not finishing or
+                 sum(len(chunk) for chunk in chunks) >= self.MIN_LENGTH) and \
                 ("Content-Encoding" not in headers)
         if self._gzipping:
             headers["Content-Encoding"] = "gzip"
             self._gzip_value = BytesIO()
             self._gzip_file = gzip.GzipFile(mode="w", fileobj=self._gzip_value)
-            chunk = self.transform_chunk(chunk, finishing)
+            chunks = self.transform_chunks(chunks, finishing)
             if "Content-Length" in headers:
                 # The original content length is no longer correct.
                 # If this is the last (and only) chunk, we can set the new
                 # content-length; otherwise we remove it and fall back to
                 # chunked encoding.
                 if finishing:
-                    headers["Content-Length"] = str(len(chunk))
+                    headers["Content-Length"] = str(len(chunks[0]))
                 else:
                     del headers["Content-Length"]
-        return status_code, headers, chunk
+        return status_code, headers, chunks
 
-    def transform_chunk(self, chunk, finishing):
+    def transform_chunks(self, chunks, finishing):
         if self._gzipping:
-            self._gzip_file.write(chunk)
+            for chunk in chunks:
+                self._gzip_file.write(chunk)
             if finishing:
                 self._gzip_file.close()
             else:
                 self._gzip_file.flush()
-            chunk = self._gzip_value.getvalue()
+            chunks = [self._gzip_value.getvalue()]
             self._gzip_value.truncate(0)
             self._gzip_value.seek(0)
-        return chunk
+        return chunks
 
 
 def authenticated(method):
@@ -26,6 +26,7 @@ import os
 import struct
 import tornado.escape
 import tornado.web
+import zlib
 
 from tornado.concurrent import TracebackFuture
 from tornado.escape import utf8, native_str, to_unicode
@@ -47,6 +48,9 @@ try:
 except NameError:
     xrange = range  # py3
 
+# The largest message a connection accepts unless told otherwise.
+_DEFAULT_MAX_MESSAGE_SIZE = 10 * 1024 * 1024
+
 
 class WebSocketError(Exception):
     pass
@@ -171,7 +175,9 @@ class WebSocketHandler(tornado.web.RequestHandler):
         self.stream.set_close_callback(self.on_connection_close)
 
         if self.request.headers.get("Sec-WebSocket-Version") in ("7", "8", "13"):
-            self.ws_connection = WebSocketProtocol13(self)
+            self.ws_connection = WebSocketProtocol13(
+                self, compression_options=self.get_compression_options(),
+                max_message_size=self.max_message_size)
             self.ws_connection.accept_connection()
         else:
             self.stream.write(tornado.escape.utf8(
@@ -213,6 +219,42 @@ class WebSocketHandler(tornado.web.RequestHandler):
         """
         return None
 
+    @property
+    def max_message_size(self):
+        """The largest message, in bytes, the client may send.
+
+        A longer message (after decompression, with ``permessage-deflate``)
+        closes the connection with status code 1009 ("message too big").
+        The default is 10MB; set the ``websocket_max_message_size``
+        application setting to change it.
+        """
+        return self.settings.get('websocket_max_message_size',
+                                 _DEFAULT_MAX_MESSAGE_SIZE)
+
+    def get_compression_options(self):
+        """Override to return compression options for the connection.
+
+        If this method returns None (the default), compression will
+        be disabled.  If it returns a dict (even an empty one), the
+        ``permessage-deflate`` extension of RFC 7692 will be enabled
+        when the client offers it.  The dict may contain:
+
+        * ``compression_level``: the zlib compression level, from 0 to 9
+          (default 6).
+        * ``mem_level``: the zlib memory level, from 1 to 9 (default 8).
+        * ``compression_threshold``: messages shorter than this many bytes
+          are sent uncompressed (default 64), since compressing them
+          costs more than it saves.
+        * ``server_no_context_takeover``: if true, the compressor is
+          reset after every message instead of remembering earlier
+          messages.  This uses less memory per connection and lets
+          `BroadcastGroup` compress a message once for all such
+          connections, at some cost in compression ratio.
+        * ``client_no_context_takeover``: if true, ask the client to
+          reset its compressor after every message too.
+        """
+        return None
+
     def open(self):
         """Invoked when a new WebSocket is opened.
 
@@ -383,15 +425,107 @@ class WebSocketProtocol(object):
         self.close()  # let the subclass cleanup
 
 
+class _PerMessageDeflateCompressor(object):
+    """Compresses messages for the ``permessage-deflate`` extension."""
+    def __init__(self, persistent, max_wbits, compression_level=6,
+                 mem_level=8):
+        if max_wbits is None:
+            max_wbits = zlib.MAX_WBITS
+        # zlib can't produce raw deflate streams with an 8-bit window.
+        if not (9 <= max_wbits <= zlib.MAX_WBITS):
+            raise ValueError("Invalid max_wbits value %r; allowed range 9-%d" %
+                             (max_wbits, zlib.MAX_WBITS))
+        self.persistent = persistent
+        # Messages compressed with the same key and without a persistent
+        # context are identical.
+        self.key = (max_wbits, compression_level, mem_level)
+        if persistent:
+            self._compressor = self._create_compressor()
+        else:
+            self._compressor = None
+
+    def _create_compressor(self):
+        max_wbits, compression_level, mem_level = self.key
+        return zlib.compressobj(compression_level, zlib.DEFLATED,
+                                -max_wbits, mem_level)
+
+    def compress(self, data):
+        compressor = self._compressor or self._create_compressor()
+        data = (compressor.compress(data) +
+                compressor.flush(zlib.Z_SYNC_FLUSH))
+        assert data.endswith(b'\x00\x00\xff\xff')
+        return data[:-4]
+
+
+class _MessageTooBigError(Exception):
+    """Raised when a message decompresses to more than the largest
+    message allowed."""
+    pass
+
+
+class _PerMessageDeflateDecompressor(object):
+    """Decompresses messages for the ``permessage-deflate`` extension."""
+    def __init__(self, persistent, max_wbits,
+                 max_message_size=_DEFAULT_MAX_MESSAGE_SIZE):
+        self.max_message_size = max_message_size
+        if max_wbits is None:
+            max_wbits = zlib.MAX_WBITS
+        if not (8 <= max_wbits <= zlib.MAX_WBITS):
+            raise ValueError("Invalid max_wbits value %r; allowed range 8-%d" %
+                             (max_wbits, zlib.MAX_WBITS))
+        # A decompressor with the largest window can read data compressed
+        # with any smaller one, so max_wbits is only validated.
+        if persistent:
+            self._decompressor = self._create_decompressor()
+        else:
+            self._decompressor = None
+
+    def _create_decompressor(self):
+        return zlib.decompressobj(-zlib.MAX_WBITS)
+
+    def decompress(self, data):
+        """Returns the decompressed message, or raises
+        `_MessageTooBigError` without inflating more than one byte
+        past ``max_message_size``.
+        """
+        decompressor = self._decompressor or self._create_decompressor()
+        data = decompressor.decompress(data + b'\x00\x00\xff\xff',
+                                       self.max_message_size + 1)
+        if len(data) > self.max_message_size or decompressor.unconsumed_tail:
+            raise _MessageTooBigError()
+        return data
+
+
 class WebSocketProtocol13(WebSocketProtocol):
     """Implementation of the WebSocket protocol from RFC 6455.
 
     This class supports versions 7 and 8 of the protocol in addition to the
     final version 13.
     """
-    def __init__(self, handler, mask_outgoing=False):
+    # Bit masks for the first byte of a frame.
+    FIN = 0x80
+    RSV1 = 0x40
+    RSV2 = 0x20
+    RSV3 = 0x10
+    RSV_MASK = RSV1 | RSV2 | RSV3
+
+    # Parameters of the permessage-deflate extension that we understand.
+    _DEFLATE_PARAMETERS = frozenset(['server_no_context_takeover',
+                                     'client_no_context_takeover',
+                                     'server_max_window_bits',
+                                     'client_max_window_bits'])
+
+    def __init__(self, handler, mask_outgoing=False,
+                 compression_options=None,
+                 max_message_size=_DEFAULT_MAX_MESSAGE_SIZE):
         WebSocketProtocol.__init__(self, handler)
         self.mask_outgoing = mask_outgoing
+        self._compression_options = compression_options
+        self._max_message_size = max_message_size
+        self._compressor = None
+        self._decompressor = None
+        self._compression_threshold = 0
+        self._message_compressed = False
         self._final_frame = False
         self._frame_opcode = None
         self._masked_frame = None
@@ -444,40 +578,166 @@ class WebSocketProtocol13(WebSocketProtocol):
                 assert selected in subprotocols
                 subprotocol_header = "Sec-WebSocket-Protocol: %s\r\n" % selected
 
+        extension_header = ''
+        if self._compression_options is not None:
+            for ext in self._parse_extensions_header(self.request.headers):
+                if ext[0] != 'permessage-deflate':
+                    continue
+                # Accept the first offer whose parameters we can honour.
+                agreed_parameters = self._accept_deflate_offer(ext[1])
+                if agreed_parameters is not None:
+                    self._create_compressors('server', agreed_parameters)
+                    extension_header = (
+                        "Sec-WebSocket-Extensions: %s\r\n" %
+                        httputil._encode_header('permessage-deflate',
+                                                agreed_parameters))
+                    break
+
         self.stream.write(tornado.escape.utf8(
             "HTTP/1.1 101 Switching Protocols\r\n"
             "Upgrade: websocket\r\n"
             "Connection: Upgrade\r\n"
             "Sec-WebSocket-Accept: %s\r\n"
-            "%s"
-            "\r\n" % (self._challenge_response(), subprotocol_header)))
+            "%s%s"
+            "\r\n" % (self._challenge_response(), subprotocol_header,
+                       extension_header)))
 
         self._run_callback(self.handler.open, *self.handler.open_args,
                            **self.handler.open_kwargs)
         self._receive_frame()
 
-    def _write_frame(self, fin, opcode, data):
+    def _parse_extensions_header(self, headers):
+        extensions = headers.get("Sec-WebSocket-Extensions", '')
+        if extensions:
+            return [httputil._parse_header(e.strip())
+                    for e in extensions.split(',')]
+        return []
+
+    def _accept_deflate_offer(self, offer):
+        """Returns the parameters to accept a client's permessage-deflate
+        offer with, or None if it must be declined.
+        """
+        agreed_parameters = dict(offer)
+        for key, value in offer.items():
+            if key not in self._DEFLATE_PARAMETERS:
+                return None
+            if key.endswith('_max_window_bits') and value is not None:
+                try:
+                    wbits = int(value)
+                except ValueError:
+                    return None
+                # RFC 7692 allows windows of 8 to 15 bits.  We can read
+                # any of them, but zlib can't compress with 8 bits.
+                if key == 'server_max_window_bits':
+                    min_wbits = 9
+                else:
+                    min_wbits = 8
+                if not (min_wbits <= wbits <= zlib.MAX_WBITS):
+                    return None
+        if agreed_parameters.get('client_max_window_bits', '') is None:
+            # The client allows us to limit its window, but we don't need to.
+            del agreed_parameters['client_max_window_bits']
+        if agreed_parameters.get('server_max_window_bits', '') is None:
+            # A server_max_window_bits without a value is malformed; we
+            # use the full window rather than echo it.
+            del agreed_parameters['server_max_window_bits']
+        for key in ('server_no_context_takeover', 'client_no_context_takeover'):
+            if self._compression_options.get(key):
+                agreed_parameters[key] = None
+        return agreed_parameters
+
+    def _process_server_headers(self, headers):
+        """Process the headers sent by the server to this client connection."""
+        for ext in self._parse_extensions_header(headers):
+            if (ext[0] == 'permessage-deflate' and
+                    self._compression_options is not None):
+                self._create_compressors('client', ext[1])
+            else:
+                raise ValueError("unsupported extension %r" % (ext,))
+
+    def _get_compressor_options(self, side, agreed_parameters):
+        """Converts a websocket agreed_parameters set to keyword arguments
+        for our compressor objects.
+        """
+        options = dict(
+            persistent=(side + '_no_context_takeover') not in agreed_parameters)
+        wbits_header = agreed_parameters.get(side + '_max_window_bits', None)
+        if wbits_header is None:
+            options['max_wbits'] = zlib.MAX_WBITS
+        else:
+            options['max_wbits'] = int(wbits_header)
+        return options
+
+    def _create_compressors(self, side, agreed_parameters):
+        for key in agreed_parameters:
+            if key not in self._DEFLATE_PARAMETERS:
+                raise ValueError("unsupported compression parameter %r" % key)
+        other_side = 'client' if (side == 'server') else 'server'
+        compressor_options = self._get_compressor_options(side, agreed_parameters)
+        for key in ('compression_level', 'mem_level'):
+            if key in self._compression_options:
+                compressor_options[key] = self._compression_options[key]
+        self._compressor = _PerMessageDeflateCompressor(**compressor_options)
+        self._decompressor = _PerMessageDeflateDecompressor(
+            max_message_size=self._max_message_size,
+            **self._get_compressor_options(other_side, agreed_parameters))
+        self._compression_threshold = self._compression_options.get(
+            'compression_threshold', 64)
+
+    @staticmethod
+    def _frame_header(fin, opcode, length, mask_bit=0):
+        """Returns the header of a frame carrying ``length`` bytes of data."""
         if fin:
             finbit = 0x80
         else:
             finbit = 0
-        frame = struct.pack("B", finbit | opcode)
-        l = len(data)
-        if self.mask_outgoing:
-            mask_bit = 0x80
-        else:
-            mask_bit = 0
-        if l < 126:
-            frame += struct.pack("B", l | mask_bit)
-        elif l <= 0xFFFF:
-            frame += struct.pack("!BH", 126 | mask_bit, l)
+        if length < 126:
+            return struct.pack("BB", finbit | opcode, length | mask_bit)
+        elif length <= 0xFFFF:
+            return struct.pack("!BBH", finbit | opcode, 126 | mask_bit, length)
         else:
-            frame += struct.pack("!BQ", 127 | mask_bit, l)
+            return struct.pack("!BBQ", finbit | opcode, 127 | mask_bit, length)
+
+    def _format_frame(self, fin, opcode, data, flags=0):
+        """Returns the header and payload of a frame, masked if necessary."""
         if self.mask_outgoing:
             mask = os.urandom(4)
-            data = mask + _websocket_mask(mask, data)
-        frame += data
-        self.stream.write(frame)
+            header = self._frame_header(fin, opcode | flags, len(data), 0x80)
+            return header + mask, _websocket_mask(mask, data)
+        return self._frame_header(fin, opcode | flags, len(data)), data
+
+    def _write_frame(self, fin, opcode, data, flags=0):
+        # The header and data are queued separately so that large
+        # messages are not copied just to prepend a few bytes.
+        self.stream.writev(self._format_frame(fin, opcode, data, flags))
+
+    def _format_message(self, opcode, message, cache=None):
+        """Returns the frame that sends ``message``, compressed if the
+        connection negotiated compression.
+
+        If ``cache`` is given, frames that don't depend on the state of
+        this connection are stored in it, keyed by the compression
+        settings used to make them, and reused.  `BroadcastGroup` shares
+        one cache among all the connections a message is sent to.
+        """
+        compressor = self._compressor
+        if compressor is not None and len(message) < self._compression_threshold:
+            compressor = None
+        key = None
+        if (cache is not None and not self.mask_outgoing and
+                (compressor is None or not compressor.persistent)):
+            key = compressor.key if compressor is not None else ()
+            frame = cache.get(key)
+            if frame is not None:
+                return frame
+        flags = 0
+        if compressor is not None:
+            message = compressor.compress(message)
+            flags = self.RSV1
+        frame = self._format_frame(True, opcode, message, flags)
+        if key is not None:
+            cache[key] = frame
+        return frame
 
     def write_message(self, message, binary=False):
         """Sends the given message to the client of this Web Socket."""
@@ -488,7 +748,7 @@ class WebSocketProtocol13(WebSocketProtocol):
         message = tornado.escape.utf8(message)
         assert isinstance(message, bytes_type)
         try:
-            self._write_frame(True, opcode, message)
+            self.stream.writev(self._format_message(opcode, message))
         except StreamClosedError:
             self._abort()
 
@@ -505,10 +765,15 @@ class WebSocketProtocol13(WebSocketProtocol):
 
     def _on_frame_start(self, data):
         header, payloadlen = struct.unpack("BB", data)
-        self._final_frame = header & 0x80
-        reserved_bits = header & 0x70
+        self._final_frame = header & self.FIN
+        reserved_bits = header & self.RSV_MASK
         self._frame_opcode = header & 0xf
         self._frame_opcode_is_control = self._frame_opcode & 0x8
+        if self._decompressor is not None and self._frame_opcode in (0x1, 0x2):
+            # With permessage-deflate, RSV1 on the first frame of a data
+            # message says whether the whole message is compressed.
+            self._message_compressed = bool(reserved_bits & self.RSV1)
+            reserved_bits &= ~self.RSV1
         if reserved_bits:
             # client is using as-yet-undefined extensions; abort
             self._abort()
@@ -522,10 +787,7 @@ class WebSocketProtocol13(WebSocketProtocol):
         try:
             if payloadlen < 126:
                 self._frame_length = payloadlen
-                if self._masked_frame:
-                    self.stream.read_bytes(4, self._on_masking_key)
-                else:
-                    self.stream.read_bytes(self._frame_length, self._on_frame_data)
+                self._read_frame_payload()
             elif payloadlen == 126:
                 self.stream.read_bytes(2, self._on_frame_length_16)
             elif payloadlen == 127:
@@ -536,23 +798,32 @@ class WebSocketProtocol13(WebSocketProtocol):
     def _on_frame_length_16(self, data):
         self._frame_length = struct.unpack("!H", data)[0]
         try:
-            if self._masked_frame:
-                self.stream.read_bytes(4, self._on_masking_key)
-            else:
-                self.stream.read_bytes(self._frame_length, self._on_frame_data)
+            self._read_frame_payload()
         except StreamClosedError:
             self._abort()
 
     def _on_frame_length_64(self, data):
         self._frame_length = struct.unpack("!Q", data)[0]
         try:
-            if self._masked_frame:
-                self.stream.read_bytes(4, self._on_masking_key)
-            else:
-                self.stream.read_bytes(self._frame_length, self._on_frame_data)
+            self._read_frame_payload()
         except StreamClosedError:
             self._abort()
 
+    def _read_frame_payload(self):
+        """Reads the masking key, if any, and payload of the current frame,
+        unless it would make the message longer than we accept."""
+        message_length = self._frame_length
+        if (not self._frame_opcode_is_control and
+                self._fragmented_message_buffer is not None):
+            message_length += len(self._fragmented_message_buffer)
+        if message_length > self._max_message_size:
+            self.close(1009, "message too big")
+            return
+        if self._masked_frame:
+            self.stream.read_bytes(4, self._on_masking_key)
+        else:
+            self.stream.read_bytes(self._frame_length, self._on_frame_data)
+
     def _on_masking_key(self, data):
         self._frame_mask = data
         try:
@@ -604,6 +875,16 @@ class WebSocketProtocol13(WebSocketProtocol):
         if self.client_terminated:
             return
 
+        if opcode in (0x1, 0x2) and self._message_compressed:
+            try:
+                data = self._decompressor.decompress(data)
+            except _MessageTooBigError:
+                self.close(1009, "message too big")
+                return
+            except zlib.error:
+                self._abort()
+                return
+
         if opcode == 0x1:
             # UTF-8 data
             try:
@@ -658,17 +939,112 @@ class WebSocketProtocol13(WebSocketProtocol):
                 self.stream.io_loop.time() + 5, self._abort)
 
 
+class BroadcastGroup(object):
+    """A set of `WebSocketHandler` connections that are sent the same
+    messages, such as the players in a game or the members of a chat room.
+
+    `broadcast` encodes and frames each message once and queues the same
+    bytes on every connection in the group, instead of repeating that
+    work for each connection as calls to `WebSocketHandler.write_message`
+    would.
+
+    A client that reads more slowly than messages are broadcast makes its
+    connection's write buffer grow.  Once more than
+    ``max_write_buffer_size`` bytes are waiting to be sent on a
+    connection, ``policy`` decides what happens to it:
+
+    * ``BroadcastGroup.DROP`` (the default) skips the connection until
+      its client catches up, so it misses the messages sent meanwhile.
+    * ``BroadcastGroup.DISCONNECT`` closes the connection (with status
+      code 1008) and removes it from the group.
+
+    Connections that have been closed are removed from the group
+    automatically the next time a message is broadcast.
+    """
+    DROP = "drop"
+    DISCONNECT = "disconnect"
+
+    def __init__(self, max_write_buffer_size=1024 * 1024, policy=DROP):
+        if policy not in (self.DROP, self.DISCONNECT):
+            raise ValueError("unknown broadcast policy %r" % (policy,))
+        self.max_write_buffer_size = max_write_buffer_size
+        self.policy = policy
+        self._handlers = set()
+
+    def add(self, handler):
+        """Adds a `WebSocketHandler` to the group."""
+        self._handlers.add(handler)
+
+    def discard(self, handler):
+        """Removes a `WebSocketHandler` from the group, if it is a member."""
+        self._handlers.discard(handler)
+
+    def __contains__(self, handler):
+        return handler in self._handlers
+
+    def __iter__(self):
+        return iter(self._handlers)
+
+    def __len__(self):
+        return len(self._handlers)
+
+    def broadcast(self, message, binary=False):
+        """Sends ``message`` to every connection in the group.
+
+        ``message`` and ``binary`` are interpreted as by
+        `WebSocketHandler.write_message`.  Returns the number of
+        connections the message was queued on.
+        """
+        if isinstance(message, dict):
+            message = tornado.escape.json_encode(message)
+        message = utf8(message)
+        assert isinstance(message, bytes_type)
+        if binary:
+            opcode = 0x2
+        else:
+            opcode = 0x1
+        # Frames already made for this message, by compression settings.
+        frames = {}
+        sent = 0
+        for handler in list(self._handlers):
+            connection = handler.ws_connection
+            if (connection is None or connection.server_terminated or
+                    connection.stream.closed()):
+                self._handlers.discard(handler)
+                continue
+            if connection.stream._write_buffer_size > self.max_write_buffer_size:
+                if self.policy == self.DISCONNECT:
+                    self._handlers.discard(handler)
+                    handler.close(1008, "client is not reading fast enough")
+                continue
+            # Server-side frames are never masked, so the same frame is
+            # valid on every connection with the same compression
+            # settings, unless it keeps a compression context.
+            try:
+                connection.stream.writev(
+                    connection._format_message(opcode, message, frames))
+            except StreamClosedError:
+                self._handlers.discard(handler)
+                connection._abort()
+                continue
+            sent += 1
+        return sent
+
+
 class WebSocketClientConnection(simple_httpclient._HTTPConnection):
     """WebSocket client connection.
 
     This class should not be instantiated directly; use the
     `websocket_connect` function instead.
     """
-    def __init__(self, io_loop, request):
+    def __init__(self, io_loop, request, compression_options=None):
+        self.compression_options = compression_options
         self.connect_future = TracebackFuture()
         self.read_future = None
         self.read_queue = collections.deque()
         self.key = base64.b64encode(os.urandom(16))
+        self.close_code = None
+        self.close_reason = None
 
         scheme, sep, rest = request.url.partition(':')
         scheme = {'ws': 'http', 'wss': 'https'}[scheme]
@@ -679,6 +1055,16 @@ class WebSocketClientConnection(simple_httpclient._HTTPConnection):
             'Sec-WebSocket-Key': self.key,
             'Sec-WebSocket-Version': '13',
         })
+        if self.compression_options is not None:
+            # Always offer to let the server set our max_wbits (and even
+            # though we don't offer it, we will accept a
+            # client_no_context_takeover from the server).
+            offer = {'client_max_window_bits': None}
+            for key in ('server_no_context_takeover', 'client_no_context_takeover'):
+                if self.compression_options.get(key):
+                    offer[key] = None
+            request.headers['Sec-WebSocket-Extensions'] = (
+                httputil._encode_header('permessage-deflate', offer))
 
         self.tcp_client = TCPClient(io_loop=io_loop)
         super(WebSocketClientConnection, self).__init__(
@@ -727,7 +1113,10 @@ class WebSocketClientConnection(simple_httpclient._HTTPConnection):
         accept = WebSocketProtocol13.compute_accept_value(self.key)
         assert self.headers['Sec-Websocket-Accept'] == accept
 
-        self.protocol = WebSocketProtocol13(self, mask_outgoing=True)
+        self.protocol = WebSocketProtocol13(
+            self, mask_outgoing=True,
+            compression_options=self.compression_options)
+        self.protocol._process_server_headers(self.headers)
         self.protocol._receive_frame()
 
         if self._timeout is not None:
@@ -777,12 +1166,16 @@ class WebSocketClientConnection(simple_httpclient._HTTPConnection):
         pass
 
 
-def websocket_connect(url, io_loop=None, callback=None, connect_timeout=None):
+def websocket_connect(url, io_loop=None, callback=None, connect_timeout=None,
+                      compression_options=None):
     """Client-side websocket support.
 
     Takes a url and returns a Future whose result is a
     `WebSocketClientConnection`.
 
+    ``compression_options`` is interpreted in the same way as the
+    return value of `.WebSocketHandler.get_compression_options`.
+
     .. versionchanged:: 3.2
        Also accepts ``HTTPRequest`` objects in place of urls.
     """
@@ -798,7 +1191,8 @@ def websocket_connect(url, io_loop=None, callback=None, connect_timeout=None):
         request = httpclient.HTTPRequest(url, connect_timeout=connect_timeout)
     request = httpclient._RequestProxy(
         request, httpclient.HTTPRequest._DEFAULTS)
-    conn = WebSocketClientConnection(io_loop, request)
+    conn = WebSocketClientConnection(io_loop, request,
+                                     compression_options=compression_options)
     if callback is not None:
         io_loop.add_future(conn.connect_future, callback)
     return conn.connect_future
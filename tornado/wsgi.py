@@ -123,13 +123,14 @@ class _WSGIConnection(httputil.HTTPConnection):
         return _dummy_future
 
     def write(self, chunk, callback=None):
+        chunks = chunk if isinstance(chunk, list) else [chunk]
         if self._expected_content_remaining is not None:
-            self._expected_content_remaining -= len(chunk)
+            self._expected_content_remaining -= sum(len(c) for c in chunks)
             if self._expected_content_remaining < 0:
                 self._error = httputil.HTTPOutputError(
                     "Tried to write more data than Content-Length")
                 raise self._error
-        self._write_buffer.append(chunk)
+        self._write_buffer.extend(chunks)
         if callback is not None:
             callback()
         return _dummy_future
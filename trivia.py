@@ -4,6 +4,8 @@ import argparse
 
 from tornado.ncss import Server
 
+import assets
+
 from handlers.index import index_handler
 from handlers.profile import profile_handler
 from handlers.game import game_handler, get_question_handler, submit_question_handler
@@ -14,18 +16,29 @@ from handlers.user import user_handler
 from handlers.error import error_handler
 from handlers.leaderboard import leaderboard_handler
 from handlers.category import category_handler, category_list_handler
+from handlers.search import search_handler
 from handlers.question import new_question_handler, new_question_form, edit_question_handler
 from handlers.logout import logout_handler
+from handlers.room import GameRoomHandler, room_handler
+from handlers import api
+from db import question_bank
+from db import selection
 
 
-def new_server(port=8888, hostname='', debug=True):
-    server = Server(port=port, hostname=hostname, debug=debug)
+def new_server(port=8888, hostname='', debug=True, preload_static=False):
+    server = Server(port=port, hostname=hostname, static_path=assets.STATIC_PATH,
+                    static_handler_class=assets.StaticAssetHandler, compress_response=True, debug=debug)
+    assets.build(server.static_path, preload=preload_static)
+    if debug or preload_static:
+        assets.watch()
 
     server.register('/', index_handler)
     server.register('/profile', profile_handler)
     server.register(r'/game/([0-9]+)', get_question_handler)
     server.register(r'/game/submit/([0-9]+)', submit_question_handler)
     server.register('/game/create', game_handler)
+    server.register(r'/game/room/([0-9]+)', room_handler)
+    server.register(r'/game/room/([0-9]+)/socket', GameRoomHandler)
     server.register('/pre_game', pre_game_handler)
     server.register('/post_game', post_game_handler)
     server.register('/leaderboard', leaderboard_handler)
@@ -35,7 +48,14 @@ def new_server(port=8888, hostname='', debug=True):
     server.register(r'/category/([0-9]+)', category_handler)
     server.register('/user', user_handler, post=signup_handler_post)
     server.register('/categories', category_list_handler)
+    server.register('/search', search_handler)
     server.register('/logout', logout_handler)
+    server.register(api.API_PREFIX + r'/games', api.method_not_allowed, post=api.create_game_handler)
+    server.register(api.API_PREFIX + r'/games/([0-9]+)', api.game_state_handler)
+    server.register(api.API_PREFIX + r'/games/([0-9]+)/questions', api.questions_handler)
+    server.register(api.API_PREFIX + r'/games/([0-9]+)/question', api.current_question_handler)
+    server.register(api.API_PREFIX + r'/games/([0-9]+)/answers', api.method_not_allowed, post=api.answer_handler)
+    server.register(api.API_PREFIX + r'/games/([0-9]+)/results', api.results_handler)
     server.register(r'/.*', error_handler)
 
     return server
@@ -46,9 +66,16 @@ if __name__ == '__main__':
     parser.add_argument('-p', '--port', type=int, default=8888, help='port to listen on')
     parser.add_argument('-H', '--hostname', default='', help='hostname to bind to')
     parser.add_argument('--prod', action='store_true', default=False, help='turn debug mode off')
+    parser.add_argument('--preload-static', action='store_true', default=False, help='serve static files from memory')
+    parser.add_argument('--shared-cache', metavar='FILE', help='share question indexes with other servers using FILE')
+    parser.add_argument('--question-bank', metavar='FILE', help='read questions from the bank published at FILE when it is up to date')
     args = parser.parse_args()
 
-    server = new_server(port=args.port, hostname=args.hostname, debug=not args.prod)
+    if args.shared_cache:
+        selection.share_indexes(args.shared_cache)
+    if args.question_bank:
+        question_bank.use(args.question_bank)
+    server = new_server(port=args.port, hostname=args.hostname, debug=not args.prod, preload_static=args.preload_static)
     server.run()
 else:
     server = new_server(debug=False)